@@ -1,15 +1,16 @@
+import asyncio
 import json
 import logging
+import threading
 import time
 import requests
 import sys
 import os
 from bs4 import BeautifulSoup
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
-from typing import Optional
-from concurrent.futures import ThreadPoolExecutor
+from pydantic import BaseModel, ConfigDict
+from typing import Dict, List, Optional
 from selenium import webdriver
 from selenium.webdriver.chrome.options import Options
 from selenium.webdriver.common.by import By
@@ -17,19 +18,27 @@ from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
 from selenium.common.exceptions import TimeoutException, WebDriverException
 import re
-from parsers.parsers_ozon_parser import scrape_ozon
-from parsers.parsers_sber_parser import scrape_sbermegamarket
-from parsers.parsers_wb_parser import scrape_wildberries
-
-logging.basicConfig(
-    level=logging.DEBUG,
-    format='%(asctime)s | %(levelname)s | %(module)s:%(lineno)d | %(message)s',
-    datefmt='%Y-%m-%d %H:%M:%S',
-    handlers=[
-        logging.FileHandler("api_debug.log", encoding="utf-8"),
-        logging.StreamHandler(sys.stdout)
-    ]
+from parsers.parsers_registry import enabled_adapters
+from core.products import (
+    SORT_ORDERS, marketplace_for_url, normalize_query, rubles_to_kopecks, select_products
+)
+from core.serialization import columnar_response, wants_columnar
+from core.logsetup import setup_logging
+from core.jobs import JobQueueFull, JobStore
+from core.singleflight import SingleFlight
+from core.urls import product_key
+from core.cache import TTLCache
+from core.hedging import HedgeDelay
+from core.executor import BoundedExecutor, ExecutorFull
+from core.broker import get_broker, scrape_pages
+from core.proxies import BLOCK_STATUSES, PROXY_POOL
+from core.resources import apply_resource_policy, record_page_resources
+from core.metrics import (
+    CHROME_LAUNCH_SECONDS, TIMEOUTS, TITLE_EXTRACTION_SECONDS, TITLE_HEDGES, TITLE_TIER_WINS, metrics_response,
 )
+from core.timing import span, start_timings
+
+setup_logging("api_debug.log", level="DEBUG")
 logger = logging.getLogger(__name__)
 logger.debug("Скрипт запущен, инициализация начата")
 
@@ -41,29 +50,76 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Server-Timing", "Retry-After"],
 )
 
+# Парсеры всех включенных адаптеров; новый маркетплейс добавляется регистрацией в parsers_registry
+PARSERS = {adapter.name: adapter.scrape for adapter in enabled_adapters()}
+MARKETPLACES = tuple(PARSERS)
+
+# Один исполнитель на процесс: ограничивает число одновременно запущенных Chrome
+SCRAPE_EXECUTOR = BoundedExecutor(
+    "scrape",
+    max_workers=int(os.getenv("SCRAPE_MAX_BROWSERS", "6")),
+    max_queue=int(os.getenv("SCRAPE_MAX_QUEUE", "12")),
+)
+# Одинаковые одновременные запросы ждут одну и ту же задачу
+TITLE_FLIGHTS = SingleFlight("title")
+# Selenium стартует параллельно, если requests не ответил за p90 своих успешных ответов
+TITLE_HEDGE = HedgeDelay(
+    default=float(os.getenv("TITLE_HEDGE_DELAY", "3")),
+    percentile=float(os.getenv("TITLE_HEDGE_PERCENTILE", "0.9")),
+    ceiling=10,
+)
+SCRAPE_FLIGHTS = SingleFlight("scrape")
+# local - парсеры в SCRAPE_EXECUTOR этого процесса, broker - страницы выдачи уходят воркерам (worker.py)
+BROKER = get_broker() if os.getenv("SCRAPE_BACKEND", "local") == "broker" else None
+BROKER_TASK_TIMEOUT = float(os.getenv("BROKER_TASK_TIMEOUT", "180"))
+# Названия известных товаров по ключу marketplace:article: пополняется и из выдачи парсеров,
+# поэтому ссылка на товар, уже встречавшийся в поиске, не требует загрузки страницы
+TITLE_INDEX = TTLCache("title_index", ttl=float(os.getenv("TITLE_INDEX_TTL", str(7 * 24 * 3600))), max_size=100_000)
+RESULT_CACHE = TTLCache("scrape_results", ttl=float(os.getenv("SCRAPE_CACHE_TTL", "300")), max_size=1000)
+# Фоновые задачи: не больше JOB_CONCURRENCY одновременно, результаты хранятся JOB_RESULT_TTL секунд
+JOB_STORE = JobStore(
+    max_active=int(os.getenv("JOB_MAX_ACTIVE", "50")),
+    ttl=float(os.getenv("JOB_RESULT_TTL", "3600")),
+)
+JOB_SLOTS = asyncio.Semaphore(int(os.getenv("JOB_CONCURRENCY", "2")))
+JOB_RETRY_SECONDS = 5
+
 class URLRequest(BaseModel):
     url: str
+    min_price: Optional[float] = None
+    max_price: Optional[float] = None
+    marketplaces: Optional[List[str]] = None
+    sort: Optional[str] = None
+    limit: Optional[int] = None
+    include_timings: bool = False
 
 class ScrapeResponse(BaseModel):
-    ozon: list
-    sbermegamarket: list
-    wildberries: list
+    # Списки товаров остальных адаптеров приходят дополнительными полями
+    model_config = ConfigDict(extra="allow")
+
+    ozon: list = []
+    sbermegamarket: list = []
+    wildberries: list = []
+    timings: Optional[dict] = None
+    # Маркетплейсы, выдачу которых воркеры не вернули целиком, и причина
+    errors: Optional[Dict[str, str]] = None
 
 def check_environment():
     logger.debug("Проверка окружения")
     try:
-        logger.info(f"Python version: {sys.version}")
-        logger.info(f"Current directory: {os.getcwd()}")
-        logger.info(f"Python executable: {sys.executable}")
-        logger.info(f"Parser directory exists: {os.path.exists('parsers')}")
+        logger.info("Python version: %s", sys.version)
+        logger.info("Current directory: %s", os.getcwd())
+        logger.info("Python executable: %s", sys.executable)
+        logger.info("Parser directory exists: %s", os.path.exists('parsers'))
         return True
     except Exception as e:
-        logger.error(f"Ошибка проверки окружения: {str(e)}", exc_info=True)
+        logger.error("Ошибка проверки окружения: %s", e, exc_info=True)
         return False
 
-def setup_selenium():
+def setup_selenium(proxy=None):
     logger.debug("Начало настройки Selenium WebDriver")
     options = Options()
     options.add_argument("--headless=new")
@@ -84,10 +140,16 @@ def setup_selenium():
     options.add_experimental_option("excludeSwitches", ["enable-automation"])
     options.add_experimental_option('useAutomationExtension', False)
 
+    if proxy:
+        logger.info("Используется прокси: %s", proxy)
+        options.add_argument(f"--proxy-server={proxy}")
+
     try:
         logger.debug("Инициализация Chrome WebDriver")
-        driver = webdriver.Chrome(options=options)
+        with CHROME_LAUNCH_SECONDS.labels("api").time():
+            driver = webdriver.Chrome(options=options)
         driver.set_page_load_timeout(30)
+        apply_resource_policy(driver, "product_page")
         logger.debug("Установка скрипта для сокрытия WebDriver")
         driver.execute_cdp_cmd("Page.addScriptToEvaluateOnNewDocument", {
             "source": """
@@ -100,7 +162,7 @@ def setup_selenium():
         logger.info("Selenium успешно инициализирован")
         return driver
     except Exception as e:
-        logger.error(f"Ошибка инициализации Selenium: {str(e)}", exc_info=True)
+        logger.error("Ошибка инициализации Selenium: %s", e, exc_info=True)
         return None
 
 def scroll_page(driver):
@@ -117,29 +179,31 @@ def scroll_page(driver):
             last_height = new_height
         logger.info("Прокрутка страницы завершена")
     except Exception as e:
-        logger.error(f"Ошибка при прокрутке страницы: {str(e)}", exc_info=True)
+        logger.error("Ошибка при прокрутке страницы: %s", e, exc_info=True)
 
 def clean_title(title):
-    logger.debug(f"Очистка заголовка: {title}")
+    logger.debug("Очистка заголовка: %s", title)
     if not title:
         logger.warning("Заголовок пустой")
         return None
     title = re.sub(r'\s+', ' ', title.strip())
     title = re.sub(r'[-|].*', '', title).strip()
     cleaned = title if title else None
-    logger.debug(f"Очищенный заголовок: {cleaned}")
+    logger.debug("Очищенный заголовок: %s", cleaned)
     return cleaned
 
+@TITLE_EXTRACTION_SECONDS.labels("selenium").time()
 def extract_title_selenium(driver, url):
-    logger.info(f"Начало извлечения названия через Selenium для URL: {url}")
+    logger.info("Начало извлечения названия через Selenium для URL: %s", url)
     try:
-        logger.debug(f"Загрузка страницы: {url}")
+        logger.debug("Загрузка страницы: %s", url)
         driver.get(url)
         WebDriverWait(driver, 10).until(
             lambda d: d.execute_script("return document.readyState") == "complete"
         )
         logger.debug("Страница загружена")
         scroll_page(driver)
+        record_page_resources(driver, "api", "product_page")
 
         meta_selectors = [
             "meta[property='og:title']",
@@ -149,34 +213,34 @@ def extract_title_selenium(driver, url):
         ]
         for selector in meta_selectors:
             try:
-                logger.debug(f"Поиск мета-тега: {selector}")
+                logger.debug("Поиск мета-тега: %s", selector)
                 meta = driver.find_element(By.CSS_SELECTOR, selector)
                 title = meta.get_attribute("content")
                 if title:
-                    logger.info(f"Название найдено в {selector}: {title}")
+                    logger.info("Название найдено в %s: %s", selector, title)
                     return clean_title(title)
             except:
-                logger.debug(f"Мета-тег {selector} не найден")
+                logger.debug("Мета-тег %s не найден", selector)
                 continue
 
         try:
             logger.debug("Поиск тега <title>")
             title = driver.find_element(By.CSS_SELECTOR, "title").text
             if title:
-                logger.info(f"Название найдено в <title>: {title}")
+                logger.info("Название найдено в <title>: %s", title)
                 return clean_title(title)
         except:
             logger.debug("Тег <title> не найден")
 
         for tag in ["h1", "h2"]:
             try:
-                logger.debug(f"Поиск тега {tag}")
+                logger.debug("Поиск тега %s", tag)
                 header = driver.find_element(By.CSS_SELECTOR, tag).text
                 if header:
-                    logger.info(f"Название найдено в {tag}: {header}")
+                    logger.info("Название найдено в %s: %s", tag, header)
                     return clean_title(header)
             except:
-                logger.debug(f"Тег {tag} не найден")
+                logger.debug("Тег %s не найден", tag)
                 continue
 
         class_selectors = [
@@ -188,13 +252,13 @@ def extract_title_selenium(driver, url):
         ]
         for selector in class_selectors:
             try:
-                logger.debug(f"Поиск по селектору класса: {selector}")
+                logger.debug("Поиск по селектору класса: %s", selector)
                 elem = driver.find_element(By.CSS_SELECTOR, selector).text
                 if elem:
-                    logger.info(f"Название найдено в {selector}: {elem}")
+                    logger.info("Название найдено в %s: %s", selector, elem)
                     return clean_title(elem)
             except:
-                logger.debug(f"Селектор {selector} не найден")
+                logger.debug("Селектор %s не найден", selector)
                 continue
 
         try:
@@ -203,12 +267,12 @@ def extract_title_selenium(driver, url):
             for script in scripts:
                 json_data = json.loads(script.get_attribute("innerHTML"))
                 if isinstance(json_data, dict) and json_data.get("name"):
-                    logger.info(f"Название найдено в JSON-LD: {json_data['name']}")
+                    logger.info("Название найдено в JSON-LD: %s", json_data['name'])
                     return clean_title(json_data["name"])
                 elif isinstance(json_data, list):
                     for item in json_data:
                         if item.get("name"):
-                            logger.info(f"Название найдено в JSON-LD: {item['name']}")
+                            logger.info("Название найдено в JSON-LD: %s", item['name'])
                             return clean_title(item["name"])
         except:
             logger.debug("JSON-LD не найден или некорректен")
@@ -218,7 +282,7 @@ def extract_title_selenium(driver, url):
             elem = driver.find_element(By.XPATH, "//*[contains(@class, 'title') or contains(@class, 'name')]")
             title = elem.text
             if title:
-                logger.info(f"Название найдено через XPath: {title}")
+                logger.info("Название найдено через XPath: %s", title)
                 return clean_title(title)
         except:
             logger.debug("XPath не нашел подходящих элементов")
@@ -226,111 +290,314 @@ def extract_title_selenium(driver, url):
         logger.warning("Название не найдено через Selenium")
         return None
     except TimeoutException as e:
-        logger.error(f"Таймаут при загрузке страницы {url}: {str(e)}", exc_info=True)
+        TIMEOUTS.labels("api", "title_selenium").inc()
+        logger.error("Таймаут при загрузке страницы %s: %s", url, e, exc_info=True)
         return None
     except WebDriverException as e:
-        logger.error(f"Ошибка WebDriver для {url}: {str(e)}", exc_info=True)
+        logger.error("Ошибка WebDriver для %s: %s", url, e, exc_info=True)
         return None
     except Exception as e:
-        logger.error(f"Общая ошибка при извлечении через Selenium: {str(e)}", exc_info=True)
+        logger.error("Общая ошибка при извлечении через Selenium: %s", e, exc_info=True)
         return None
 
+def extract_title_html(html):
+    """Извлечение названия товара из HTML страницы."""
+    soup = BeautifulSoup(html, "html.parser")
+
+    meta_tags = [
+        ("meta[property='og:title']", "content"),
+        ("meta[name='title']", "content"),
+        ("meta[name='twitter:title']", "content"),
+        ("meta[itemprop='name']", "content")
+    ]
+    for selector, attr in meta_tags:
+        try:
+            logger.debug("Поиск мета-тега: %s", selector)
+            tag = soup.select_one(selector)
+            if tag and tag.get(attr):
+                logger.info("Название найдено в %s: %s", selector, tag.get(attr))
+                return clean_title(tag.get(attr))
+        except:
+            logger.debug("Мета-тег %s не найден", selector)
+            continue
+
+    try:
+        logger.debug("Поиск тега <title>")
+        title_tag = soup.select_one("title")
+        if title_tag and title_tag.text:
+            logger.info("Название найдено в <title>: %s", title_tag.text)
+            return clean_title(title_tag.text)
+    except:
+        logger.debug("Тег <title> не найден")
+
+    for tag in ["h1", "h2"]:
+        try:
+            logger.debug("Поиск тега %s", tag)
+            header = soup.select_one(tag)
+            if header and header.text:
+                logger.info("Название найдено в %s: %s", tag, header.text)
+                return clean_title(header.text)
+        except:
+            logger.debug("Тег %s не найден", tag)
+            continue
+
+    class_selectors = [
+        "[class*='product-title']",
+        "[class*='item-title']",
+        "[class*='name']",
+        "[class*='title']",
+        "[class*='product-name']"
+    ]
+    for selector in class_selectors:
+        try:
+            logger.debug("Поиск по селектору класса: %s", selector)
+            elem = soup.select_one(selector)
+            if elem and elem.text:
+                logger.info("Название найдено в %s: %s", selector, elem.text)
+                return clean_title(elem.text)
+        except:
+            logger.debug("Селектор %s не найден", selector)
+            continue
+
+    try:
+        logger.debug("Поиск JSON-LD скриптов")
+        scripts = soup.select("script[type='application/ld+json']")
+        for script in scripts:
+            json_data = json.loads(script.text)
+            if isinstance(json_data, dict) and json_data.get("name"):
+                logger.info("Название найдено в JSON-LD: %s", json_data['name'])
+                return clean_title(json_data["name"])
+            elif isinstance(json_data, list):
+                for item in json_data:
+                    if item.get("name"):
+                        logger.info("Название найдено в JSON-LD: %s", item['name'])
+                        return clean_title(item["name"])
+    except:
+        logger.debug("JSON-LD не найден или некорректен")
+
+    logger.warning("Название не найдено в HTML")
+    return None
+
+@TITLE_EXTRACTION_SECONDS.labels("requests").time()
 def extract_title_requests(url):
-    logger.info(f"Начало извлечения названия через requests для URL: {url}")
+    logger.info("Начало извлечения названия через requests для URL: %s", url)
     headers = {
         "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 "
                       "(KHTML, like Gecko) Chrome/126.0.0.0 Safari/537.36"
     }
+    lease = PROXY_POOL.lease(marketplace_for_url(url) or "other")
     try:
-        logger.debug(f"Отправка HTTP-запроса к {url}")
-        response = requests.get(url, headers=headers, timeout=10)
+        logger.debug("Отправка HTTP-запроса к %s", url)
+        with lease.timed():
+            response = requests.get(url, headers=headers, timeout=10, proxies=lease.requests_proxies)
         response.encoding = "utf-8"  # Force UTF-8 decoding
         response.raise_for_status()
+        lease.record("ok")
         logger.debug("Ответ получен, парсинг HTML")
-        soup = BeautifulSoup(response.text, "html.parser")
+        return extract_title_html(response.text)
+    except requests.exceptions.Timeout as e:
+        TIMEOUTS.labels("api", "title_requests").inc()
+        lease.record("timeout")
+        logger.error("Таймаут HTTP-запроса для %s: %s", url, e, exc_info=True)
+        return None
+    except requests.exceptions.RequestException as e:
+        if getattr(e.response, "status_code", None) in BLOCK_STATUSES:
+            lease.record("captcha")
+        logger.error("Ошибка HTTP-запроса для %s: %s", url, e, exc_info=True)
+        return None
+    except UnicodeDecodeError as e:
+        logger.error("Ошибка декодирования UTF-8 для %s: %s", url, e, exc_info=True)
+        return None
+    except Exception as e:
+        logger.error("Общая ошибка при извлечении через requests: %s", e, exc_info=True)
+        return None
+    finally:
+        lease.release()
 
-        meta_tags = [
-            ("meta[property='og:title']", "content"),
-            ("meta[name='title']", "content"),
-            ("meta[name='twitter:title']", "content"),
-            ("meta[itemprop='name']", "content")
-        ]
-        for selector, attr in meta_tags:
-            try:
-                logger.debug(f"Поиск мета-тега: {selector}")
-                tag = soup.select_one(selector)
-                if tag and tag.get(attr):
-                    logger.info(f"Название найдено в {selector}: {tag.get(attr)}")
-                    return clean_title(tag.get(attr))
-            except:
-                logger.debug(f"Мета-тег {selector} не найден")
-                continue
+def validate_url(request: URLRequest):
+    logger.debug("Проверка URL на корректность")
+    if not request.url.startswith(("http://", "https://")):
+        logger.error("Некорректный URL: отсутствует схема http(s)")
+        raise HTTPException(status_code=400, detail="URL должен начинаться с http:// или https://")
 
+def validate_filters(request: URLRequest):
+    logger.debug("Проверка параметров фильтрации")
+    if request.marketplaces is not None:
+        unknown = [m for m in request.marketplaces if m not in MARKETPLACES]
+        if unknown or not request.marketplaces:
+            logger.error("Неизвестные маркетплейсы: %s", unknown)
+            raise HTTPException(status_code=400, detail=f"marketplaces должен быть подмножеством {list(MARKETPLACES)}")
+    if request.sort is not None and request.sort not in SORT_ORDERS:
+        logger.error("Некорректная сортировка: %s", request.sort)
+        raise HTTPException(status_code=400, detail=f"sort должен быть одним из {list(SORT_ORDERS)}")
+    if request.limit is not None and request.limit <= 0:
+        logger.error("Некорректный limit: %s", request.limit)
+        raise HTTPException(status_code=400, detail="limit должен быть положительным")
+    for value in (request.min_price, request.max_price):
+        if value is not None and value < 0:
+            logger.error("Цены не могут быть отрицательными")
+            raise HTTPException(status_code=400, detail="Цены не могут быть отрицательными")
+    if request.min_price is not None and request.max_price is not None and request.min_price > request.max_price:
+        logger.error("min_price больше max_price")
+        raise HTTPException(status_code=400, detail="min_price не может быть больше max_price")
+
+def extract_title_browser(url, cancelled=None):
+    """cancelled - событие, после которого результат уже не нужен (название нашел requests)."""
+    if cancelled is not None and cancelled.is_set():
+        return None
+    lease = PROXY_POOL.lease(marketplace_for_url(url) or "other")
+    try:
+        with span("title_driver_start"):
+            driver = setup_selenium(lease.chrome_arg)
+        if not driver:
+            return None
         try:
-            logger.debug("Поиск тега <title>")
-            title_tag = soup.select_one("title")
-            if title_tag and title_tag.text:
-                logger.info(f"Название найдено в <title>: {title_tag.text}")
-                return clean_title(title_tag.text)
-        except:
-            logger.debug("Тег <title> не найден")
+            if cancelled is not None and cancelled.is_set():
+                logger.debug("Название уже получено, Selenium не загружает страницу")
+                return None
+            with span("title_selenium"):
+                return extract_title_selenium(driver, url)
+        finally:
+            logger.debug("Закрытие Selenium драйвера")
+            driver.quit()
+    finally:
+        lease.release()
+
+def run_parser(marketplace, title, limit=None):
+    with span(marketplace):
+        return PARSERS[marketplace](title, limit=limit)
+
+def parser_limit(request):
+    """Сколько товаров достаточно собрать парсеру. Сортировке и фильтрам по цене нужна
+    вся выдача, иначе первые limit товаров выдачи уже и есть ответ."""
+    if request.sort or request.min_price is not None or request.max_price is not None:
+        return None
+    return request.limit
 
-        for tag in ["h1", "h2"]:
-            try:
-                logger.debug(f"Поиск тега {tag}")
-                header = soup.select_one(tag)
-                if header and header.text:
-                    logger.info(f"Название найдено в {tag}: {header.text}")
-                    return clean_title(header.text)
-            except:
-                logger.debug(f"Тег {tag} не найден")
-                continue
+def too_busy(error: ExecutorFull) -> HTTPException:
+    logger.warning("Запрос отклонен: %s", error)
+    return HTTPException(status_code=429, detail="Сервер перегружен, повторите запрос позже",
+                         headers={"Retry-After": str(error.retry_after)})
 
-        class_selectors = [
-            "[class*='product-title']",
-            "[class*='item-title']",
-            "[class*='name']",
-            "[class*='title']",
-            "[class*='product-name']"
-        ]
-        for selector in class_selectors:
-            try:
-                logger.debug(f"Поиск по селектору класса: {selector}")
-                elem = soup.select_one(selector)
-                if elem and elem.text:
-                    logger.info(f"Название найдено в {selector}: {elem.text}")
-                    return clean_title(elem.text)
-            except:
-                logger.debug(f"Селектор {selector} не найден")
+async def submit_when_free(fn, *args, label=None):
+    """Для фоновых задач: вместо отказа ждем, пока в исполнителе освободится место."""
+    while True:
+        try:
+            return SCRAPE_EXECUTOR.submit(fn, *args, label=label)
+        except ExecutorFull as e:
+            await asyncio.sleep(min(e.retry_after, JOB_RETRY_SECONDS))
+
+def timed_title_requests(url):
+    start = time.monotonic()
+    title = extract_title_requests(url)
+    if title:
+        TITLE_HEDGE.observe(time.monotonic() - start)
+    return title
+
+async def requests_title(url):
+    with span("title_requests"):
+        return await asyncio.to_thread(timed_title_requests, url)
+
+async def resolve_title(url, wait_for_slot=False):
+    """Hedged-извлечение названия: requests, а если он не ответил за TITLE_HEDGE.delay()
+    или ответил без названия - Selenium. Побеждает первое найденное название,
+    проигравший уровень отменяется."""
+    logger.debug("Попытка извлечения названия через requests")
+    cancelled = threading.Event()
+    tiers = {asyncio.ensure_future(requests_title(url)): "requests"}
+    browser_started = False
+    rejected = None
+    try:
+        while tiers:
+            timeout = None if browser_started else TITLE_HEDGE.delay()
+            done, _ = await asyncio.wait(tiers, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                tier = tiers.pop(task)
+                title = task.result()
+                if title:
+                    TITLE_TIER_WINS.labels(tier).inc()
+                    return title
+            if browser_started:
                 continue
-
+            if done:
+                logger.debug("Название не найдено через requests, переход к Selenium")
+            else:
+                TITLE_HEDGES.inc()
+                logger.info("requests не ответил за %.1f с, параллельно запускаем Selenium", timeout)
+            if wait_for_slot:
+                future = await submit_when_free(extract_title_browser, url, cancelled, label="title")
+            else:
+                try:
+                    future = SCRAPE_EXECUTOR.submit(extract_title_browser, url, cancelled, label="title")
+                except ExecutorFull as e:
+                    if tiers:
+                        # Браузер недоступен, но requests еще может ответить
+                        logger.warning("Нет места для Selenium, ждем ответа requests")
+                        browser_started, rejected = True, e
+                        continue
+                    raise too_busy(e)
+            tiers[asyncio.wrap_future(future)] = "selenium"
+            browser_started = True
+        if rejected is not None:
+            raise too_busy(rejected)
+        TITLE_TIER_WINS.labels("none").inc()
+        return None
+    finally:
+        # Задача в очереди исполнителя снимается, запущенный браузер закрывается до загрузки
+        cancelled.set()
+        for task in tiers:
+            task.cancel()
+
+def index_products(marketplace, products):
+    for product in products:
+        if product.article:
+            TITLE_INDEX.put(f"{marketplace}:{product.article}", product.title)
+
+async def title_for_url(url, wait_for_slot=False):
+    key = product_key(url)
+    title = TITLE_INDEX.get(key)
+    if title:
+        logger.info("Название найдено в индексе известных товаров: %s", key)
+        return title
+    title = await TITLE_FLIGHTS.do(key, lambda: resolve_title(url, wait_for_slot))
+    if title:
+        TITLE_INDEX.put(key, title)
+    return title
+
+async def search_marketplaces(title, marketplaces, limit=None):
+    """Выдача маркетплейсов и ошибки тех, что не были получены целиком (только через брокер)."""
+    key = (normalize_query(title), tuple(sorted(marketplaces)), limit)
+    scraped = RESULT_CACHE.get(key)
+    if scraped is not None:
+        return scraped, {}
+    return await SCRAPE_FLIGHTS.do(key, lambda: scrape_marketplaces(title, marketplaces, limit, key))
+
+async def scrape_marketplaces(title, marketplaces, limit, cache_key):
+    if BROKER is not None:
+        logger.debug("Отправка страниц выдачи воркерам через брокер")
+        outcomes = await asyncio.gather(*(scrape_pages(BROKER, marketplace, title, limit, BROKER_TASK_TIMEOUT)
+                                          for marketplace in marketplaces))
+        results = [products for products, _ in outcomes]
+        errors = {marketplace: error for marketplace, (_, error) in zip(marketplaces, outcomes) if error}
+    else:
+        logger.debug("Отправка парсеров в общий исполнитель")
         try:
-            logger.debug("Поиск JSON-LD скриптов")
-            scripts = soup.select("script[type='application/ld+json']")
-            for script in scripts:
-                json_data = json.loads(script.text)
-                if isinstance(json_data, dict) and json_data.get("name"):
-                    logger.info(f"Название найдено в JSON-LD: {json_data['name']}")
-                    return clean_title(json_data["name"])
-                elif isinstance(json_data, list):
-                    for item in json_data:
-                        if item.get("name"):
-                            logger.info(f"Название найдено в JSON-LD: {item['name']}")
-                            return clean_title(item["name"])
-        except:
-            logger.debug("JSON-LD не найден или некорректен")
+            futures = SCRAPE_EXECUTOR.submit_batch(
+                [(run_parser, (marketplace, title, limit), marketplace) for marketplace in marketplaces]
+            )
+        except ExecutorFull as e:
+            raise too_busy(e)
 
-        logger.warning("Название не найдено через requests")
-        return None
-    except requests.exceptions.RequestException as e:
-        logger.error(f"Ошибка HTTP-запроса для {url}: {str(e)}", exc_info=True)
-        return None
-    except UnicodeDecodeError as e:
-        logger.error(f"Ошибка декодирования UTF-8 для {url}: {str(e)}", exc_info=True)
-        return None
-    except Exception as e:
-        logger.error(f"Общая ошибка при извлечении через requests: {str(e)}", exc_info=True)
-        return None
+        logger.debug("Ожидание результатов парсеров")
+        results = await asyncio.gather(*(asyncio.wrap_future(future) for future in futures))
+        errors = {}
+    scraped = dict(zip(marketplaces, results))
+    for marketplace, products in scraped.items():
+        index_products(marketplace, products)
+    # Пустую и неполную выдачу не кэшируем: она чаще означает блокировку или сбой, чем отсутствие товаров
+    if any(scraped.values()) and not errors:
+        RESULT_CACHE.put(cache_key, scraped)
+    return scraped, errors
 
 @app.get("/health")
 async def health_check():
@@ -338,55 +605,166 @@ async def health_check():
     logger.debug("Отправка ответа: status=healthy")
     return {"status": "healthy", "message": "API is running"}
 
-@app.post("/scrape-products", response_model=ScrapeResponse)
-async def scrape_products(request: URLRequest):
-    """API endpoint для извлечения названия по URL и парсинга товаров."""
-    logger.info(f"Получен запрос на обработку URL: {request.url}")
+@app.get("/metrics")
+async def metrics():
+    return metrics_response()
+
+@app.post("/scrape-products", response_model=ScrapeResponse, response_model_exclude_none=True)
+async def scrape_products(request: URLRequest, http_request: Request, response: Response,
+                          format: Optional[str] = None):
+    """API endpoint для извлечения названия по URL и парсинга товаров.
+
+    format=columnar или Accept: application/vnd.sauce.columnar+json включают колоночный ответ.
+    """
+    logger.info("Получен запрос на обработку URL: %s", request.url)
     start_time = time.time()
+    timings = start_timings()
 
-    logger.debug("Проверка URL на корректность")
-    if not request.url.startswith(("http://", "https://")):
-        logger.error("Некорректный URL: отсутствует схема http(s)")
-        raise HTTPException(status_code=400, detail="URL должен начинаться с http:// или https://")
-        
-    logger.debug("Попытка извлечения названия через requests")
-    title = extract_title_requests(request.url)
-    if not title:
-        logger.debug("Название не найдено через requests, переход к Selenium")
-        driver = setup_selenium()
-        if driver:
-            try:
-                title = extract_title_selenium(driver, request.url)
-            finally:
-                logger.debug("Закрытие Selenium драйвера")
-                driver.quit()
-        if not title:
-            logger.error("Не удалось извлечь название из URL")
-            raise HTTPException(status_code=400, detail="Не удалось извлечь название товара из URL")
-
-    logger.info(f"Извлеченное название: {title}")
-
-    logger.debug("Запуск парсеров в многопоточном режиме")
-    with ThreadPoolExecutor(max_workers=3) as executor:
-        logger.debug("Отправка задачи для Ozon")
-        ozon_future = executor.submit(scrape_ozon, title)
-        logger.debug("Отправка задачи для SberMegaMarket")
-        sber_future = executor.submit(scrape_sbermegamarket, title)
-        logger.debug("Отправка задачи для Wildberries")
-        wb_future = executor.submit(scrape_wildberries, title)
+    validate_url(request)
+    if format not in (None, "columnar", "json"):
+        logger.error("Некорректный формат ответа: %s", format)
+        raise HTTPException(status_code=400, detail="format должен быть columnar или json")
+    validate_filters(request)
+    marketplaces = list(dict.fromkeys(request.marketplaces or MARKETPLACES))
 
-        logger.debug("Ожидание результатов парсеров")
-        results = {
-            "ozon": ozon_future.result(),
-            "sbermegamarket": sber_future.result(),
-            "wildberries": wb_future.result()
-        }
-        logger.debug(f"Результаты получены: Ozon={len(results['ozon'])}, "
-                     f"Sber={len(results['sbermegamarket'])}, WB={len(results['wildberries'])}")
-
-    logger.info(f"Общее время обработки: {time.time() - start_time:.2f} секунд")
+    title = await title_for_url(request.url)
+    if not title:
+        logger.error("Не удалось извлечь название из URL")
+        raise HTTPException(status_code=400, detail="Не удалось извлечь название товара из URL")
+
+    logger.info("Извлеченное название: %s", title)
+
+    # Результаты парсеров общие, фильтры и сортировка применяются к каждому запросу отдельно
+    scraped, errors = await search_marketplaces(title, marketplaces, parser_limit(request))
+    if errors and all(marketplace in errors and not scraped[marketplace] for marketplace in marketplaces):
+        reasons = "; ".join(f"{marketplace}: {reason}" for marketplace, reason in errors.items())
+        logger.error("Выдача не получена ни с одного маркетплейса: %s", reasons)
+        raise HTTPException(status_code=502, detail=f"Выдача не получена ни с одного маркетплейса: {reasons}")
+
+    min_price = rubles_to_kopecks(request.min_price)
+    max_price = rubles_to_kopecks(request.max_price)
+    selected = {
+        marketplace: select_products(scraped.get(marketplace, []), min_price, max_price,
+                                     request.sort, request.limit)
+        for marketplace in MARKETPLACES
+    }
+    logger.debug("Результаты получены: %s",
+                 ", ".join(f"{marketplace}={len(products)}" for marketplace, products in selected.items()))
+
+    timings.add("total", time.time() - start_time)
+    logger.info("Общее время обработки: %.2f секунд", time.time() - start_time)
+    headers = {"Server-Timing": timings.server_timing()}
+    if wants_columnar(http_request.headers.get("accept"), format):
+        logger.debug("Отправка ответа в колоночном формате")
+        return columnar_response(selected, http_request.headers.get("accept-encoding"), headers,
+                                 timings.as_dict() if request.include_timings else None, errors)
+    response.headers.update(headers)
+    results = {marketplace: [product.to_dict() for product in products]
+               for marketplace, products in selected.items()}
+    if request.include_timings:
+        results["timings"] = timings.as_dict()
+    if errors:
+        results["errors"] = errors
     return results
 
+def run_job_parser(job, marketplace):
+    job.progress[marketplace] = "running"
+    try:
+        job.results[marketplace] = run_parser(marketplace, job.title, parser_limit(job.request))
+        index_products(marketplace, job.results[marketplace])
+        job.progress[marketplace] = "done"
+    except Exception as e:
+        logger.error("Ошибка парсера %s в задаче %s: %s", marketplace, job.id, e, exc_info=True)
+        job.errors[marketplace] = str(e)
+        job.progress[marketplace] = "failed"
+
+async def run_job_parser_remote(job, marketplace):
+    job.progress[marketplace] = "running"
+    products, error = await scrape_pages(BROKER, marketplace, job.title, parser_limit(job.request),
+                                         BROKER_TASK_TIMEOUT)
+    job.results[marketplace] = products
+    index_products(marketplace, products)
+    if error:
+        # Со страницами, полученными до сбоя, маркетплейс все же считается обработанным
+        job.errors[marketplace] = error
+    job.progress[marketplace] = "failed" if error and not products else "done"
+
+async def run_job(job):
+    status, error = "failed", None
+    try:
+        async with JOB_SLOTS:
+            job.status = "running"
+            job.title = await title_for_url(job.url, wait_for_slot=True)
+            if not job.title:
+                error = "Не удалось извлечь название товара из URL"
+                return
+            logger.info("Задача %s: извлеченное название %s", job.id, job.title)
+            if BROKER is not None:
+                await asyncio.gather(*(run_job_parser_remote(job, marketplace) for marketplace in job.marketplaces))
+            else:
+                futures = [await submit_when_free(run_job_parser, job, marketplace, label=marketplace)
+                           for marketplace in job.marketplaces]
+                await asyncio.gather(*(asyncio.wrap_future(future) for future in futures))
+            if any(state == "done" for state in job.progress.values()):
+                status = "done"
+            else:
+                error = "Ни один парсер не завершился успешно"
+                if job.errors:
+                    error += ": " + "; ".join(f"{marketplace}: {reason}" for marketplace, reason in job.errors.items())
+    except HTTPException as e:
+        # Задача присоединилась к извлечению названия синхронного запроса, которому отказал исполнитель
+        retry_after = (e.headers or {}).get("Retry-After")
+        error = f"{e.detail} (через {retry_after} с)" if retry_after else str(e.detail)
+        logger.warning("Задача %s отклонена: %s", job.id, error)
+    except Exception as e:
+        logger.error("Ошибка выполнения задачи %s: %s", job.id, e, exc_info=True)
+        error = str(e)
+    finally:
+        JOB_STORE.finish(job, status, error)
+
+def job_response(job):
+    request = job.request
+    min_price = rubles_to_kopecks(request.min_price)
+    max_price = rubles_to_kopecks(request.max_price)
+    return {
+        "id": job.id,
+        "status": job.status,
+        "url": job.url,
+        "title": job.title,
+        "progress": job.progress,
+        "errors": job.errors,
+        "results": {
+            marketplace: [product.to_dict() for product in select_products(
+                products, min_price, max_price, request.sort, request.limit)]
+            for marketplace, products in list(job.results.items())
+        },
+        "error": job.error,
+        "created_at": job.created_at,
+        "finished_at": job.finished_at,
+    }
+
+@app.post("/scrape-jobs", status_code=202)
+async def create_scrape_job(request: URLRequest):
+    """Ставит парсинг в очередь и сразу возвращает id задачи для опроса через GET /scrape-jobs/{id}."""
+    logger.info("Получен запрос на создание задачи для URL: %s", request.url)
+    validate_url(request)
+    validate_filters(request)
+    marketplaces = list(dict.fromkeys(request.marketplaces or MARKETPLACES))
+    try:
+        job = JOB_STORE.create(request.url, request, marketplaces)
+    except JobQueueFull as e:
+        logger.warning("Очередь задач заполнена: %s", e)
+        raise too_busy(ExecutorFull(SCRAPE_EXECUTOR.retry_after()))
+    job.task = asyncio.create_task(run_job(job))
+    return {"id": job.id, "status": job.status}
+
+@app.get("/scrape-jobs/{job_id}")
+async def get_scrape_job(job_id: str):
+    job = JOB_STORE.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Задача не найдена или ее результаты устарели")
+    return job_response(job)
+
 if __name__ == "__main__":
     try:
         logger.debug("Начало выполнения основного блока")
@@ -397,5 +775,5 @@ if __name__ == "__main__":
         logger.info("Запуск FastAPI сервера на http://0.0.0.0:8000")
         uvicorn.run(app, host="0.0.0.0", port=8000, log_level="debug")
     except Exception as e:
-        logger.error(f"Критическая ошибка при запуске: {str(e)}", exc_info=True)
+        logger.error("Критическая ошибка при запуске: %s", e, exc_info=True)
         sys.exit(1)
@@ -0,0 +1,233 @@
+"""Офлайн-бенчмарк парсеров на сохраненных страницах выдачи.
+
+Запуск из каталога api:
+    python -m bench.bench_parsers --repeat 3 --output bench/results/run.json
+    python -m bench.bench_parsers --baseline bench/results/run.json
+    python -m bench.bench_parsers --resource-policies none default
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import resource
+import sys
+import threading
+import time
+from datetime import datetime
+
+# Меряем только парсеры: без общего с сервисами состояния регуляторов, без прокси и без
+# ожидания ответов API, которых в сохраненных страницах нет. Задается до импорта core и parsers
+os.environ["THROTTLE_STATE_URL"] = "memory"
+os.environ["SEARCH_EXTRACTION"] = "dom"
+os.environ["PROXIES"] = ""
+os.environ.pop("PROXY_FILE", None)
+
+from prometheus_client import REGISTRY
+from selenium.webdriver.remote.webdriver import WebDriver
+
+from bench.server import PAGES_DIR, serve_pages
+from core.logsetup import setup_logging
+from core.resources import get_policy
+from core.throttle import ThrottleConfig, configure_throttle
+from parsers.parsers_ozon_parser import scrape_ozon
+from parsers.parsers_sber_parser import scrape_sbermegamarket
+from parsers.parsers_wb_parser import scrape_wildberries
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+logger = logging.getLogger(__name__)
+
+PARSERS = {
+    "ozon": scrape_ozon,
+    "wildberries": scrape_wildberries,
+    "sbermegamarket": scrape_sbermegamarket,
+}
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+# Локальный сервер не блокирует: паузы между переходами не нужны
+BENCH_THROTTLE = ThrottleConfig(initial_delay=0, min_delay=0, jitter=0)
+
+
+class RoundTripCounter:
+    """Считает команды WebDriver: каждая проходит через WebDriver.execute."""
+
+    def __init__(self):
+        self.count = 0
+        self._lock = threading.Lock()
+        self._original = WebDriver.execute
+
+    def __enter__(self):
+        counter = self
+        original = self._original
+
+        def execute(driver, *args, **kwargs):
+            with counter._lock:
+                counter.count += 1
+            return original(driver, *args, **kwargs)
+
+        WebDriver.execute = execute
+        return self
+
+    def __exit__(self, *exc):
+        WebDriver.execute = self._original
+
+
+class PeakRSS:
+    """Пиковый RSS процесса вместе с дочерними (chromedriver, Chrome) при наличии psutil."""
+
+    def __init__(self, interval: float = 0.1):
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _sample(self) -> int:
+        process = psutil.Process()
+        total = process.memory_info().rss
+        for child in process.children(recursive=True):
+            try:
+                total += child.memory_info().rss
+            except psutil.Error:
+                continue
+        return total
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.peak = max(self.peak, self._sample())
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        if psutil is not None:
+            self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        if psutil is not None:
+            self._stop.set()
+            self._thread.join()
+        else:
+            # Без psutil доступен только пик собственного процесса (в КБ на Linux)
+            self.peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def page_resource_totals(name: str) -> tuple:
+    """Накопленные объем, время загрузки и число страниц из метрик core.resources."""
+    labels = {"marketplace": name, "policy": get_policy(name).name}
+    return tuple(
+        REGISTRY.get_sample_value(sample, labels) or 0.0
+        for sample in ("sauce_page_transfer_bytes_sum", "sauce_page_load_seconds_sum", "sauce_page_transfer_bytes_count")
+    )
+
+
+def run_parser(name: str, query: str, base_url: str) -> dict:
+    bytes_before, load_before, pages_before = page_resource_totals(name)
+    with RoundTripCounter() as round_trips, PeakRSS() as rss:
+        start = time.perf_counter()
+        products = PARSERS[name](query, base_url=base_url)
+        wall = time.perf_counter() - start
+    bytes_after, load_after, pages_after = page_resource_totals(name)
+    pages = pages_after - pages_before
+    return {
+        "wall_seconds": round(wall, 3),
+        "webdriver_round_trips": round_trips.count,
+        "products": len(products),
+        "products_per_second": round(len(products) / wall, 2) if wall else 0.0,
+        "peak_rss_mb": round(rss.peak / 2 ** 20, 1),
+        "transfer_kb_per_page": round((bytes_after - bytes_before) / pages / 1024, 1) if pages else 0.0,
+        "page_load_ms": round((load_after - load_before) / pages * 1000, 1) if pages else 0.0,
+    }
+
+
+def summarize(runs: list) -> dict:
+    keys = runs[0].keys()
+    return {key: round(sorted(run[key] for run in runs)[len(runs) // 2], 3) for key in keys}
+
+
+def policy_savings(report: dict, parsers: list, policies: list) -> dict:
+    """Сэкономленный трафик и время загрузки относительно прогона без блокировки."""
+    savings = {}
+    for name in parsers:
+        base = report["parsers"].get(f"{name}[none]")
+        if not base:
+            continue
+        for policy in policies:
+            current = report["parsers"].get(f"{name}[{policy}]")
+            if policy == "none" or not current:
+                continue
+            savings[f"{name}[{policy}]"] = {
+                "transfer_kb_saved_per_page": round(
+                    base["median"]["transfer_kb_per_page"] - current["median"]["transfer_kb_per_page"], 1),
+                "page_load_ms_saved": round(base["median"]["page_load_ms"] - current["median"]["page_load_ms"], 1),
+            }
+    return savings
+
+
+def compare(current: dict, baseline: dict):
+    for name, summary in current["parsers"].items():
+        base = baseline.get("parsers", {}).get(name)
+        if not base:
+            continue
+        for key, value in summary["median"].items():
+            old = base["median"].get(key)
+            if old:
+                print(f"{name:15} {key:24} {old:>10} -> {value:>10} ({(value - old) / old * 100:+.1f}%)")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--query", default="iphone 15")
+    parser.add_argument("--pages-dir", default=PAGES_DIR)
+    parser.add_argument("--parsers", nargs="+", choices=list(PARSERS), default=list(PARSERS))
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument("--output", help="JSON-файл с результатами (по умолчанию bench/results/parsers-<время>.json)")
+    parser.add_argument("--baseline", help="JSON-файл предыдущего прогона для сравнения")
+    parser.add_argument("--resource-policies", nargs="+", choices=["default", "none"],
+                        help="Прогнать парсеры с каждой политикой блокировки ресурсов (RESOURCE_POLICY)")
+    args = parser.parse_args(argv)
+
+    setup_logging("bench.log", level="WARNING")
+
+    for name in PARSERS:
+        configure_throttle(name, BENCH_THROTTLE)
+    server, base_url = serve_pages(args.pages_dir)
+    report = {
+        "started_at": datetime.now().isoformat(timespec="seconds"),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "query": args.query,
+        "repeat": args.repeat,
+        "rss_source": "psutil (process tree)" if psutil else "ru_maxrss (self)",
+        "parsers": {},
+    }
+    policies = args.resource_policies or [None]
+    try:
+        for policy in policies:
+            if policy:
+                os.environ["RESOURCE_POLICY"] = policy
+            for name in args.parsers:
+                key = f"{name}[{policy}]" if policy else name
+                runs = [run_parser(name, args.query, base_url) for _ in range(args.repeat)]
+                report["parsers"][key] = {"runs": runs, "median": summarize(runs)}
+                print(f"{key}: {report['parsers'][key]['median']}")
+    finally:
+        server.shutdown()
+    if args.resource_policies:
+        report["resource_policy_savings"] = policy_savings(report, args.parsers, args.resource_policies)
+        print(f"resource_policy_savings: {report['resource_policy_savings']}")
+
+    output = args.output or os.path.join(RESULTS_DIR, f"parsers-{datetime.now():%Y%m%d-%H%M%S}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"Результаты сохранены в {output}")
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            compare(report, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
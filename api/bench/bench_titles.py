@@ -0,0 +1,159 @@
+"""Микробенчмарк извлечения названия по корпусу страниц товаров.
+
+Запуск из каталога api:
+    python -m bench.bench_titles --repeat 50
+    python -m bench.bench_titles --pad-to-mb 3 --output bench/results/titles.json
+
+Корпус: bench/corpus/titles/*.html и expected.json с ожидаемыми названиями. Страницы -
+написанные вручную шаблоны с тем же расположением названия, что у маркетплейсов
+(<title>, og:title, JSON-LD, h1), по несколько сотен байт. Сохраненные страницы весят
+1-3 МБ, в основном за счет встроенного JSON состояния и карточек рекомендаций, поэтому
+по умолчанию шаблоны дополняются такой разметкой до --pad-to-mb 1.5 МБ;
+--pad-to-mb 0 меряет сами шаблоны.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+from app import clean_title, extract_title_html
+
+CORPUS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "corpus", "titles")
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+
+DEFAULT_PAD_MB = 1.5
+# Доля дополнения, которая приходится на встроенный JSON состояния страницы в <head>
+STATE_SHARE = 0.6
+# Блок разметки карточки-рекомендации для увеличения страницы до реального размера
+FILLER = (
+    '<div class="tile-root"><a href="/product/item-{n}/"><img src="/img/{n}.jpg"></a>'
+    '<span class="tsBody500Medium">Похожий товар {n}</span>'
+    '<span class="tsHeadline500Medium">{n} ₽</span></div>\n'
+)
+
+
+def state_script(size: int) -> str:
+    """Встроенный JSON состояния приложения, как window.__NUXT__ или __NEXT_DATA__ маркетплейсов."""
+    items, length, n = [], 0, 0
+    while length < size:
+        item = {"id": 100000 + n, "name": f"Похожий товар {n}", "price": {"value": 1000 + n, "currency": "RUB"},
+                "images": [f"https://cdn.example/img/{n}-{i}.jpg" for i in range(3)], "rating": 4.5, "reviews": n}
+        length += len(json.dumps(item, ensure_ascii=False)) + 1
+        items.append(item)
+        n += 1
+    return f'<script>window.__STATE__ = {json.dumps({"recommendations": items}, ensure_ascii=False)};</script>\n'
+
+
+def pad_page(html: str, pad_to_mb: float) -> str:
+    budget = int(pad_to_mb * 2 ** 20) - len(html)
+    if budget <= 0:
+        return html
+    html = html.replace("</head>", state_script(int(budget * STATE_SHARE)) + "</head>")
+    filler, length, n = [], len(html), 0
+    while length < pad_to_mb * 2 ** 20:
+        tile = FILLER.format(n=n)
+        filler.append(tile)
+        length += len(tile)
+        n += 1
+    return html.replace("</body>", "".join(filler) + "</body>")
+
+
+def load_corpus(corpus_dir: str, pad_to_mb: float = DEFAULT_PAD_MB):
+    with open(os.path.join(corpus_dir, "expected.json"), encoding="utf-8") as f:
+        expected = json.load(f)
+    pages = {}
+    for name in sorted(expected):
+        with open(os.path.join(corpus_dir, name), encoding="utf-8") as f:
+            html = f.read()
+        pages[name] = pad_page(html, pad_to_mb) if pad_to_mb else html
+    return pages, expected
+
+
+def percentile(values, q):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+
+def bench_page(html: str, repeat: int) -> dict:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        title = extract_title_html(html)
+        timings.append(time.perf_counter() - start)
+
+    # Аллокации меряем отдельным прогоном: tracemalloc заметно замедляет выполнение
+    tracemalloc.start()
+    extract_title_html(html)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        "title": title,
+        "size_kb": round(len(html.encode("utf-8")) / 1024, 1),
+        "p50_ms": round(percentile(timings, 0.5) * 1000, 3),
+        "p95_ms": round(percentile(timings, 0.95) * 1000, 3),
+        "peak_alloc_kb": round(peak / 1024, 1),
+    }
+
+
+def bench_clean_title(titles, repeat: int) -> dict:
+    timings = []
+    for _ in range(repeat):
+        for title in titles:
+            start = time.perf_counter()
+            clean_title(title)
+            timings.append(time.perf_counter() - start)
+    return {
+        "p50_us": round(percentile(timings, 0.5) * 1e6, 2),
+        "p95_us": round(percentile(timings, 0.95) * 1e6, 2),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--corpus", default=CORPUS_DIR)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--pad-to-mb", type=float, default=DEFAULT_PAD_MB,
+                        help="Дополнить каждую страницу разметкой до указанного размера (0 - без дополнения)")
+    parser.add_argument("--output", help="JSON-файл с результатами")
+    args = parser.parse_args(argv)
+
+    pages, expected = load_corpus(args.corpus, args.pad_to_mb)
+    report = {
+        "started_at": datetime.now().isoformat(timespec="seconds"),
+        "python": sys.version.split()[0],
+        "repeat": args.repeat,
+        "pad_to_mb": args.pad_to_mb,
+        "pages": {},
+    }
+    mismatches = []
+    for name, html in pages.items():
+        result = bench_page(html, args.repeat)
+        result["ok"] = result["title"] == expected[name]
+        if not result["ok"]:
+            mismatches.append(name)
+        report["pages"][name] = result
+        print(f"{name:32} {result['size_kb']:>9} KB  p50 {result['p50_ms']:>9} ms  "
+              f"p95 {result['p95_ms']:>9} ms  peak {result['peak_alloc_kb']:>9} KB  "
+              f"{'ok' if result['ok'] else 'MISMATCH: ' + repr(result['title'])}")
+    report["clean_title"] = bench_clean_title(list(expected.values()), args.repeat)
+    print(f"clean_title: {report['clean_title']}")
+
+    output = args.output or os.path.join(RESULTS_DIR, f"titles-{datetime.now():%Y%m%d-%H%M%S}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"Результаты сохранены в {output}")
+
+    if mismatches:
+        print(f"Названия не совпали с ожидаемыми: {', '.join(mismatches)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
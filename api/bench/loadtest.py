@@ -0,0 +1,254 @@
+"""Нагрузочный тест API с заглушками вместо парсеров, Appwrite и Telegram.
+
+Запуск из каталога api:
+    python -m bench.loadtest scrape --concurrency 20 --requests 100 --latency 2
+    python -m bench.loadtest track --concurrency 50 --requests 500 --latency 0.5
+    python -m bench.loadtest alert --concurrency 50 --requests 500 --latency 0.2
+
+Заглушки блокируют поток на --latency секунд так же, как реальные Selenium,
+requests и Appwrite SDK, поэтому блокировки event loop видны в метрике лага.
+Каждый запрос идет за своим товаром, чтобы кэши и объединение одинаковых запросов
+не отвечали вместо заглушек; --same-url измеряет как раз их.
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+import httpx
+import uvicorn
+
+from core.products import Product
+
+
+def blocking_stub(latency: float, result):
+    def stub(*args, **kwargs):
+        time.sleep(latency)
+        return result(*args, **kwargs) if callable(result) else result
+    return stub
+
+
+def async_stub(latency: float, result):
+    """Заглушка асинхронной операции (браузер через CDP): ждет, не блокируя event loop."""
+    async def stub(*args, **kwargs):
+        await asyncio.sleep(latency)
+        return result
+    return stub
+
+
+class FakeDatabases:
+    """Заглушка Appwrite Databases с задержкой на запись."""
+
+    def __init__(self, latency: float):
+        self.latency = latency
+
+    def create_document(self, **kwargs):
+        time.sleep(self.latency)
+        return {"$id": "stub"}
+
+    def get_collection(self, **kwargs):
+        return {}
+
+    def list_documents(self, **kwargs):
+        return {"total": 0, "documents": []}
+
+    def list_attributes(self, **kwargs):
+        return {"attributes": [{"key": key} for key in ("user_id", "url", "date", "time", "price", "title", "target_price")]}
+
+
+def start_telegram_stub(latency: float) -> str:
+    """Локальный сервер вместо api.telegram.org и хостинга картинок."""
+
+    class TelegramStubHandler(BaseHTTPRequestHandler):
+        def _reply(self, content_type: str, body: bytes):
+            time.sleep(latency)
+            self.send_response(200)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            if self.command != "HEAD":
+                self.wfile.write(body)
+
+        def do_HEAD(self):
+            self._reply("image/jpeg", b"")
+
+        def do_POST(self):
+            self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            self._reply("application/json", b'{"ok": true, "result": {}}')
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), TelegramStubHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{server.server_address[1]}"
+
+
+def product_url(i: int) -> str:
+    return f"https://www.ozon.ru/product/test-{100000 + i}/"
+
+
+def title_stub(url: str) -> str:
+    return f"Тестовый товар {url.rstrip('/').rsplit('-', 1)[-1]}"
+
+
+def prepare_service(service: str, latency: float):
+    """Импортирует приложение сервиса, подменяет внешние зависимости и строит
+    функцию, возвращающую тело i-го запроса."""
+    if service == "scrape":
+        import app as module
+        products = [Product("ozon", f"Тестовый товар {i}", 100000 + i * 100, link=f"https://example.com/{i}")
+                    for i in range(40)]
+        module.extract_title_requests = blocking_stub(latency * 0.1, title_stub)
+        module.PARSERS = {marketplace: blocking_stub(latency, lambda *args, **kwargs: list(products))
+                          for marketplace in module.PARSERS}
+        return module.app, "/scrape-products", lambda i: {"url": product_url(i)}
+    if service == "track":
+        # Реестр экземпляров - локальный файл: Appwrite подменяется уже после импорта трекера
+        os.environ.setdefault("TRACKER_REGISTRY_URL",
+                              f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'tracker_members.sqlite3')}")
+        from tracker import trackerapi as module
+        module.extract_price = async_stub(latency, 1299.0)
+        module.extract_title_requests = blocking_stub(latency * 0.1, title_stub)
+        module.extract_title_selenium = blocking_stub(latency, title_stub)
+        module.databases = FakeDatabases(latency * 0.1)
+        return module.app, "/track-price", lambda i: {"url": product_url(i), "user_id": "loadtest"}
+    if service == "alert":
+        from tbot import telegramnontify as module
+        stub_url = start_telegram_stub(latency)
+        module.TELEGRAM_API_URL = f"{stub_url}/botTOKEN"
+        return module.app, "/send-telegram-alert", lambda i: {
+            "username": "loadtest", "old_price": 1500, "new_price": 1299,
+            "url": product_url(i), "image": f"{stub_url}/image.jpg",
+            "userid": "1", "email": "loadtest@example.com",
+        }
+    raise ValueError(f"Неизвестный сервис: {service}")
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+class ServerThread:
+    """uvicorn в отдельном потоке со своим event loop и замером его лага."""
+
+    def __init__(self, app, port: int, interval: float = 0.01):
+        self.server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+        self.interval = interval
+        self.lags = []
+        self.thread = threading.Thread(target=lambda: asyncio.run(self._main()), daemon=True)
+
+    async def _monitor_lag(self):
+        loop = asyncio.get_running_loop()
+        while not self.server.should_exit:
+            start = loop.time()
+            await asyncio.sleep(self.interval)
+            self.lags.append(max(0.0, loop.time() - start - self.interval))
+
+    async def _main(self):
+        monitor = asyncio.create_task(self._monitor_lag())
+        await self.server.serve()
+        monitor.cancel()
+
+    def __enter__(self):
+        self.thread.start()
+        while not self.server.started:
+            time.sleep(0.05)
+        return self
+
+    def __exit__(self, *exc):
+        self.server.should_exit = True
+        self.thread.join(timeout=10)
+
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+
+async def drive(url: str, payload, concurrency: int, total: int, timeout: float):
+    latencies, statuses = [], {}
+    remaining = iter(range(total))
+
+    async def client_loop(client):
+        for i in remaining:
+            start = time.perf_counter()
+            try:
+                response = await client.post(url, json=payload(i))
+                status = str(response.status_code)
+            except httpx.HTTPError as e:
+                status = type(e).__name__
+            latencies.append(time.perf_counter() - start)
+            statuses[status] = statuses.get(status, 0) + 1
+
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(timeout=timeout, limits=limits) as client:
+        start = time.perf_counter()
+        await asyncio.gather(*(client_loop(client) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+    return latencies, statuses, elapsed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("service", choices=["scrape", "track", "alert"])
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--requests", type=int, default=100)
+    parser.add_argument("--latency", type=float, default=1.0, help="Задержка заглушек, секунды")
+    parser.add_argument("--timeout", type=float, default=600.0)
+    parser.add_argument("--same-url", action="store_true",
+                        help="Все запросы за одним товаром: измеряет кэши и объединение запросов")
+    parser.add_argument("--output", help="JSON-файл с результатами")
+    args = parser.parse_args(argv)
+
+    app, path, payload = prepare_service(args.service, args.latency)
+    if args.same_url:
+        make_payload = payload
+        payload = lambda i: make_payload(0)
+    port = free_port()
+    with ServerThread(app, port) as server:
+        latencies, statuses, elapsed = asyncio.run(
+            drive(f"http://127.0.0.1:{port}{path}", payload, args.concurrency, args.requests, args.timeout)
+        )
+
+    report = {
+        "started_at": datetime.now().isoformat(timespec="seconds"),
+        "service": args.service,
+        "concurrency": args.concurrency,
+        "requests": args.requests,
+        "stub_latency_seconds": args.latency,
+        "same_url": args.same_url,
+        "elapsed_seconds": round(elapsed, 3),
+        "throughput_rps": round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+        "statuses": statuses,
+        "latency_ms": {
+            name: round(percentile(latencies, q) * 1000, 1)
+            for name, q in (("p50", 0.5), ("p90", 0.9), ("p99", 0.99), ("max", 1.0))
+        },
+        "event_loop_lag_ms": {
+            name: round(percentile(server.lags, q) * 1000, 1)
+            for name, q in (("p50", 0.5), ("p99", 0.99), ("max", 1.0))
+        },
+    }
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,65 @@
+import logging
+import os
+import threading
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+PAGES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "pages")
+
+# Пути поисковой выдачи, которые строят парсеры, -> каталог с сохраненными страницами
+ROUTES = (
+    ("/search/", "ozon"),
+    ("/catalog/0/search.aspx", "wildberries"),
+    ("/catalog/", "sbermegamarket"),
+)
+
+
+def load_pages(pages_dir: str) -> Dict[str, List[bytes]]:
+    """Загружает сохраненные страницы выдачи: <pages_dir>/<маркетплейс>/page<N>.html."""
+    pages = {}
+    for _, marketplace in ROUTES:
+        directory = os.path.join(pages_dir, marketplace)
+        if not os.path.isdir(directory):
+            continue
+        names = sorted(
+            (name for name in os.listdir(directory) if name.startswith("page") and name.endswith(".html")),
+            key=lambda name: int(name[4:-5]),
+        )
+        pages[marketplace] = [open(os.path.join(directory, name), "rb").read() for name in names]
+    return pages
+
+
+def make_handler(pages: Dict[str, List[bytes]]):
+    class SavedPageHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            url = urllib.parse.urlsplit(self.path)
+            marketplace = next((m for prefix, m in ROUTES if url.path.startswith(prefix)), None)
+            saved = pages.get(marketplace)
+            if not saved:
+                self.send_error(404)
+                return
+            page = urllib.parse.parse_qs(url.query).get("page", ["1"])[0]
+            # Страниц больше, чем сохранено, - отдаем сохраненные по кругу
+            body = saved[(int(page) - 1) % len(saved)] if page.isdigit() and int(page) > 0 else saved[0]
+            self.send_response(200)
+            self.send_header("Content-Type", "text/html; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            logger.debug("%s - %s", self.address_string(), format % args)
+
+    return SavedPageHandler
+
+
+def serve_pages(pages_dir: str = PAGES_DIR, port: int = 0) -> Tuple[ThreadingHTTPServer, str]:
+    """Запускает локальный сервер сохраненных страниц, возвращает сервер и базовый URL."""
+    server = ThreadingHTTPServer(("127.0.0.1", port), make_handler(load_pages(pages_dir)))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{server.server_address[1]}"
+    logger.info("Сервер сохраненных страниц запущен: %s", base_url)
+    return server, base_url
@@ -0,0 +1,252 @@
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from abc import ABC, abstractmethod
+from dataclasses import asdict, dataclass, field
+from typing import List, Optional, Tuple
+
+from core.metrics import BROKER_TASKS
+from core.products import Product
+from core.relevance import SearchStop
+
+logger = logging.getLogger(__name__)
+
+# Столько же страниц выдачи обходят парсеры в одном процессе
+MAX_PAGES = 5
+POLL_INTERVAL = 0.5
+
+
+@dataclass
+class ScrapeTask:
+    """Одна страница выдачи маркетплейса; limit - сколько товаров еще нужно."""
+    marketplace: str
+    query: str
+    page: int
+    limit: Optional[int] = None
+    id: str = field(default_factory=lambda: uuid.uuid4().hex)
+    attempts: int = 0
+
+    def payload(self) -> str:
+        return json.dumps({"marketplace": self.marketplace, "query": self.query,
+                           "page": self.page, "limit": self.limit}, ensure_ascii=False)
+
+
+@dataclass
+class TaskResult:
+    status: str  # done или failed
+    products: List[Product]
+    error: Optional[str] = None
+
+
+class Broker(ABC):
+    """Очередь задач парсинга между API и воркерами.
+
+    Взятая воркером задача невидима для остальных visibility_timeout секунд. Если воркер
+    за это время не ответил (упал или завис), задачу получит другой воркер, но не больше
+    max_attempts раз. Задачи старше result_ttl, результат которых так и не забрали
+    (например, API перезапустился во время ожидания), удаляет purge. В Redis то же ложится
+    на список очереди, сортированное множество задач в работе по сроку и ключи результатов с TTL.
+    """
+
+    def __init__(self, visibility_timeout: float = 300, max_attempts: int = 3, result_ttl: float = 3600):
+        self.visibility_timeout = visibility_timeout
+        self.max_attempts = max_attempts
+        self.result_ttl = result_ttl
+
+    @abstractmethod
+    def enqueue(self, task: ScrapeTask):
+        pass
+
+    @abstractmethod
+    def claim(self, worker_id: str) -> Optional[ScrapeTask]:
+        """Следующая задача для воркера или None, если очередь пуста."""
+
+    @abstractmethod
+    def complete(self, task_id: str, products: List[Product]):
+        pass
+
+    @abstractmethod
+    def fail(self, task_id: str, error: str):
+        pass
+
+    @abstractmethod
+    def take_result(self, task_id: str) -> Optional[TaskResult]:
+        """Результат завершенной задачи; после чтения задача удаляется."""
+
+    @abstractmethod
+    def cancel(self, task_id: str):
+        """Удаляет задачу, результат которой больше никто не ждет."""
+
+    @abstractmethod
+    def purge(self) -> int:
+        """Удаляет задачи старше result_ttl и возвращает их число."""
+
+
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS scrape_tasks (
+    id TEXT PRIMARY KEY,
+    payload TEXT NOT NULL,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    worker TEXT,
+    claimed_at REAL,
+    created_at REAL NOT NULL,
+    result TEXT,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS scrape_tasks_status ON scrape_tasks (status, created_at);
+"""
+
+
+class SqliteBroker(Broker):
+    """Брокер в файле SQLite: для тестов и воркеров на одной машине с API."""
+
+    def __init__(self, path: str, visibility_timeout: float = 300, max_attempts: int = 3,
+                 result_ttl: float = 3600):
+        super().__init__(visibility_timeout, max_attempts, result_ttl)
+        self.path = path
+        self._local = threading.local()
+        self._connection().executescript(SQLITE_SCHEMA)
+
+    def _connection(self) -> sqlite3.Connection:
+        # Соединение SQLite нельзя делить между потоками, у каждого потока свое
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def enqueue(self, task: ScrapeTask):
+        self._connection().execute(
+            "INSERT INTO scrape_tasks (id, payload, status, created_at) VALUES (?, ?, 'queued', ?)",
+            (task.id, task.payload(), time.time()),
+        )
+
+    def claim(self, worker_id: str) -> Optional[ScrapeTask]:
+        conn = self._connection()
+        expired = time.time() - self.visibility_timeout
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute(
+                "UPDATE scrape_tasks SET status = 'failed', error = ? "
+                "WHERE status = 'running' AND claimed_at < ? AND attempts >= ?",
+                ("Превышено число попыток", expired, self.max_attempts),
+            )
+            row = conn.execute(
+                "SELECT id, payload, attempts FROM scrape_tasks "
+                "WHERE status = 'queued' OR (status = 'running' AND claimed_at < ?) "
+                "ORDER BY created_at LIMIT 1",
+                (expired,),
+            ).fetchone()
+            if row:
+                conn.execute(
+                    "UPDATE scrape_tasks SET status = 'running', worker = ?, claimed_at = ?, attempts = attempts + 1 "
+                    "WHERE id = ?",
+                    (worker_id, time.time(), row[0]),
+                )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        if row is None:
+            return None
+        return ScrapeTask(**json.loads(row[1]), id=row[0], attempts=row[2] + 1)
+
+    def complete(self, task_id: str, products: List[Product]):
+        result = json.dumps([asdict(product) for product in products], ensure_ascii=False)
+        self._connection().execute(
+            "UPDATE scrape_tasks SET status = 'done', result = ? WHERE id = ? AND status = 'running'",
+            (result, task_id),
+        )
+
+    def fail(self, task_id: str, error: str):
+        self._connection().execute(
+            "UPDATE scrape_tasks SET status = 'failed', error = ? WHERE id = ? AND status = 'running'",
+            (error, task_id),
+        )
+
+    def take_result(self, task_id: str) -> Optional[TaskResult]:
+        conn = self._connection()
+        row = conn.execute(
+            "SELECT status, result, error FROM scrape_tasks WHERE id = ? AND status IN ('done', 'failed')",
+            (task_id,),
+        ).fetchone()
+        if row is None:
+            return None
+        conn.execute("DELETE FROM scrape_tasks WHERE id = ?", (task_id,))
+        products = [Product(**item) for item in json.loads(row[1])] if row[1] else []
+        return TaskResult(row[0], products, row[2])
+
+    def cancel(self, task_id: str):
+        self._connection().execute("DELETE FROM scrape_tasks WHERE id = ?", (task_id,))
+
+    def purge(self) -> int:
+        return self._connection().execute(
+            "DELETE FROM scrape_tasks WHERE created_at < ?", (time.time() - self.result_ttl,)
+        ).rowcount
+
+
+def get_broker(url: Optional[str] = None) -> Broker:
+    """Брокер по BROKER_URL. Пока поддерживается sqlite:///путь/к/файлу."""
+    url = url or os.getenv("BROKER_URL", "sqlite:///broker.sqlite3")
+    visibility_timeout = float(os.getenv("BROKER_VISIBILITY_TIMEOUT", "300"))
+    result_ttl = float(os.getenv("BROKER_RESULT_TTL", "3600"))
+    if url.startswith("sqlite:///"):
+        return SqliteBroker(url[len("sqlite:///"):], visibility_timeout=visibility_timeout, result_ttl=result_ttl)
+    raise ValueError(f"Неподдерживаемый брокер {url}: ожидается sqlite:///путь")
+
+
+async def run_task(broker: Broker, task: ScrapeTask, timeout: float) -> Optional[TaskResult]:
+    """Ставит задачу в очередь и ждет результат; None - воркеры не успели за timeout."""
+    await asyncio.to_thread(broker.enqueue, task)
+    deadline = time.monotonic() + timeout
+    result = None
+    try:
+        while result is None and time.monotonic() < deadline:
+            await asyncio.sleep(POLL_INTERVAL)
+            result = await asyncio.to_thread(broker.take_result, task.id)
+        return result
+    finally:
+        if result is None:
+            # Ответ больше не нужен: не занимаем им воркер
+            await asyncio.to_thread(broker.cancel, task.id)
+
+
+async def scrape_pages(broker: Broker, marketplace: str, query: str, limit: Optional[int] = None,
+                       timeout: float = 180) -> Tuple[List[Product], Optional[str]]:
+    """Выдача маркетплейса через воркеров, страница за страницей.
+
+    Следующая страница ставится в очередь, только если набранные товары не исчерпали
+    limit и текущая страница осталась релевантной запросу. Маркетплейсы и запросы
+    обрабатываются параллельно. Возвращает товары и ошибку страницы, на которой обход
+    прервался сбоем или таймаутом воркеров (None, если сбоя не было).
+    """
+    stop = SearchStop(marketplace, query, limit)
+    products = []
+    error = None
+    for page in range(1, MAX_PAGES + 1):
+        task = ScrapeTask(marketplace, query, page, limit=stop.remaining(products))
+        result = await run_task(broker, task, timeout)
+        if result is None:
+            BROKER_TASKS.labels(marketplace, "timeout").inc()
+            error = f"Воркеры не вернули страницу {page} за {timeout:g} с"
+            logger.error("Воркеры не вернули страницу %s %s за %s с", page, marketplace, timeout)
+            break
+        BROKER_TASKS.labels(marketplace, result.status).inc()
+        if result.status != "done":
+            error = f"Страница {page} не получена: {result.error}"
+            logger.error("Страница %s %s не получена: %s", page, marketplace, result.error)
+            break
+        if not result.products:
+            break
+        page_start = len(products)
+        products.extend(result.products[:stop.remaining(products)])
+        if stop.page_done(products, page_start):
+            break
+    return products, error
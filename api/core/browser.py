@@ -0,0 +1,151 @@
+import asyncio
+import json
+import logging
+import os
+import time
+from abc import ABC, abstractmethod
+from typing import Any, Callable, Optional
+
+from core.resources import PAGE_RESOURCES_EXPRESSION, observe_page_resources
+from core.scrolling import SCROLL_STEP_FUNCTION
+
+logger = logging.getLogger(__name__)
+
+# selenium - WebDriver в потоке, cdp - Chrome DevTools Protocol из event loop (core.cdp).
+# Для отдельного парсера движок задает BROWSER_ENGINE_<МАРКЕТПЛЕЙС>, см. engine_for
+BROWSER_ENGINE = os.getenv("BROWSER_ENGINE", "selenium")
+SELECTOR_POLL_INTERVAL = 0.1
+
+
+def engine_for(name: str) -> str:
+    """Движок парсера: BROWSER_ENGINE_WILDBERRIES и т. п., иначе общий BROWSER_ENGINE."""
+    return os.getenv(f"BROWSER_ENGINE_{name.upper()}", BROWSER_ENGINE)
+
+
+class Page(ABC):
+    """Вкладка браузера с операциями, которые нужны парсерам и трекеру.
+
+    Ожидания завершаются TimeoutError. Операции, выраженные через evaluate,
+    реализованы здесь и одинаково работают на любом движке.
+    """
+
+    @abstractmethod
+    async def goto(self, url: str, timeout: float = 30):
+        """Переход по ссылке с ожиданием события load."""
+
+    @abstractmethod
+    async def evaluate(self, expression: str, await_promise: bool = False) -> Any:
+        """Значение JavaScript-выражения; await_promise дожидается результата Promise."""
+
+    @abstractmethod
+    async def close(self):
+        pass
+
+    async def wait_for_selector(self, selector: str, timeout: float = 15, visible: bool = False):
+        check = (
+            f"(() => {{ const e = document.querySelector({json.dumps(selector)});"
+            f" return !!e{' && e.offsetParent !== null' if visible else ''}; }})()"
+        )
+        deadline = time.monotonic() + timeout
+        while not await self.evaluate(check):
+            if time.monotonic() >= deadline:
+                raise TimeoutError(f"Элемент {selector} не появился за {timeout} с")
+            await asyncio.sleep(SELECTOR_POLL_INTERVAL)
+
+    async def text(self, selector: str) -> Optional[str]:
+        """Видимый текст первого элемента по селектору или None."""
+        return await self.evaluate(
+            f"(() => {{ const e = document.querySelector({json.dumps(selector)}); return e ? e.innerText : null; }})()"
+        )
+
+    async def scroll_until_loaded(self, tile_selector: str, target: Optional[int] = None, max_time: float = 10,
+                                  idle_timeout: float = 1.5, step: Optional[int] = None) -> int:
+        """То же, что core.scrolling.scroll_until_loaded, без блокировки потока."""
+        call = f"({SCROLL_STEP_FUNCTION})({json.dumps(tile_selector)}, {step or 0}, {int(idle_timeout * 1000)})"
+        deadline = time.monotonic() + max_time
+        count = 0
+        while time.monotonic() < deadline:
+            state = await self.evaluate(call, await_promise=True)
+            count = state["after"]
+            if target and count >= target:
+                break
+            if state["atBottom"] and state["after"] == state["before"]:
+                break
+        return count
+
+    async def record_resources(self, marketplace: str, policy_name: Optional[str] = None) -> Optional[dict]:
+        try:
+            stats = await self.evaluate(PAGE_RESOURCES_EXPRESSION)
+        except Exception as e:
+            logger.debug("Не удалось получить статистику ресурсов страницы: %s", e)
+            return None
+        return observe_page_resources(stats, marketplace, policy_name)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+
+class SeleniumPage(Page):
+    """Page поверх WebDriver: блокирующие вызовы выполняются в потоке."""
+
+    def __init__(self, driver):
+        self.driver = driver
+
+    async def goto(self, url: str, timeout: float = 30):
+        from selenium.common.exceptions import TimeoutException
+
+        def load():
+            self.driver.set_page_load_timeout(timeout)
+            self.driver.get(url)
+
+        try:
+            await asyncio.to_thread(load)
+        except TimeoutException as e:
+            raise TimeoutError(f"Страница {url} не загрузилась за {timeout} с") from e
+
+    async def evaluate(self, expression: str, await_promise: bool = False) -> Any:
+        # execute_script по спецификации WebDriver сам дожидается возвращенного Promise
+        return await asyncio.to_thread(self.driver.execute_script, f"return ({expression});")
+
+    async def close(self):
+        try:
+            await asyncio.to_thread(self.driver.quit)
+        except Exception:
+            logger.error("Ошибка при закрытии Selenium")
+
+
+async def close_browsers():
+    """Закрывает общий браузер движка cdp при остановке сервиса."""
+    if BROWSER_ENGINE == "cdp":
+        from core import cdp
+
+        await cdp.close_browser()
+
+
+async def open_page(policy: str, proxy: Optional[str] = None,
+                    setup_selenium: Optional[Callable] = None, engine: Optional[str] = None,
+                    shared: bool = True) -> Optional[Page]:
+    """Новая вкладка на движке engine (по умолчанию BROWSER_ENGINE) или None, если браузер не запустился.
+
+    setup_selenium(proxy) - фабрика WebDriver вызывающего модуля для движка selenium.
+    shared=False открывает вкладку в собственном Chrome, который закрывается вместе с ней:
+    общий браузер привязан к event loop сервиса, а парсеры в потоках запускают свой.
+    """
+    if (engine or BROWSER_ENGINE) == "cdp":
+        from core import cdp
+
+        if cdp.websockets is not None:
+            try:
+                if not shared:
+                    return await cdp.open_standalone_page(policy=policy, proxy=proxy)
+                browser = await cdp.get_browser()
+                return await browser.new_page(policy=policy, proxy=proxy)
+            except Exception as e:
+                logger.error("Не удалось открыть вкладку через CDP: %s", e, exc_info=True)
+                return None
+        logger.warning("BROWSER_ENGINE=cdp требует пакет websockets, используется Selenium")
+    driver = await asyncio.to_thread(setup_selenium, proxy)
+    return SeleniumPage(driver) if driver else None
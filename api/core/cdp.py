@@ -0,0 +1,311 @@
+import asyncio
+import json
+import logging
+import os
+import re
+import shutil
+import tempfile
+from collections import defaultdict
+from typing import Any, Callable, Dict, Optional
+
+try:
+    import websockets
+except ImportError:
+    websockets = None
+
+from core.browser import Page
+from core.metrics import CHROME_LAUNCH_SECONDS
+from core.resources import get_policy
+
+logger = logging.getLogger(__name__)
+
+CHROME_BINARY = os.getenv("CHROME_BINARY", "google-chrome")
+LAUNCH_TIMEOUT = 30
+DEVTOOLS_RE = re.compile(rb"DevTools listening on (ws://\S+)")
+USER_AGENT = (
+    "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 "
+    "(KHTML, like Gecko) Chrome/126.0.0.0 Safari/537.36"
+)
+STEALTH_SCRIPT = """
+    Object.defineProperty(navigator, 'webdriver', {get: () => undefined});
+    window.navigator.chrome = { runtime: {} };
+    Object.defineProperty(navigator, 'plugins', { get: () => [1, 2, 3] });
+    Object.defineProperty(navigator, 'languages', { get: () => ['en-US', 'en'] });
+"""
+
+
+class CdpError(Exception):
+    """Ошибка команды DevTools Protocol или разрыв соединения с Chrome."""
+
+
+class CdpConnection:
+    """WebSocket-соединение с браузером. Вкладки работают как сессии в плоском режиме
+    (flatten): команды и события вкладки помечены ее sessionId."""
+
+    def __init__(self, ws):
+        self._ws = ws
+        self._next_id = 0
+        self._pending: Dict[int, asyncio.Future] = {}
+        self._listeners = defaultdict(list)
+        self._reader = asyncio.create_task(self._read())
+
+    @property
+    def open(self) -> bool:
+        return not self._reader.done()
+
+    async def send(self, method: str, params: Optional[dict] = None,
+                   session_id: Optional[str] = None, timeout: float = 30) -> dict:
+        self._next_id += 1
+        message_id = self._next_id
+        message = {"id": message_id, "method": method, "params": params or {}}
+        if session_id:
+            message["sessionId"] = session_id
+        future = asyncio.get_running_loop().create_future()
+        self._pending[message_id] = future
+        try:
+            await self._ws.send(json.dumps(message))
+            return await asyncio.wait_for(future, timeout)
+        finally:
+            self._pending.pop(message_id, None)
+
+    def on(self, session_id: str, method: str, callback: Callable[[dict], None]):
+        self._listeners[(session_id, method)].append(callback)
+
+    def off(self, session_id: str, method: str, callback: Callable[[dict], None]):
+        listeners = self._listeners.get((session_id, method), [])
+        if callback in listeners:
+            listeners.remove(callback)
+        if not listeners:
+            self._listeners.pop((session_id, method), None)
+
+    def drop_session(self, session_id: str):
+        for key in [key for key in self._listeners if key[0] == session_id]:
+            del self._listeners[key]
+
+    async def close(self):
+        await self._ws.close()
+        await asyncio.gather(self._reader, return_exceptions=True)
+
+    async def _read(self):
+        try:
+            async for raw in self._ws:
+                message = json.loads(raw)
+                if "id" in message:
+                    future = self._pending.get(message["id"])
+                    if future is None or future.done():
+                        continue
+                    if "error" in message:
+                        future.set_exception(CdpError(message["error"].get("message", str(message["error"]))))
+                    else:
+                        future.set_result(message.get("result", {}))
+                    continue
+                key = (message.get("sessionId"), message.get("method"))
+                for callback in list(self._listeners.get(key, ())):
+                    try:
+                        callback(message.get("params", {}))
+                    except Exception as e:
+                        logger.error("Ошибка обработчика события %s: %s", key[1], e, exc_info=True)
+        except websockets.ConnectionClosed:
+            logger.warning("Соединение с Chrome закрыто")
+        finally:
+            for future in self._pending.values():
+                if not future.done():
+                    future.set_exception(CdpError("Соединение с Chrome закрыто"))
+
+
+class CdpPage(Page):
+    """Вкладка в собственном контексте браузера (отдельные cookies и прокси)."""
+
+    def __init__(self, connection: CdpConnection, target_id: str, session_id: str, context_id: str):
+        self.connection = connection
+        self.target_id = target_id
+        self.session_id = session_id
+        self.context_id = context_id
+        # Браузер, запущенный только для этой вкладки (open_standalone_page)
+        self.owner: Optional["CdpBrowser"] = None
+
+    async def send(self, method: str, params: Optional[dict] = None, timeout: float = 30) -> dict:
+        return await self.connection.send(method, params, self.session_id, timeout)
+
+    async def setup(self, policy: Optional[str] = None):
+        await self.send("Page.enable")
+        await self.send("Page.addScriptToEvaluateOnNewDocument", {"source": STEALTH_SCRIPT})
+        urls = get_policy(policy).blocked_urls() if policy else []
+        if urls:
+            await self.send("Network.enable")
+            await self.send("Network.setBlockedURLs", {"urls": urls})
+
+    async def goto(self, url: str, timeout: float = 30):
+        loaded = asyncio.get_running_loop().create_future()
+
+        def on_load(params):
+            if not loaded.done():
+                loaded.set_result(None)
+
+        self.connection.on(self.session_id, "Page.loadEventFired", on_load)
+        try:
+            result = await self.send("Page.navigate", {"url": url}, timeout)
+            if result.get("errorText"):
+                raise CdpError(f"Не удалось открыть {url}: {result['errorText']}")
+            await asyncio.wait_for(loaded, timeout)
+        except TimeoutError as e:
+            try:
+                await self.send("Page.stopLoading")
+            except Exception:
+                pass
+            raise TimeoutError(f"Страница {url} не загрузилась за {timeout} с") from e
+        finally:
+            self.connection.off(self.session_id, "Page.loadEventFired", on_load)
+
+    async def evaluate(self, expression: str, await_promise: bool = False) -> Any:
+        result = await self.send("Runtime.evaluate", {
+            "expression": expression, "returnByValue": True, "awaitPromise": await_promise,
+        })
+        if "exceptionDetails" in result:
+            details = result["exceptionDetails"]
+            raise CdpError(details.get("exception", {}).get("description") or details.get("text"))
+        return result.get("result", {}).get("value")
+
+    async def close(self):
+        try:
+            await self.connection.send("Target.closeTarget", {"targetId": self.target_id})
+            await self.connection.send("Target.disposeBrowserContext", {"browserContextId": self.context_id})
+        except Exception as e:
+            logger.debug("Ошибка при закрытии вкладки %s: %s", self.target_id, e)
+        finally:
+            self.connection.drop_session(self.session_id)
+            if self.owner is not None:
+                await self.owner.close()
+
+
+class CdpBrowser:
+    """Процесс Chrome, которым управляет один event loop по DevTools WebSocket.
+
+    Вкладки открываются параллельно без потоков: каждая операция - сообщение
+    в общем соединении, ответы разбирает одна задача чтения.
+    """
+
+    def __init__(self, executable: str = CHROME_BINARY, headless: bool = True):
+        self.executable = executable
+        self.headless = headless
+        self.process: Optional[asyncio.subprocess.Process] = None
+        self.connection: Optional[CdpConnection] = None
+        self._profile: Optional[str] = None
+
+    @property
+    def alive(self) -> bool:
+        return (self.process is not None and self.process.returncode is None
+                and self.connection is not None and self.connection.open)
+
+    async def start(self):
+        self._profile = tempfile.mkdtemp(prefix="sauce-chrome-")
+        args = [
+            self.executable,
+            "--remote-debugging-port=0",
+            f"--user-data-dir={self._profile}",
+            "--no-sandbox",
+            "--disable-dev-shm-usage",
+            "--disable-gpu",
+            "--window-size=1920,1080",
+            "--disable-blink-features=AutomationControlled",
+            "--disable-extensions",
+            "--no-first-run",
+            "--no-default-browser-check",
+            f"--user-agent={USER_AGENT}",
+        ]
+        if self.headless:
+            args.append("--headless=new")
+        args.append("about:blank")
+        with CHROME_LAUNCH_SECONDS.labels("cdp").time():
+            self.process = await asyncio.create_subprocess_exec(
+                *args, stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.PIPE
+            )
+            url = await asyncio.wait_for(self._devtools_url(), LAUNCH_TIMEOUT)
+            ws = await websockets.connect(url, max_size=None, ping_interval=None)
+        self.connection = CdpConnection(ws)
+        # Chrome пишет в stderr весь срок работы: непрочитанный канал остановит процесс
+        asyncio.create_task(self._drain_stderr())
+        logger.info("Chrome запущен для CDP: %s", url)
+
+    async def new_page(self, policy: Optional[str] = None, proxy: Optional[str] = None) -> CdpPage:
+        params = {"disposeOnDetach": True}
+        if proxy:
+            params["proxyServer"] = proxy
+        context_id = (await self.connection.send("Target.createBrowserContext", params))["browserContextId"]
+        target_id = (await self.connection.send(
+            "Target.createTarget", {"url": "about:blank", "browserContextId": context_id}
+        ))["targetId"]
+        session_id = (await self.connection.send(
+            "Target.attachToTarget", {"targetId": target_id, "flatten": True}
+        ))["sessionId"]
+        page = CdpPage(self.connection, target_id, session_id, context_id)
+        try:
+            await page.setup(policy)
+        except BaseException:
+            await page.close()
+            raise
+        return page
+
+    async def close(self):
+        if self.connection is not None:
+            await self.connection.close()
+        if self.process is not None and self.process.returncode is None:
+            self.process.terminate()
+            try:
+                await asyncio.wait_for(self.process.wait(), 10)
+            except TimeoutError:
+                self.process.kill()
+        if self._profile:
+            shutil.rmtree(self._profile, ignore_errors=True)
+
+    async def _devtools_url(self) -> str:
+        while True:
+            line = await self.process.stderr.readline()
+            if not line:
+                raise CdpError("Chrome завершился при запуске")
+            match = DEVTOOLS_RE.search(line)
+            if match:
+                return match.group(1).decode()
+
+    async def _drain_stderr(self):
+        while await self.process.stderr.read(65536):
+            pass
+
+
+_browser: Optional[CdpBrowser] = None
+_browser_lock: Optional[asyncio.Lock] = None
+
+
+async def get_browser() -> CdpBrowser:
+    """Общий браузер процесса; запускается при первой вкладке и после падения Chrome."""
+    global _browser, _browser_lock
+    if _browser_lock is None:
+        _browser_lock = asyncio.Lock()
+    async with _browser_lock:
+        if _browser is None or not _browser.alive:
+            if _browser is not None:
+                logger.warning("Chrome для CDP недоступен, перезапуск")
+                await _browser.close()
+            _browser = CdpBrowser()
+            await _browser.start()
+        return _browser
+
+
+async def open_standalone_page(policy: Optional[str] = None, proxy: Optional[str] = None) -> CdpPage:
+    """Вкладка в отдельном Chrome: для вызовов из asyncio.run в потоке исполнителя или воркера."""
+    browser = CdpBrowser()
+    try:
+        await browser.start()
+        page = await browser.new_page(policy=policy, proxy=proxy)
+    except BaseException:
+        await browser.close()
+        raise
+    page.owner = browser
+    return page
+
+
+async def close_browser():
+    global _browser
+    if _browser is not None:
+        await _browser.close()
+        _browser = None
@@ -0,0 +1,94 @@
+import logging
+import math
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextvars import copy_context
+from typing import Callable, List, Optional, Sequence, Tuple
+
+from core.metrics import EXECUTOR_IN_FLIGHT, EXECUTOR_QUEUE_DEPTH, EXECUTOR_QUEUE_WAIT_SECONDS, EXECUTOR_REJECTED
+from core.timing import add_span
+
+logger = logging.getLogger(__name__)
+
+DURATION_ALPHA = 0.2
+
+
+class ExecutorFull(Exception):
+    """Очередь исполнителя заполнена; retry_after - оценка, через сколько секунд повторить."""
+
+    def __init__(self, retry_after: int):
+        super().__init__(f"Очередь заполнена, повторите через {retry_after} с")
+        self.retry_after = retry_after
+
+
+class BoundedExecutor:
+    """Общий на процесс пул потоков с ограниченной очередью.
+
+    max_workers ограничивает число одновременно работающих браузеров, max_queue -
+    число задач, ожидающих свободного потока. Задачи сверх этого отклоняются сразу.
+    """
+
+    def __init__(self, name: str, max_workers: int, max_queue: int, expected_duration: float = 30.0):
+        self.name = name
+        self.max_workers = max_workers
+        self.capacity = max_workers + max_queue
+        self.pending = 0
+        self.running = 0
+        self.avg_duration = expected_duration
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=name)
+        self._export()
+
+    def submit(self, fn: Callable, *args, label: Optional[str] = None) -> Future:
+        return self.submit_batch([(fn, args, label)])[0]
+
+    def submit_batch(self, calls: Sequence[Tuple[Callable, tuple, Optional[str]]]) -> List[Future]:
+        """Принимает все задачи или ни одной: частично запущенный запрос бесполезен."""
+        with self._lock:
+            if self.pending + len(calls) > self.capacity:
+                EXECUTOR_REJECTED.labels(self.name).inc()
+                retry_after = self.retry_after(len(calls))
+                logger.warning("Исполнитель %s переполнен (%s/%s), отказ на %s задач",
+                               self.name, self.pending, self.capacity, len(calls))
+                raise ExecutorFull(retry_after)
+            self.pending += len(calls)
+            self._export()
+        futures = []
+        for fn, args, label in calls:
+            # Контекст копируем, чтобы задача писала этапы в Server-Timing своего запроса
+            future = self._executor.submit(copy_context().run, self._run, fn, args, label, time.monotonic())
+            future.add_done_callback(self._done)
+            futures.append(future)
+        return futures
+
+    def retry_after(self, tasks: int = 1) -> int:
+        """Оценка ожидания: сколько волн задач должно завершиться до освобождения места."""
+        waves = max(1, self.pending + tasks - self.max_workers) / self.max_workers
+        return max(1, math.ceil(waves * self.avg_duration))
+
+    def _run(self, fn, args, label, submitted):
+        wait = time.monotonic() - submitted
+        EXECUTOR_QUEUE_WAIT_SECONDS.labels(self.name).observe(wait)
+        if label:
+            add_span(f"{label}.queue", wait)
+        with self._lock:
+            self.running += 1
+            self._export()
+        start = time.monotonic()
+        try:
+            return fn(*args)
+        finally:
+            with self._lock:
+                self.running -= 1
+                self.avg_duration += DURATION_ALPHA * (time.monotonic() - start - self.avg_duration)
+
+    def _done(self, future: Future):
+        # Вызывается и для задач, отмененных в очереди, поэтому место освобождаем здесь
+        with self._lock:
+            self.pending -= 1
+            self._export()
+
+    def _export(self):
+        EXECUTOR_IN_FLIGHT.labels(self.name).set(self.running)
+        EXECUTOR_QUEUE_DEPTH.labels(self.name).set(max(0, self.pending - self.running))
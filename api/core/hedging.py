@@ -0,0 +1,37 @@
+import math
+import threading
+from collections import deque
+from typing import Optional
+
+
+class HedgeDelay:
+    """Через сколько секунд запускать запасной уровень, если основной еще не ответил.
+
+    Задержка - перцентиль времени успешных ответов основного уровня за последние
+    window замеров, ограниченный floor и ceiling. Пока замеров меньше min_samples,
+    используется default.
+    """
+
+    def __init__(self, default: float, percentile: float = 0.9, window: int = 200,
+                 min_samples: int = 20, floor: float = 0.5, ceiling: Optional[float] = None):
+        self.default = default
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self.floor = floor
+        self.ceiling = ceiling
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def observe(self, seconds: float):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def delay(self) -> float:
+        with self._lock:
+            samples = sorted(self._samples)
+        if len(samples) < self.min_samples:
+            value = self.default
+        else:
+            value = samples[min(len(samples) - 1, math.ceil(self.percentile * len(samples)) - 1)]
+        value = max(self.floor, value)
+        return min(self.ceiling, value) if self.ceiling is not None else value
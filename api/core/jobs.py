@@ -0,0 +1,88 @@
+import logging
+import threading
+import time
+import uuid
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+
+from core.metrics import JOBS_ACTIVE, JOBS_FINISHED
+
+logger = logging.getLogger(__name__)
+
+FINISHED_STATUSES = ("done", "failed")
+
+
+class JobQueueFull(Exception):
+    """Слишком много незавершенных задач."""
+
+
+@dataclass
+class Job:
+    """Фоновая задача парсинга: статус, прогресс по маркетплейсам и частичные результаты."""
+    id: str
+    url: str
+    request: Any
+    marketplaces: List[str]
+    status: str = "queued"
+    title: Optional[str] = None
+    error: Optional[str] = None
+    progress: Dict[str, str] = field(default_factory=dict)
+    # Причина сбоя маркетплейса: ошибка парсера или воркеров
+    errors: Dict[str, str] = field(default_factory=dict)
+    results: Dict[str, list] = field(default_factory=dict)
+    created_at: float = field(default_factory=time.time)
+    finished_at: Optional[float] = None
+    task: Any = None
+
+    @property
+    def finished(self) -> bool:
+        return self.status in FINISHED_STATUSES
+
+
+class JobStore:
+    """Хранилище задач в памяти процесса.
+
+    max_active ограничивает число задач в очереди и в работе, готовые результаты
+    хранятся ttl секунд после завершения.
+    """
+
+    def __init__(self, max_active: int, ttl: float):
+        self.max_active = max_active
+        self.ttl = ttl
+        self._jobs: Dict[str, Job] = {}
+        self._lock = threading.Lock()
+
+    def create(self, url: str, request: Any, marketplaces: List[str]) -> Job:
+        with self._lock:
+            self._purge()
+            active = sum(not job.finished for job in self._jobs.values())
+            if active >= self.max_active:
+                raise JobQueueFull(f"Активных задач: {active}")
+            job = Job(uuid.uuid4().hex, url, request, marketplaces,
+                      progress={marketplace: "queued" for marketplace in marketplaces})
+            self._jobs[job.id] = job
+            JOBS_ACTIVE.set(active + 1)
+        logger.info("Создана задача %s для %s", job.id, url)
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._lock:
+            self._purge()
+            return self._jobs.get(job_id)
+
+    def finish(self, job: Job, status: str, error: Optional[str] = None):
+        with self._lock:
+            job.status = status
+            job.error = error
+            job.finished_at = time.time()
+            job.task = None
+            JOBS_FINISHED.labels(status).inc()
+            JOBS_ACTIVE.set(sum(not j.finished for j in self._jobs.values()))
+        logger.info("Задача %s завершена со статусом %s", job.id, status)
+
+    def _purge(self):
+        now = time.time()
+        expired = [job_id for job_id, job in self._jobs.items()
+                   if job.finished and now - job.finished_at > self.ttl]
+        for job_id in expired:
+            del self._jobs[job_id]
@@ -0,0 +1,86 @@
+import atexit
+import itertools
+import logging
+import os
+import queue
+import sys
+from logging.handlers import QueueHandler, QueueListener
+from typing import Dict, Optional
+
+LOG_FORMAT = '%(asctime)s | %(levelname)s | %(name)s:%(lineno)d | %(message)s'
+DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
+ITEM_LOGGER_SUFFIX = ".items"
+
+_listener: Optional[QueueListener] = None
+
+
+class SamplingFilter(logging.Filter):
+    """Пропускает только часть DEBUG-записей по отдельным товарам (логгеры *.items)."""
+
+    def __init__(self, rate: float):
+        super().__init__()
+        self.every = max(1, round(1 / rate)) if rate > 0 else 0
+        self._counter = itertools.count()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno > logging.DEBUG or not record.name.endswith(ITEM_LOGGER_SUFFIX):
+            return True
+        if not self.every:
+            return False
+        return next(self._counter) % self.every == 0
+
+
+class DeferredQueueHandler(QueueHandler):
+    """QueueHandler, который не форматирует запись в вызывающем потоке.
+
+    Очередь живет в том же процессе, поэтому запись можно передать как есть,
+    а %-подстановка и форматирование выполнятся в потоке QueueListener.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+def parse_levels(spec: str) -> Dict[str, int]:
+    """Разбирает строку вида "parsers=INFO,core.metrics=WARNING"."""
+    levels = {}
+    for item in spec.split(","):
+        name, _, level = item.partition("=")
+        if name.strip() and level.strip():
+            levels[name.strip()] = logging.getLevelName(level.strip().upper())
+    return levels
+
+
+def setup_logging(logfile: str, level: str = "INFO") -> QueueListener:
+    """Настройка логирования сервиса: файл и stdout пишутся в отдельном потоке.
+
+    Переменные окружения переопределяют настройки:
+    LOG_LEVEL — уровень корневого логгера, LOG_LEVELS — уровни по модулям,
+    LOG_ITEM_SAMPLE_RATE — доля DEBUG-записей по товарам, попадающих в лог.
+    """
+    global _listener
+    if _listener is not None:
+        return _listener
+
+    formatter = logging.Formatter(LOG_FORMAT, datefmt=DATE_FORMAT)
+    file_handler = logging.FileHandler(os.getenv("LOG_FILE", logfile), encoding="utf-8")
+    stream_handler = logging.StreamHandler(sys.stdout)
+    for handler in (file_handler, stream_handler):
+        handler.setFormatter(formatter)
+
+    log_queue = queue.SimpleQueue()
+    queue_handler = DeferredQueueHandler(log_queue)
+    queue_handler.addFilter(SamplingFilter(float(os.getenv("LOG_ITEM_SAMPLE_RATE", "0.05"))))
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(os.getenv("LOG_LEVEL", level).upper())
+    for name, module_level in parse_levels(os.getenv("LOG_LEVELS", "")).items():
+        logging.getLogger(name).setLevel(module_level)
+
+    _listener = QueueListener(log_queue, file_handler, stream_handler, respect_handler_level=True)
+    _listener.start()
+    atexit.register(_listener.stop)
+    return _listener
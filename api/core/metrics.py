@@ -0,0 +1,153 @@
+from fastapi import Response
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Gauge, Histogram, generate_latest
+
+NAMESPACE = "sauce"
+
+# Бакеты под браузерные операции: от долей секунды до нескольких минут
+SLOW_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 90, 120, 180, 300)
+COUNT_BUCKETS = (0, 1, 2, 3, 4, 5, 10, 20, 30, 50, 100, 200)
+# Интервалы между проверками отслеживаемых товаров: от 15 минут до суток
+INTERVAL_BUCKETS = (900, 1800, 3600, 2 * 3600, 4 * 3600, 8 * 3600, 12 * 3600, 18 * 3600, 24 * 3600, 30 * 3600)
+
+TITLE_EXTRACTION_SECONDS = Histogram(
+    "title_extraction_seconds", "Время извлечения названия товара по ссылке",
+    ["tier"], namespace=NAMESPACE, buckets=SLOW_BUCKETS,
+)
+PARSER_DURATION_SECONDS = Histogram(
+    "parser_duration_seconds", "Время работы парсера маркетплейса",
+    ["marketplace"], namespace=NAMESPACE, buckets=SLOW_BUCKETS,
+)
+PAGES_SCRAPED = Histogram(
+    "parser_pages_scraped", "Количество страниц выдачи, обработанных за один запуск парсера",
+    ["marketplace"], namespace=NAMESPACE, buckets=COUNT_BUCKETS,
+)
+PARSER_EARLY_STOPS = Counter(
+    "parser_early_stops", "Досрочные завершения обхода выдачи: набран limit или упала релевантность",
+    ["marketplace", "reason"], namespace=NAMESPACE,
+)
+PAGE_EXTRACTION_SOURCE = Counter(
+    "parser_page_source", "Откуда взяты товары страницы выдачи: xhr/state (JSON) или dom (карточки)",
+    ["marketplace", "source"], namespace=NAMESPACE,
+)
+PRODUCTS_PER_PAGE = Histogram(
+    "parser_products_per_page", "Количество товаров, извлеченных с одной страницы выдачи",
+    ["marketplace"], namespace=NAMESPACE, buckets=COUNT_BUCKETS,
+)
+CHROME_LAUNCH_SECONDS = Histogram(
+    "chrome_launch_seconds", "Время запуска Chrome WebDriver",
+    ["component"], namespace=NAMESPACE, buckets=SLOW_BUCKETS,
+)
+PAGE_TRANSFER_BYTES = Histogram(
+    "page_transfer_bytes", "Объем данных, загруженных страницей, по политике блокировки ресурсов",
+    ["marketplace", "policy"], namespace=NAMESPACE,
+    buckets=(1e5, 2.5e5, 5e5, 1e6, 2.5e6, 5e6, 1e7, 2.5e7),
+)
+PAGE_LOAD_SECONDS = Histogram(
+    "page_load_seconds", "Время загрузки страницы (loadEventEnd) по политике блокировки ресурсов",
+    ["marketplace", "policy"], namespace=NAMESPACE, buckets=SLOW_BUCKETS,
+)
+CAPTCHA_DETECTIONS = Counter(
+    "captcha_detections", "Обнаруженные CAPTCHA",
+    ["marketplace"], namespace=NAMESPACE,
+)
+TIMEOUTS = Counter(
+    "timeouts", "Таймауты загрузки страниц и HTTP-запросов",
+    ["component", "stage"], namespace=NAMESPACE,
+)
+BLOCK_SIGNALS = Counter(
+    "block_signals", "Сигналы блокировки, учтенные регулятором нагрузки (captcha/timeout/empty)",
+    ["marketplace", "signal"], namespace=NAMESPACE,
+)
+THROTTLE_DELAY_SECONDS = Gauge(
+    "throttle_delay_seconds", "Текущая задержка между переходами по страницам маркетплейса",
+    ["marketplace"], namespace=NAMESPACE,
+)
+THROTTLE_CONCURRENCY = Gauge(
+    "throttle_concurrency", "Текущее допустимое число одновременных загрузок страниц маркетплейса",
+    ["marketplace"], namespace=NAMESPACE,
+)
+PROXY_LEASES = Counter(
+    "proxy_leases", "Выданные сессии: через прокси или напрямую, если прокси недоступны",
+    ["marketplace", "route"], namespace=NAMESPACE,
+)
+PROXY_QUARANTINES = Counter(
+    "proxy_quarantines", "Помещения прокси в карантин по сигналу",
+    ["signal"], namespace=NAMESPACE,
+)
+PROXY_QUARANTINED = Gauge(
+    "proxy_quarantined", "Число прокси в карантине на момент последнего сбоя",
+    namespace=NAMESPACE,
+)
+EXECUTOR_QUEUE_DEPTH = Gauge(
+    "executor_queue_depth", "Задачи, ожидающие свободного потока исполнителя",
+    ["executor"], namespace=NAMESPACE,
+)
+EXECUTOR_IN_FLIGHT = Gauge(
+    "executor_in_flight", "Задачи, выполняющиеся в исполнителе",
+    ["executor"], namespace=NAMESPACE,
+)
+EXECUTOR_QUEUE_WAIT_SECONDS = Histogram(
+    "executor_queue_wait_seconds", "Время ожидания задачи в очереди исполнителя",
+    ["executor"], namespace=NAMESPACE, buckets=SLOW_BUCKETS,
+)
+EXECUTOR_REJECTED = Counter(
+    "executor_rejected", "Запросы, отклоненные из-за заполненной очереди исполнителя",
+    ["executor"], namespace=NAMESPACE,
+)
+SINGLEFLIGHT_CALLS = Counter(
+    "singleflight_calls", "Вызовы с объединением одинаковых запросов: запустившие задачу и присоединившиеся",
+    ["flight", "role"], namespace=NAMESPACE,
+)
+JOBS_ACTIVE = Gauge(
+    "jobs_active", "Фоновые задачи парсинга в очереди и в работе",
+    namespace=NAMESPACE,
+)
+JOBS_FINISHED = Counter(
+    "jobs_finished", "Завершенные фоновые задачи парсинга по статусу",
+    ["status"], namespace=NAMESPACE,
+)
+TITLE_TIER_WINS = Counter(
+    "title_tier_wins", "Уровень, первым вернувший название товара (none - ни один)",
+    ["tier"], namespace=NAMESPACE,
+)
+TITLE_HEDGES = Counter(
+    "title_hedges", "Запуски Selenium параллельно с еще не ответившим HTTP-запросом названия",
+    namespace=NAMESPACE,
+)
+BROKER_TASKS = Counter(
+    "broker_tasks", "Страницы выдачи, отданные воркерам через брокер, по результату (done/failed/timeout)",
+    ["marketplace", "outcome"], namespace=NAMESPACE,
+)
+TRACKER_MEMBERS = Gauge(
+    "tracker_members", "Живые экземпляры трекера в реестре, между которыми делятся товары",
+    namespace=NAMESPACE,
+)
+TRACKER_SHARD_SIZE = Gauge(
+    "tracker_shard_size", "Отслеживаемые товары в доле этого экземпляра",
+    namespace=NAMESPACE,
+)
+TRACKER_REFRESHES = Counter(
+    "tracker_refreshes", "Проверки цены отслеживаемых товаров по результату",
+    ["outcome"], namespace=NAMESPACE,
+)
+TRACKER_REFRESH_INTERVAL_SECONDS = Histogram(
+    "tracker_refresh_interval_seconds", "Назначенный интервал до следующей проверки цены товара",
+    namespace=NAMESPACE, buckets=INTERVAL_BUCKETS,
+)
+CACHE_REQUESTS = Counter(
+    "cache_requests", "Обращения к кэшам по результату (hit/miss)",
+    ["cache", "result"], namespace=NAMESPACE,
+)
+ALERT_SEND_SECONDS = Histogram(
+    "alert_send_seconds", "Время отправки уведомления",
+    ["channel"], namespace=NAMESPACE,
+)
+ALERTS_SENT = Counter(
+    "alerts_sent", "Отправленные уведомления по результату",
+    ["channel", "outcome"], namespace=NAMESPACE,
+)
+
+
+def metrics_response() -> Response:
+    """Ответ для эндпоинта /metrics в текстовом формате Prometheus."""
+    return Response(content=generate_latest(), media_type=CONTENT_TYPE_LATEST)
@@ -0,0 +1,78 @@
+import re
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional
+
+SORT_ORDERS = ("price_asc", "price_desc")
+# Домен -> маркетплейс; заполняется при регистрации адаптеров в parsers.parsers_registry
+MARKETPLACE_DOMAINS: Dict[str, str] = {}
+
+# Первое число в строке цены: "1 299 ₽", "1 299,50 ₽", "от 12 990 ₽"
+PRICE_RE = re.compile(r"\d[\d \u00a0\u2009\u202f]*(?:[.,]\d{1,2})?")
+SPACES_RE = re.compile(r"[ \u00a0\u2009\u202f]+")
+
+
+@dataclass(slots=True)
+class Product:
+    """Карточка товара с маркетплейса. Цена хранится в копейках."""
+    marketplace: str
+    title: str
+    price: int
+    link: Optional[str] = None
+    image: Optional[str] = None
+    article: Optional[str] = None
+
+    def to_dict(self) -> dict:
+        return {
+            "title": self.title,
+            "price": kopecks_to_rubles(self.price),
+            "link": self.link,
+            "image": self.image,
+            "article": self.article,
+        }
+
+
+def marketplace_for_url(url: str) -> Optional[str]:
+    """Маркетплейс по домену ссылки или None для неизвестных сайтов."""
+    return next((m for domain, m in MARKETPLACE_DOMAINS.items() if domain in url), None)
+
+
+def normalize_query(text: str) -> str:
+    """Поисковый запрос для сравнения: нижний регистр, одиночные пробелы."""
+    return " ".join(text.split()).lower()
+
+
+def parse_price(text: Optional[str]) -> Optional[int]:
+    """Разбирает текст цены в целое число копеек."""
+    if not text:
+        return None
+    match = PRICE_RE.search(text)
+    if not match:
+        return None
+    number = SPACES_RE.sub("", match.group()).replace(",", ".")
+    rubles, _, kopecks = number.partition(".")
+    return int(rubles) * 100 + int(kopecks.ljust(2, "0")) if kopecks else int(rubles) * 100
+
+
+def kopecks_to_rubles(price: int):
+    return price // 100 if price % 100 == 0 else price / 100
+
+
+def rubles_to_kopecks(price: Optional[float]) -> Optional[int]:
+    return None if price is None else round(price * 100)
+
+
+def select_products(products: Iterable[Product], min_price: Optional[int] = None,
+                    max_price: Optional[int] = None, sort: Optional[str] = None,
+                    limit: Optional[int] = None) -> List[Product]:
+    """Фильтрация по цене (в копейках), сортировка и ограничение количества."""
+    selected = [
+        p for p in products
+        if (min_price is None or p.price >= min_price) and (max_price is None or p.price <= max_price)
+    ]
+    if sort == "price_asc":
+        selected.sort(key=lambda p: p.price)
+    elif sort == "price_desc":
+        selected.sort(key=lambda p: p.price, reverse=True)
+    if limit is not None:
+        selected = selected[:limit]
+    return selected
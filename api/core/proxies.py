@@ -0,0 +1,191 @@
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+from urllib.parse import urlsplit
+
+from core.metrics import PROXY_LEASES, PROXY_QUARANTINED, PROXY_QUARANTINES
+
+logger = logging.getLogger(__name__)
+
+# Базовая длительность карантина по сигналу; при повторных сбоях подряд удваивается
+QUARANTINE_SECONDS = {
+    "captcha": 600.0,
+    "timeout": 120.0,
+}
+MAX_QUARANTINE_SECONDS = 3600.0
+# HTTP-статусы, которые считаем блокировкой прокси наравне с CAPTCHA
+BLOCK_STATUSES = (403, 429)
+LATENCY_ALPHA = 0.3
+
+
+@dataclass
+class Proxy:
+    url: str
+    latency: float = 1.0
+    successes: int = 0
+    failures: int = 0
+    consecutive_failures: int = 0
+    quarantined_until: float = 0.0
+    sessions: int = 0
+    auth_warned: bool = False
+
+    @property
+    def has_auth(self) -> bool:
+        parts = urlsplit(self.url)
+        return bool(parts.username or parts.password)
+
+    @property
+    def chrome_arg(self) -> str:
+        """Адрес для --proxy-server: Chrome не принимает логин и пароль в URL."""
+        parts = urlsplit(self.url)
+        return f"{parts.scheme}://{parts.hostname}:{parts.port}" if parts.port else f"{parts.scheme}://{parts.hostname}"
+
+    @property
+    def requests_proxies(self) -> dict:
+        return {"http": self.url, "https": self.url}
+
+    def score(self) -> float:
+        """Чем меньше, тем лучше: сглаженная задержка со штрафом за долю ошибок."""
+        failure_rate = self.failures / (self.successes + self.failures + 1)
+        return self.latency * (1 + 5 * failure_rate)
+
+    def available(self, now: float) -> bool:
+        return self.quarantined_until <= now
+
+
+class ProxyLease:
+    """Прокси, закрепленный за одной сессией маркетплейса (одним драйвером или запросом).
+
+    Без настроенных прокси proxy равен None и все методы ничего не делают.
+    """
+
+    def __init__(self, pool: "ProxyPool", marketplace: str, proxy: Optional[Proxy]):
+        self.pool = pool
+        self.marketplace = marketplace
+        self.proxy = proxy
+        self._latency: Optional[float] = None
+
+    @property
+    def chrome_arg(self) -> Optional[str]:
+        if self.proxy is None:
+            return None
+        if self.proxy.has_auth and not self.proxy.auth_warned:
+            # Один раз на прокси: иначе предупреждение повторялось бы на каждый драйвер
+            self.proxy.auth_warned = True
+            logger.warning("Прокси %s требует логин и пароль, которые Chrome из --proxy-server не берет: "
+                           "запросы браузера для %s получат ответ 407. Для браузеров нужен прокси с доступом по IP",
+                           self.proxy.chrome_arg, self.marketplace)
+        return self.proxy.chrome_arg
+
+    @property
+    def requests_proxies(self) -> Optional[dict]:
+        return self.proxy.requests_proxies if self.proxy else None
+
+    @contextmanager
+    def timed(self):
+        """Замеряет длительность загрузки для оценки задержки прокси."""
+        start = time.perf_counter()
+        yield
+        self._latency = time.perf_counter() - start
+
+    def record(self, signal: str):
+        """Результат загрузки через прокси: ok, captcha, timeout или empty (не влияет на оценку)."""
+        if self.proxy is not None:
+            self.pool.record(self.proxy, self.marketplace, signal, self._latency)
+        self._latency = None
+
+    def release(self):
+        if self.proxy is not None:
+            self.pool.release(self.proxy)
+            self.proxy = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+class ProxyPool:
+    """Пул прокси с оценкой по задержке и ошибкам, закреплением за маркетплейсом и карантином."""
+
+    def __init__(self, urls: List[str], max_sessions: int = 2):
+        self.proxies = [Proxy(url) for url in dict.fromkeys(urls)]
+        self.max_sessions = max_sessions
+        self._sticky: Dict[str, Proxy] = {}
+        self._lock = threading.Lock()
+        PROXY_QUARANTINED.set(0)
+
+    def lease(self, marketplace: str) -> ProxyLease:
+        """Выдает прокси для новой сессии: закрепленный за маркетплейсом, если он здоров,
+        иначе лучший по оценке. Если все в карантине или заняты, работаем напрямую."""
+        if not self.proxies:
+            return ProxyLease(self, marketplace, None)
+        with self._lock:
+            now = time.monotonic()
+            sticky = self._sticky.get(marketplace)
+            if sticky and sticky.available(now) and sticky.sessions < self.max_sessions:
+                proxy = sticky
+            else:
+                candidates = [p for p in self.proxies if p.available(now) and p.sessions < self.max_sessions]
+                proxy = min(candidates, key=lambda p: (p.sessions, p.score()), default=None)
+            if proxy is None:
+                PROXY_LEASES.labels(marketplace, "direct").inc()
+                logger.warning("Нет доступных прокси для %s, запрос пойдет напрямую", marketplace)
+                return ProxyLease(self, marketplace, None)
+            proxy.sessions += 1
+            self._sticky[marketplace] = proxy
+            PROXY_LEASES.labels(marketplace, "proxy").inc()
+        return ProxyLease(self, marketplace, proxy)
+
+    def release(self, proxy: Proxy):
+        with self._lock:
+            proxy.sessions = max(0, proxy.sessions - 1)
+
+    def record(self, proxy: Proxy, marketplace: str, signal: str, latency: Optional[float] = None):
+        with self._lock:
+            if signal == "ok":
+                proxy.successes += 1
+                proxy.consecutive_failures = 0
+                if latency is not None:
+                    proxy.latency += LATENCY_ALPHA * (latency - proxy.latency)
+                return
+            if signal not in QUARANTINE_SECONDS:
+                return
+            proxy.failures += 1
+            proxy.consecutive_failures += 1
+            duration = min(
+                MAX_QUARANTINE_SECONDS,
+                QUARANTINE_SECONDS[signal] * 2 ** (proxy.consecutive_failures - 1),
+            )
+            proxy.quarantined_until = time.monotonic() + duration
+            if self._sticky.get(marketplace) is proxy:
+                del self._sticky[marketplace]
+            PROXY_QUARANTINES.labels(signal).inc()
+            self._export()
+        logger.warning("Прокси %s в карантине на %.0f с после сигнала %s (%s)",
+                       proxy.chrome_arg, duration, signal, marketplace)
+
+    def _export(self):
+        now = time.monotonic()
+        PROXY_QUARANTINED.set(sum(not p.available(now) for p in self.proxies))
+
+
+def load_proxy_urls() -> List[str]:
+    """Список прокси из PROXIES (через запятую) и файла PROXY_FILE (по одному в строке)."""
+    urls = [url.strip() for url in os.getenv("PROXIES", "").split(",") if url.strip()]
+    path = os.getenv("PROXY_FILE")
+    if path:
+        try:
+            with open(path, encoding="utf-8") as f:
+                urls.extend(line.strip() for line in f if line.strip() and not line.startswith("#"))
+        except OSError as e:
+            logger.error("Не удалось прочитать файл прокси %s: %s", path, e)
+    return urls
+
+
+PROXY_POOL = ProxyPool(load_proxy_urls(), max_sessions=int(os.getenv("PROXY_MAX_SESSIONS", "2")))
@@ -0,0 +1,70 @@
+import math
+import random
+from dataclasses import dataclass
+from typing import Iterable, Optional
+
+DAY = 24 * 3600
+
+
+class ChangeRate:
+    """Частота изменения цены товара (изменений в секунду) по истории проверок.
+
+    Изменения и время наблюдения забываются экспоненциально с периодом half_life.
+    Без истории оценка равна prior_rate и смещается к наблюдаемой с каждой проверкой.
+    """
+
+    def __init__(self, half_life: float = 7 * DAY, prior_rate: float = 1 / DAY):
+        self.half_life = half_life
+        self.prior_rate = prior_rate
+        self.changes = 0.0
+        self.exposure = 0.0
+        self.last_price: Optional[float] = None
+        self.last_at: Optional[float] = None
+
+    def observe(self, price: float, at: float):
+        if self.last_at is not None:
+            if at < self.last_at:
+                return
+            elapsed = at - self.last_at
+            decay = 0.5 ** (elapsed / self.half_life)
+            self.changes = self.changes * decay + (price != self.last_price)
+            self.exposure = self.exposure * decay + elapsed
+        self.last_price, self.last_at = price, at
+
+    @property
+    def rate(self) -> float:
+        # Априорная оценка весит как одно изменение за 1 / prior_rate секунд
+        return (self.changes + 1) / (self.exposure + 1 / self.prior_rate)
+
+
+@dataclass
+class RefreshPolicy:
+    """Интервал до следующей проверки товара.
+
+    Базовый интервал - 1 / (rate * checks_per_change): товар, меняющийся раз в сутки,
+    при checks_per_change=10 проверяется примерно раз в 2,4 часа. Интервал сокращается
+    в sqrt(subscribers) раз и до 4 раз, когда цена ближе proximity к цели подписчика.
+    Интервал умножается на 1 ± jitter и затем ограничивается [min_interval, max_interval].
+    """
+    min_interval: float = 15 * 60
+    max_interval: float = DAY
+    checks_per_change: float = 10
+    proximity: float = 0.05
+    jitter: float = 0.1
+
+    def interval(self, rate: float, subscribers: int = 1, price: Optional[float] = None,
+                 targets: Iterable[float] = ()) -> float:
+        interval = 1 / (rate * self.checks_per_change)
+        interval /= math.sqrt(max(subscribers, 1))
+        interval *= self.proximity_factor(price, targets)
+        interval *= random.uniform(1 - self.jitter, 1 + self.jitter)
+        return min(max(interval, self.min_interval), self.max_interval)
+
+    def proximity_factor(self, price: Optional[float], targets: Iterable[float]) -> float:
+        """От 0.25 (цена достигла цели) до 1 (цена выше цели больше чем на proximity)."""
+        if not price:
+            return 1.0
+        gaps = [max(0.0, (price - target) / price) for target in targets if target]
+        if not gaps or min(gaps) >= self.proximity:
+            return 1.0
+        return 0.25 + 0.75 * min(gaps) / self.proximity
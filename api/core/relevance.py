@@ -0,0 +1,64 @@
+import logging
+import os
+import re
+from typing import List, Optional, Set
+
+from core.metrics import PARSER_EARLY_STOPS
+from core.products import Product
+
+logger = logging.getLogger(__name__)
+
+# Средняя релевантность страницы выдачи, ниже которой следующие страницы не загружаются
+MIN_RELEVANCE = float(os.getenv("SEARCH_MIN_RELEVANCE", "0.3"))
+WORD_RE = re.compile(r"\w+")
+# Слова сравниваются по началу, чтобы "черный" и "черного" совпадали
+STEM_LENGTH = 5
+
+
+def stems(text: str) -> Set[str]:
+    return {word[:STEM_LENGTH] for word in WORD_RE.findall(text.lower()) if len(word) > 1 or word.isdigit()}
+
+
+def relevance(query_stems: Set[str], title: str) -> float:
+    """Доля слов запроса, встречающихся в названии товара."""
+    if not query_stems:
+        return 1.0
+    return len(query_stems & stems(title)) / len(query_stems)
+
+
+class SearchStop:
+    """Когда парсеру прекращать обход страниц выдачи.
+
+    Обход заканчивается, как только набрано limit товаров или средняя релевантность
+    товаров очередной страницы запросу опустилась ниже min_relevance.
+    """
+
+    def __init__(self, marketplace: str, query: str, limit: Optional[int] = None,
+                 min_relevance: float = MIN_RELEVANCE):
+        self.marketplace = marketplace
+        self.limit = limit
+        self.min_relevance = min_relevance
+        self.query_stems = stems(query)
+
+    def remaining(self, products: List[Product]) -> Optional[int]:
+        """Сколько товаров еще нужно или None без ограничения."""
+        return None if self.limit is None else max(0, self.limit - len(products))
+
+    def full(self, products: List[Product]) -> bool:
+        return self.limit is not None and len(products) >= self.limit
+
+    def page_done(self, products: List[Product], page_start: int) -> bool:
+        """Проверка после обработки страницы; page_start - число товаров до нее."""
+        if self.full(products):
+            PARSER_EARLY_STOPS.labels(self.marketplace, "limit").inc()
+            logger.info("%s: набрано %s товаров, обход страниц завершен", self.marketplace, self.limit)
+            return True
+        page = products[page_start:]
+        if page and self.min_relevance > 0:
+            score = sum(relevance(self.query_stems, p.title) for p in page) / len(page)
+            if score < self.min_relevance:
+                PARSER_EARLY_STOPS.labels(self.marketplace, "relevance").inc()
+                logger.info("%s: релевантность страницы %.2f ниже %.2f, обход страниц завершен",
+                            self.marketplace, score, self.min_relevance)
+                return True
+        return False
@@ -0,0 +1,123 @@
+import fnmatch
+import logging
+import os
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+from core.metrics import PAGE_LOAD_SECONDS, PAGE_TRANSFER_BYTES
+
+logger = logging.getLogger(__name__)
+
+# Шаблоны URL для Network.setBlockedURLs по типу ресурса
+RESOURCE_TYPE_PATTERNS = {
+    "image": ("*.jpg*", "*.jpeg*", "*.png*", "*.gif*", "*.webp*", "*.avif*", "*.svg*", "*.ico*"),
+    "font": ("*.woff*", "*.woff2*", "*.ttf*", "*.otf*", "*.eot*"),
+    "media": ("*.mp4*", "*.webm*", "*.m3u8*", "*.ts?*", "*.mp3*"),
+}
+
+# Аналитика, реклама и счетчики, которые не влияют на выдачу товаров
+THIRD_PARTY_PATTERNS = (
+    "*google-analytics.com*",
+    "*googletagmanager.com*",
+    "*doubleclick.net*",
+    "*mc.yandex.ru*",
+    "*an.yandex.ru*",
+    "*yandex.ru/ads*",
+    "*ads.adfox.ru*",
+    "*top-fwz1.mail.ru*",
+    "*vk.com/rtrg*",
+    "*criteo.*",
+    "*mindbox.ru*",
+    "*tiqcdn.com*",
+)
+
+
+@dataclass(frozen=True)
+class ResourcePolicy:
+    """Что не загружать в headless Chrome: типы ресурсов, шаблоны URL и исключения."""
+    name: str
+    block_types: Tuple[str, ...] = ()
+    block_patterns: Tuple[str, ...] = ()
+    allow_patterns: Tuple[str, ...] = ()
+
+    def blocked_urls(self) -> List[str]:
+        patterns = [p for t in self.block_types for p in RESOURCE_TYPE_PATTERNS[t]]
+        patterns.extend(self.block_patterns)
+        # Шаблон блокировки, под который попадает разрешенный XHR, отбрасываем
+        return [
+            p for p in dict.fromkeys(patterns)
+            if not any(fnmatch.fnmatchcase(allowed, p) for allowed in self.allow_patterns)
+        ]
+
+
+NO_BLOCKING = ResourcePolicy("none")
+
+POLICIES: Dict[str, ResourcePolicy] = {
+    "ozon": ResourcePolicy(
+        "ozon", ("image", "font", "media"), THIRD_PARTY_PATTERNS,
+        ("*ozon.ru/api/entrypoint-api.bx/page/json/*", "*ozon.ru/api/composer-api.bx/*"),
+    ),
+    "wildberries": ResourcePolicy(
+        "wildberries", ("image", "font", "media"), THIRD_PARTY_PATTERNS,
+        ("*search.wb.ru/*", "*card.wb.ru/*"),
+    ),
+    "sbermegamarket": ResourcePolicy(
+        "sbermegamarket", ("image", "font", "media"), THIRD_PARTY_PATTERNS,
+        ("*megamarket.ru/api/mobile/*",),
+    ),
+    # Страницы товара в трекере и при извлечении названия: нужны только текст и мета-теги
+    "product_page": ResourcePolicy("product_page", ("image", "font", "media"), THIRD_PARTY_PATTERNS),
+}
+
+
+def get_policy(name: str) -> ResourcePolicy:
+    """Политика по имени; RESOURCE_POLICY=none отключает блокировку везде."""
+    if os.getenv("RESOURCE_POLICY", "default").lower() == "none":
+        return NO_BLOCKING
+    return POLICIES.get(name, NO_BLOCKING)
+
+
+def apply_resource_policy(driver, name: str) -> ResourcePolicy:
+    policy = get_policy(name)
+    urls = policy.blocked_urls()
+    if not urls:
+        return policy
+    try:
+        driver.execute_cdp_cmd("Network.enable", {})
+        driver.execute_cdp_cmd("Network.setBlockedURLs", {"urls": urls})
+        logger.debug("Политика загрузки ресурсов %s: заблокировано шаблонов %d", policy.name, len(urls))
+    except Exception as e:
+        logger.warning("Не удалось применить политику ресурсов %s: %s", policy.name, e)
+    return policy
+
+
+PAGE_RESOURCES_SCRIPT = """
+const nav = performance.getEntriesByType('navigation')[0];
+const resources = performance.getEntriesByType('resource');
+let bytes = nav ? nav.transferSize : 0;
+for (const r of resources) { bytes += r.transferSize || 0; }
+return {
+    bytes: bytes,
+    requests: resources.length + 1,
+    load_ms: nav && nav.loadEventEnd > 0 ? nav.loadEventEnd - nav.startTime : performance.now()
+};
+"""
+# То же выражением, для Runtime.evaluate
+PAGE_RESOURCES_EXPRESSION = f"(() => {{{PAGE_RESOURCES_SCRIPT}}})()"
+
+
+def record_page_resources(driver, marketplace: str, policy_name: Optional[str] = None) -> Optional[dict]:
+    """Объем переданных данных и время загрузки текущей страницы по Performance API."""
+    try:
+        stats = driver.execute_script(PAGE_RESOURCES_SCRIPT)
+    except Exception as e:
+        logger.debug("Не удалось получить статистику ресурсов страницы: %s", e)
+        return None
+    return observe_page_resources(stats, marketplace, policy_name)
+
+
+def observe_page_resources(stats: dict, marketplace: str, policy_name: Optional[str] = None) -> dict:
+    policy = get_policy(policy_name or marketplace).name
+    PAGE_TRANSFER_BYTES.labels(marketplace, policy).observe(stats["bytes"])
+    PAGE_LOAD_SECONDS.labels(marketplace, policy).observe(stats["load_ms"] / 1000)
+    return stats
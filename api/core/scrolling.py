@@ -0,0 +1,75 @@
+import logging
+import time
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+# Прокручивает страницу и ждет, пока MutationObserver не увидит новые карточки.
+# Если страница еще не докручена до конца, шаг завершается на следующем кадре;
+# внизу страницы ждем новые карточки не дольше idle_ms.
+SCROLL_STEP_FUNCTION = """(selector, step, idleMs) => new Promise(done => {
+    const count = () => document.querySelectorAll(selector).length;
+    const before = count();
+    let finished = false;
+    let timer = null;
+    const observer = new MutationObserver(() => {
+        if (count() > before) finish();
+    });
+    function finish() {
+        if (finished) return;
+        finished = true;
+        observer.disconnect();
+        clearTimeout(timer);
+        const root = document.scrollingElement || document.documentElement;
+        done({
+            before: before,
+            after: count(),
+            atBottom: window.scrollY + window.innerHeight >= root.scrollHeight - 2
+        });
+    }
+    observer.observe(document.body, {childList: true, subtree: true});
+    if (step) {
+        window.scrollBy(0, step);
+    } else {
+        window.scrollTo(0, document.body.scrollHeight);
+    }
+    const root = document.scrollingElement || document.documentElement;
+    if (window.scrollY + window.innerHeight < root.scrollHeight - 2) {
+        requestAnimationFrame(() => finish());
+    } else {
+        timer = setTimeout(finish, idleMs);
+    }
+})"""
+# Для execute_async_script: результат передается в callback последним аргументом
+SCROLL_STEP_SCRIPT = f"""
+const [selector, step, idleMs, done] = arguments;
+({SCROLL_STEP_FUNCTION})(selector, step, idleMs).then(done);
+"""
+
+
+def scroll_until_loaded(driver, tile_selector: str, target: Optional[int] = None,
+                        max_time: float = 10, idle_timeout: float = 1.5, step: Optional[int] = None) -> int:
+    """Прокрутка до тех пор, пока растет число карточек или не достигнут target.
+
+    step=None прокручивает сразу в конец страницы, иначе на step пикселей за шаг.
+    Возвращает число карточек на странице после прокрутки.
+    """
+    deadline = time.monotonic() + max_time
+    count = 0
+    steps = 0
+    try:
+        driver.set_script_timeout(idle_timeout + 5)
+        while time.monotonic() < deadline:
+            state = driver.execute_async_script(
+                SCROLL_STEP_SCRIPT, tile_selector, step or 0, int(idle_timeout * 1000)
+            )
+            steps += 1
+            count = state["after"]
+            if target and count >= target:
+                break
+            if state["atBottom"] and state["after"] == state["before"]:
+                break
+        logger.debug("Прокрутка завершена: шагов %s, карточек %s", steps, count)
+    except Exception as e:
+        logger.error("Ошибка при прокрутке страницы: %s", e)
+    return count
@@ -0,0 +1,107 @@
+import gzip
+import json
+from typing import Dict, Iterable, List, Optional
+
+from fastapi import Response
+
+from core.products import Product, kopecks_to_rubles
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COLUMNAR_MEDIA_TYPE = "application/vnd.sauce.columnar+json"
+PRODUCT_FIELDS = ("title", "price", "link", "image", "article")
+MIN_COMPRESS_SIZE = 1024
+
+
+def to_columnar(results: Dict[str, List[Product]]) -> dict:
+    """Колоночное представление: по параллельному массиву на каждое поле маркетплейса."""
+    payload = {"format": "columnar", "fields": list(PRODUCT_FIELDS)}
+    for marketplace, products in results.items():
+        payload[marketplace] = {
+            "title": [p.title for p in products],
+            "price": [kopecks_to_rubles(p.price) for p in products],
+            "link": [p.link for p in products],
+            "image": [p.image for p in products],
+            "article": [p.article for p in products],
+        }
+    return payload
+
+
+def dumps(payload) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(payload)
+    return json.dumps(payload, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def wants_columnar(accept: Optional[str], response_format: Optional[str]) -> bool:
+    if response_format:
+        return response_format == "columnar"
+    return bool(accept) and COLUMNAR_MEDIA_TYPE in accept
+
+
+def parse_accept_encoding(header: Optional[str]) -> Dict[str, float]:
+    encodings = {}
+    for part in (header or "").split(","):
+        name, _, params = part.strip().partition(";")
+        if not name:
+            continue
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        encodings[name.strip().lower()] = quality
+    return encodings
+
+
+def choose_encoding(accept_encoding: Optional[str]) -> Optional[str]:
+    """Выбирает br или gzip с учетом q-значений из Accept-Encoding."""
+    encodings = parse_accept_encoding(accept_encoding)
+    candidates = ["br", "gzip"] if brotli is not None else ["gzip"]
+    best = None
+    for name in candidates:
+        quality = encodings.get(name, encodings.get("*", 0.0))
+        if quality > 0 and (best is None or quality > best[1]):
+            best = (name, quality)
+    return best[0] if best else None
+
+
+def compress(body: bytes, encoding: Optional[str]) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body, quality=5)
+    if encoding == "gzip":
+        return gzip.compress(body, compresslevel=5)
+    return body
+
+
+def encoded_response(payload, accept_encoding: Optional[str], media_type: str,
+                     headers: Optional[Dict[str, str]] = None) -> Response:
+    body = dumps(payload)
+    headers = dict(headers or {})
+    headers["Vary"] = "Accept, Accept-Encoding"
+    encoding = choose_encoding(accept_encoding) if len(body) >= MIN_COMPRESS_SIZE else None
+    if encoding:
+        body = compress(body, encoding)
+        headers["Content-Encoding"] = encoding
+    return Response(content=body, media_type=media_type, headers=headers)
+
+
+def columnar_response(results: Dict[str, Iterable[Product]], accept_encoding: Optional[str],
+                      headers: Optional[Dict[str, str]] = None, timings: Optional[dict] = None,
+                      errors: Optional[Dict[str, str]] = None) -> Response:
+    payload = to_columnar({m: list(products) for m, products in results.items()})
+    if timings is not None:
+        payload["timings"] = timings
+    if errors:
+        payload["errors"] = errors
+    return encoded_response(payload, accept_encoding, COLUMNAR_MEDIA_TYPE, headers)
@@ -0,0 +1,244 @@
+import bisect
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from typing import Iterable, List, Optional
+
+try:
+    from appwrite.exception import AppwriteException
+    from appwrite.query import Query
+except ImportError:
+    AppwriteException = Query = None
+
+from core.metrics import TRACKER_MEMBERS
+
+logger = logging.getLogger(__name__)
+
+# Виртуальных точек на экземпляр: чем больше, тем ровнее доли
+VNODES = 128
+
+
+def ring_hash(value: str) -> int:
+    return int.from_bytes(hashlib.md5(value.encode("utf-8")).digest()[:8], "big")
+
+
+class HashRing:
+    """Консистентное хеширование: ключ принадлежит первой точке кольца по часовой стрелке.
+
+    При добавлении или уходе одного из N экземпляров владельца меняет примерно 1/N ключей.
+    """
+
+    def __init__(self, nodes: Iterable[str] = (), vnodes: int = VNODES):
+        self.nodes = frozenset(nodes)
+        points = sorted((ring_hash(f"{node}#{i}"), node) for node in self.nodes for i in range(vnodes))
+        self._hashes = [point for point, _ in points]
+        self._owners = [node for _, node in points]
+
+    def node_for(self, key: str) -> Optional[str]:
+        if not self._hashes:
+            return None
+        index = bisect.bisect(self._hashes, ring_hash(key)) % len(self._hashes)
+        return self._owners[index]
+
+
+class Membership(ABC):
+    """Реестр живых экземпляров трекера.
+
+    Экземпляр отмечается не реже чем раз в ttl секунд; не отметившиеся считаются ушедшими.
+    В Redis то же ложится на сортированное множество с временем отметки.
+    """
+
+    def __init__(self, ttl: float = 45):
+        self.ttl = ttl
+
+    def setup(self):
+        """Готовит хранилище реестра при запуске сервиса."""
+
+    @abstractmethod
+    def heartbeat(self, instance_id: str):
+        pass
+
+    @abstractmethod
+    def members(self) -> List[str]:
+        """Экземпляры, отметившиеся за последние ttl секунд."""
+
+    @abstractmethod
+    def leave(self, instance_id: str):
+        pass
+
+
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS tracker_members (
+    id TEXT PRIMARY KEY,
+    heartbeat_at REAL NOT NULL
+);
+"""
+
+
+class SqliteMembership(Membership):
+    """Реестр в файле SQLite: только для экземпляров на одной машине."""
+
+    def __init__(self, path: str, ttl: float = 45):
+        super().__init__(ttl)
+        self.path = path
+        self._local = threading.local()
+        self._connection().executescript(SQLITE_SCHEMA)
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def heartbeat(self, instance_id: str):
+        self._connection().execute(
+            "INSERT INTO tracker_members (id, heartbeat_at) VALUES (?, ?) "
+            "ON CONFLICT (id) DO UPDATE SET heartbeat_at = excluded.heartbeat_at",
+            (instance_id, time.time()),
+        )
+
+    def members(self) -> List[str]:
+        conn = self._connection()
+        expired = time.time() - self.ttl
+        conn.execute("DELETE FROM tracker_members WHERE heartbeat_at < ?", (expired,))
+        return [row[0] for row in conn.execute("SELECT id FROM tracker_members ORDER BY id")]
+
+    def leave(self, instance_id: str):
+        self._connection().execute("DELETE FROM tracker_members WHERE id = ?", (instance_id,))
+
+
+class AppwriteMembership(Membership):
+    """Реестр в коллекции Appwrite: общий для экземпляров на разных машинах.
+
+    Экземпляр - документ с атрибутами instance и heartbeat_at. Id документа - хеш
+    идентификатора экземпляра: Appwrite допускает в id не все символы.
+    """
+
+    def __init__(self, databases, database_id: str, collection_id: str, ttl: float = 45):
+        if AppwriteException is None:
+            raise RuntimeError("Реестр appwrite требует пакет appwrite")
+        super().__init__(ttl)
+        self.databases = databases
+        self.database_id = database_id
+        self.collection_id = collection_id
+
+    def setup(self):
+        """Создает коллекцию реестра и ее атрибуты, если их еще нет."""
+        try:
+            self.databases.get_collection(database_id=self.database_id, collection_id=self.collection_id)
+        except AppwriteException as e:
+            if e.code != 404:
+                raise
+            self.databases.create_collection(database_id=self.database_id, collection_id=self.collection_id,
+                                             name=self.collection_id)
+        attributes = self.databases.list_attributes(database_id=self.database_id, collection_id=self.collection_id)
+        existing_attributes = {attr['key'] for attr in attributes['attributes']}
+        if 'instance' not in existing_attributes:
+            self.databases.create_string_attribute(database_id=self.database_id, collection_id=self.collection_id,
+                                                   key="instance", size=255, required=True)
+        if 'heartbeat_at' not in existing_attributes:
+            self.databases.create_float_attribute(database_id=self.database_id, collection_id=self.collection_id,
+                                                  key="heartbeat_at", required=True)
+
+    @staticmethod
+    def document_id(instance_id: str) -> str:
+        return hashlib.md5(instance_id.encode("utf-8")).hexdigest()
+
+    def heartbeat(self, instance_id: str):
+        data = {"instance": instance_id, "heartbeat_at": time.time()}
+        document_id = self.document_id(instance_id)
+        try:
+            self.databases.update_document(database_id=self.database_id, collection_id=self.collection_id,
+                                           document_id=document_id, data=data)
+        except AppwriteException as e:
+            if e.code != 404:
+                raise
+            self.databases.create_document(database_id=self.database_id, collection_id=self.collection_id,
+                                           document_id=document_id, data=data)
+
+    def members(self) -> List[str]:
+        documents = self.databases.list_documents(
+            database_id=self.database_id, collection_id=self.collection_id,
+            queries=[Query.greater_than("heartbeat_at", time.time() - self.ttl), Query.limit(1000)],
+        )["documents"]
+        return sorted(document["instance"] for document in documents)
+
+    def leave(self, instance_id: str):
+        try:
+            self.databases.delete_document(database_id=self.database_id, collection_id=self.collection_id,
+                                           document_id=self.document_id(instance_id))
+        except AppwriteException as e:
+            if e.code != 404:
+                raise
+
+
+def get_membership(url: Optional[str] = None, databases=None, database_id: Optional[str] = None) -> Membership:
+    """Реестр по TRACKER_REGISTRY_URL.
+
+    appwrite:///коллекция - коллекция в базе database_id клиента databases, общая для всех машин;
+    sqlite:///путь/к/файлу - только для экземпляров на одной машине.
+    """
+    url = url or os.getenv("TRACKER_REGISTRY_URL", "appwrite:///tracker-members")
+    ttl = float(os.getenv("TRACKER_MEMBER_TTL", "45"))
+    if url.startswith("appwrite:///"):
+        if databases is None or not database_id:
+            raise ValueError("Реестр appwrite требует клиент Appwrite Databases и database_id")
+        return AppwriteMembership(databases, database_id, url[len("appwrite:///"):], ttl=ttl)
+    if url.startswith("sqlite:///"):
+        logger.warning("Реестр экземпляров трекера в файле %s: экземпляры на других машинах его не видят "
+                       "и проверят все товары сами", url)
+        return SqliteMembership(url[len("sqlite:///"):], ttl=ttl)
+    raise ValueError(f"Неподдерживаемый реестр {url}: ожидается appwrite:///коллекция или sqlite:///путь")
+
+
+class Shard:
+    """Доля отслеживаемых товаров одного экземпляра трекера."""
+
+    def __init__(self, membership: Membership, instance_id: str, vnodes: int = VNODES):
+        self.membership = membership
+        self.instance_id = instance_id
+        self.vnodes = vnodes
+        self.ring = HashRing([instance_id], vnodes)
+        self.last_seen = time.monotonic()
+
+    def refresh(self) -> bool:
+        """Отмечает экземпляр в реестре и перестраивает кольцо; True, если состав изменился.
+
+        Пока реестр недоступен не дольше ttl, остается прежнее кольцо. Дольше - неизвестно,
+        живы ли остальные экземпляры, и этот берет все товары: лучше дважды проверить товар,
+        чем пропустить его.
+        """
+        try:
+            self.membership.heartbeat(self.instance_id)
+            members = set(self.membership.members()) | {self.instance_id}
+        except Exception as e:
+            logger.error("Реестр экземпляров трекера недоступен: %s", e)
+            if time.monotonic() - self.last_seen < self.membership.ttl or self.ring.nodes == {self.instance_id}:
+                return False
+            logger.warning("Реестр недоступен дольше %s с: экземпляр %s проверяет все товары",
+                           self.membership.ttl, self.instance_id)
+            members = {self.instance_id}
+        else:
+            self.last_seen = time.monotonic()
+        TRACKER_MEMBERS.set(len(members))
+        if members == self.ring.nodes:
+            return False
+        logger.info("Состав экземпляров трекера изменился: %s -> %s",
+                    sorted(self.ring.nodes), sorted(members))
+        self.ring = HashRing(members, self.vnodes)
+        return True
+
+    def owns(self, key: str) -> bool:
+        return self.ring.node_for(key) == self.instance_id
+
+    def leave(self):
+        try:
+            self.membership.leave(self.instance_id)
+        except Exception as e:
+            logger.error("Не удалось выйти из реестра экземпляров трекера: %s", e)
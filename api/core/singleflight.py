@@ -0,0 +1,51 @@
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, Hashable
+
+from core.metrics import SINGLEFLIGHT_CALLS
+
+logger = logging.getLogger(__name__)
+
+
+class _Call:
+    __slots__ = ("task", "waiters")
+
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0
+
+
+class SingleFlight:
+    """Объединение одинаковых одновременных вызовов в одну задачу.
+
+    Первый вызов с ключом запускает задачу, остальные ждут ее же результат.
+    Отмена одного из ожидающих не отменяет задачу для других; задача отменяется,
+    только когда ее перестали ждать все.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._calls: Dict[Hashable, _Call] = {}
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        call = self._calls.get(key)
+        if call is None:
+            SINGLEFLIGHT_CALLS.labels(self.name, "leader").inc()
+            call = _Call(asyncio.ensure_future(fn()))
+            self._calls[key] = call
+            call.task.add_done_callback(lambda task: self._forget(key, call))
+        else:
+            SINGLEFLIGHT_CALLS.labels(self.name, "follower").inc()
+            logger.debug("Присоединение к выполняющемуся запросу %s: %s", self.name, key)
+        call.waiters += 1
+        try:
+            return await asyncio.shield(call.task)
+        finally:
+            call.waiters -= 1
+            if call.waiters == 0 and not call.task.done():
+                logger.debug("Все ожидающие отменили запрос %s: %s", self.name, key)
+                call.task.cancel()
+
+    def _forget(self, key: Hashable, call: _Call):
+        if self._calls.get(key) is call:
+            del self._calls[key]
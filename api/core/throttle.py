@@ -0,0 +1,264 @@
+import asyncio
+import logging
+import os
+import random
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import asynccontextmanager, contextmanager
+from dataclasses import dataclass
+from typing import Dict, Optional, Tuple
+
+from core.metrics import BLOCK_SIGNALS, THROTTLE_CONCURRENCY, THROTTLE_DELAY_SECONDS
+
+logger = logging.getLogger(__name__)
+
+# Сигналы блокировки и во сколько раз после них растет задержка между переходами
+BACKOFF_FACTORS = {
+    "captcha": 4.0,
+    "timeout": 2.0,
+    "empty": 1.5,
+}
+
+
+@dataclass(frozen=True)
+class ThrottleConfig:
+    initial_delay: float
+    min_delay: float = 0.5
+    max_delay: float = 60.0
+    delay_step: float = 0.25
+    initial_concurrency: float = 2
+    max_concurrency: int = 4
+    concurrency_step: float = 0.25
+    jitter: float = 0.2
+
+
+# Настройки маркетплейсов задают их адаптеры в parsers.parsers_registry
+CONFIGS: Dict[str, ThrottleConfig] = {}
+DEFAULT_CONFIG = ThrottleConfig(initial_delay=2.0)
+
+# Где хранится состояние регуляторов: sqlite:///путь - общее для всех процессов машины
+# (API, трекер, воркеры ходят на маркетплейсы с одного адреса), memory - свое у процесса.
+# Файл по умолчанию лежит в каталоге api, а не в текущем: сервисы запускаются из разных каталогов
+DEFAULT_STATE_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "throttle.sqlite3")
+THROTTLE_STATE_URL = os.getenv("THROTTLE_STATE_URL", f"sqlite:///{DEFAULT_STATE_PATH}")
+# Слот процесса, упавшего во время перехода, освобождается через столько секунд
+SLOT_TTL = 300
+POLL_INTERVAL = 0.2
+
+
+class Throttle:
+    """AIMD-регулятор переходов по страницам одного маркетплейса.
+
+    Пока сайт отвечает нормально, задержка между переходами уменьшается на delay_step,
+    а допустимое число одновременных загрузок растет на concurrency_step.
+    После CAPTCHA, таймаута или пустой выдачи задержка умножается на BACKOFF_FACTORS,
+    а параллелизм делится пополам.
+    """
+
+    def __init__(self, marketplace: str, config: ThrottleConfig = DEFAULT_CONFIG):
+        self.marketplace = marketplace
+        self.config = config
+        self.delay = config.initial_delay
+        self.concurrency = float(config.initial_concurrency)
+        self.in_flight = 0
+        self.next_start = 0.0
+        self._cond = threading.Condition()
+        self._export()
+
+    @property
+    def cautious(self) -> bool:
+        """Недавно были сигналы блокировки и задержка еще не вернулась к исходной."""
+        return self.delay > self.config.initial_delay
+
+    @contextmanager
+    def navigation(self):
+        """Ждет свободный слот и паузу с последнего перехода, затем выполняет переход."""
+        slot, pause = self._acquire()
+        try:
+            if pause > 0:
+                time.sleep(pause)
+            yield
+        finally:
+            self._release(slot)
+
+    @asynccontextmanager
+    async def navigation_async(self):
+        """navigation() для asyncio: слот ожидается в потоке, пауза - без блокировки цикла."""
+        slot, pause = await asyncio.to_thread(self._acquire)
+        try:
+            if pause > 0:
+                await asyncio.sleep(pause)
+            yield
+        finally:
+            await asyncio.to_thread(self._release, slot)
+
+    def _acquire(self) -> Tuple[Optional[str], float]:
+        """Занимает слот и возвращает его и сколько ждать до перехода."""
+        with self._cond:
+            while self.in_flight >= max(1, int(self.concurrency)):
+                self._cond.wait()
+            self.in_flight += 1
+            now = time.monotonic()
+            start = max(now, self.next_start)
+            self.next_start = start + self._gap()
+        return None, start - now
+
+    def _release(self, slot: Optional[str]):
+        with self._cond:
+            self.in_flight -= 1
+            self._cond.notify()
+
+    def _gap(self) -> float:
+        return self.delay * random.uniform(1 - self.config.jitter, 1 + self.config.jitter)
+
+    def record(self, signal: str):
+        """Учитывает результат перехода: ok или сигнал блокировки (captcha, timeout, empty)."""
+        with self._cond:
+            self.next_start = self._adjust(signal, self.next_start, time.monotonic())
+            self._export()
+            self._cond.notify_all()
+
+    def _adjust(self, signal: str, next_start: float, now: float) -> float:
+        """Меняет задержку и параллелизм по сигналу и возвращает новое время следующего перехода."""
+        config = self.config
+        if signal == "ok":
+            self.delay = max(config.min_delay, self.delay - config.delay_step)
+            self.concurrency = min(config.max_concurrency, self.concurrency + config.concurrency_step)
+            return next_start
+        BLOCK_SIGNALS.labels(self.marketplace, signal).inc()
+        self.delay = min(config.max_delay, self.delay * BACKOFF_FACTORS[signal])
+        self.concurrency = max(1.0, self.concurrency / 2)
+        logger.warning(
+            "Сигнал блокировки %s для %s: задержка %.1f с, параллелизм %d",
+            signal, self.marketplace, self.delay, int(self.concurrency)
+        )
+        # Уже запланированные переходы тоже отодвигаем
+        return max(next_start, now + self.delay)
+
+    def _export(self):
+        THROTTLE_DELAY_SECONDS.labels(self.marketplace).set(self.delay)
+        THROTTLE_CONCURRENCY.labels(self.marketplace).set(int(self.concurrency))
+
+
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS throttle_state (
+    marketplace TEXT PRIMARY KEY,
+    delay REAL NOT NULL,
+    concurrency REAL NOT NULL,
+    next_start REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS throttle_slots (
+    id TEXT PRIMARY KEY,
+    marketplace TEXT NOT NULL,
+    acquired_at REAL NOT NULL
+);
+"""
+
+
+class SqliteThrottle(Throttle):
+    """Throttle, состояние которого лежит в файле SQLite и общее для всех процессов.
+
+    Задержка, параллелизм, время следующего перехода и занятые слоты читаются и
+    меняются в одной транзакции, поэтому сигнал блокировки, полученный трекером,
+    сразу замедляет и парсеры. Время - time.time(), общее для процессов.
+    """
+
+    def __init__(self, marketplace: str, config: ThrottleConfig, path: str):
+        self.path = path
+        self._local = threading.local()
+        super().__init__(marketplace, config)
+        conn = self._connection()
+        conn.executescript(SQLITE_SCHEMA)
+        conn.execute(
+            "INSERT OR IGNORE INTO throttle_state (marketplace, delay, concurrency, next_start) VALUES (?, ?, ?, 0)",
+            (marketplace, config.initial_delay, float(config.initial_concurrency)),
+        )
+        with self._transaction() as conn:
+            self._load(conn)
+        self._export()
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def _transaction(self):
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    def _load(self, conn: sqlite3.Connection) -> float:
+        """Читает общее состояние в self.delay и self.concurrency, возвращает next_start."""
+        self.delay, self.concurrency, next_start = conn.execute(
+            "SELECT delay, concurrency, next_start FROM throttle_state WHERE marketplace = ?",
+            (self.marketplace,),
+        ).fetchone()
+        return next_start
+
+    def _acquire(self) -> Tuple[Optional[str], float]:
+        slot = uuid.uuid4().hex
+        while True:
+            with self._transaction() as conn:
+                next_start = self._load(conn)
+                now = time.time()
+                conn.execute("DELETE FROM throttle_slots WHERE marketplace = ? AND acquired_at < ?",
+                             (self.marketplace, now - SLOT_TTL))
+                in_flight = conn.execute("SELECT COUNT(*) FROM throttle_slots WHERE marketplace = ?",
+                                         (self.marketplace,)).fetchone()[0]
+                if in_flight < max(1, int(self.concurrency)):
+                    start = max(now, next_start)
+                    conn.execute("INSERT INTO throttle_slots (id, marketplace, acquired_at) VALUES (?, ?, ?)",
+                                 (slot, self.marketplace, now))
+                    conn.execute("UPDATE throttle_state SET next_start = ? WHERE marketplace = ?",
+                                 (start + self._gap(), self.marketplace))
+                    return slot, start - now
+            time.sleep(POLL_INTERVAL)
+
+    def _release(self, slot: Optional[str]):
+        self._connection().execute("DELETE FROM throttle_slots WHERE id = ?", (slot,))
+
+    def record(self, signal: str):
+        with self._transaction() as conn:
+            next_start = self._adjust(signal, self._load(conn), time.time())
+            conn.execute(
+                "UPDATE throttle_state SET delay = ?, concurrency = ?, next_start = ? WHERE marketplace = ?",
+                (self.delay, self.concurrency, next_start, self.marketplace),
+            )
+        self._export()
+
+
+_throttles: Dict[str, Throttle] = {}
+_throttles_lock = threading.Lock()
+
+
+def new_throttle(marketplace: str, config: ThrottleConfig) -> Throttle:
+    if THROTTLE_STATE_URL == "memory":
+        return Throttle(marketplace, config)
+    if THROTTLE_STATE_URL.startswith("sqlite:///"):
+        return SqliteThrottle(marketplace, config, THROTTLE_STATE_URL[len("sqlite:///"):])
+    raise ValueError(f"Неподдерживаемое хранилище {THROTTLE_STATE_URL}: ожидается sqlite:///путь или memory")
+
+
+def configure_throttle(marketplace: str, config: ThrottleConfig):
+    with _throttles_lock:
+        CONFIGS[marketplace] = config
+        _throttles.pop(marketplace, None)
+
+
+def get_throttle(marketplace: str) -> Throttle:
+    """Регулятор маркетплейса для парсеров и трекера; общий для процессов, см. THROTTLE_STATE_URL."""
+    with _throttles_lock:
+        if marketplace not in _throttles:
+            _throttles[marketplace] = new_throttle(marketplace, CONFIGS.get(marketplace, DEFAULT_CONFIG))
+        return _throttles[marketplace]
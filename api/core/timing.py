@@ -0,0 +1,66 @@
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Optional
+
+_current: ContextVar[Optional["Timings"]] = ContextVar("timings", default=None)
+
+
+class Timings:
+    """Сборщик длительностей этапов одного запроса (в миллисекундах).
+
+    Спаны с одинаковым именем суммируются. Объект общий для потоков парсеров,
+    поэтому запись защищена блокировкой.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._spans: Dict[str, float] = {}
+
+    def add(self, name: str, seconds: float):
+        with self._lock:
+            self._spans[name] = self._spans.get(name, 0.0) + seconds * 1000
+
+    @contextmanager
+    def span(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start)
+
+    def as_dict(self) -> Dict[str, float]:
+        with self._lock:
+            return {name: round(ms, 1) for name, ms in self._spans.items()}
+
+    def server_timing(self) -> str:
+        """Значение заголовка Server-Timing."""
+        return ", ".join(f"{name};dur={ms}" for name, ms in self.as_dict().items())
+
+
+def start_timings() -> Timings:
+    timings = Timings()
+    _current.set(timings)
+    return timings
+
+
+def current_timings() -> Optional[Timings]:
+    return _current.get()
+
+
+@contextmanager
+def span(name: str):
+    """Замер этапа в сборщик текущего запроса; без сборщика ничего не делает."""
+    timings = _current.get()
+    if timings is None:
+        yield
+        return
+    with timings.span(name):
+        yield
+
+
+def add_span(name: str, seconds: float):
+    timings = _current.get()
+    if timings is not None:
+        timings.add(name, seconds)
@@ -0,0 +1,49 @@
+import re
+from typing import Dict, Optional, Pattern, Tuple
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+from core.products import marketplace_for_url
+
+# Параметры, которые не меняют страницу товара: метки рекламы и аналитики
+TRACKING_PREFIXES = ("utm_",)
+TRACKING_PARAMS = {"yclid", "gclid", "fbclid", "_openstat", "ref", "asb", "asb2", "keywords", "sh", "from_sku"}
+
+# Маркетплейс -> регулярное выражение с артикулом в первой группе, ищется в пути ссылки.
+# Заполняется при регистрации адаптеров в parsers.parsers_registry
+ARTICLE_PATTERNS: Dict[str, Pattern] = {}
+
+
+def register_article_pattern(marketplace: str, pattern: str):
+    ARTICLE_PATTERNS[marketplace] = re.compile(pattern)
+
+
+def canonical_url(url: str) -> str:
+    """Приводит ссылку к одному виду: схема и хост в нижнем регистре, без фрагмента,
+    меток отслеживания и завершающего слэша, параметры отсортированы."""
+    parts = urlsplit(url.strip())
+    query = sorted(
+        (name, value) for name, value in parse_qsl(parts.query, keep_blank_values=True)
+        if not name.lower().startswith(TRACKING_PREFIXES) and name.lower() not in TRACKING_PARAMS
+    )
+    host = (parts.hostname or "").lower()
+    if host.startswith("www."):
+        host = host[4:]
+    netloc = f"{host}:{parts.port}" if parts.port else host
+    path = parts.path.rstrip("/") or "/"
+    return urlunsplit((parts.scheme.lower(), netloc, path, urlencode(query), ""))
+
+
+def recognize(url: str) -> Optional[Tuple[str, str]]:
+    """(маркетплейс, артикул) из ссылки на товар без загрузки страницы."""
+    marketplace = marketplace_for_url(url)
+    pattern = ARTICLE_PATTERNS.get(marketplace)
+    if pattern is None:
+        return None
+    match = pattern.search(urlsplit(url.strip()).path)
+    return (marketplace, match.group(1)) if match else None
+
+
+def product_key(url: str) -> str:
+    """Ключ товара для кэшей и дедупликации: marketplace:article или каноническая ссылка."""
+    recognized = recognize(url)
+    return f"{recognized[0]}:{recognized[1]}" if recognized else canonical_url(url)
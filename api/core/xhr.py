@@ -0,0 +1,117 @@
+import base64
+import json
+import logging
+import os
+import re
+import time
+from typing import Any, List, Sequence
+
+logger = logging.getLogger(__name__)
+
+# xhr - товары из JSON-ответов поискового API страницы, dom - разбор карточек.
+# В режиме xhr парсеры возвращаются к DOM, если ответы не перехвачены
+EXTRACTION_MODE = os.getenv("SEARCH_EXTRACTION", "xhr")
+POLL_INTERVAL = 0.2
+
+
+def xhr_enabled() -> bool:
+    return EXTRACTION_MODE == "xhr"
+
+
+def enable_performance_log(options):
+    """Включает performance-лог Chrome: из него берутся события Network.* страницы."""
+    if xhr_enabled():
+        options.set_capability("goog:loggingPrefs", {"performance": "ALL"})
+
+
+class ResponseCapture:
+    """Перехват JSON-ответов, которые страница получает сама, через performance-лог и CDP.
+
+    patterns - регулярные выражения для URL нужных запросов. Тело ответа читается
+    командой Network.getResponseBody после события Network.loadingFinished.
+    """
+
+    def __init__(self, driver, patterns: Sequence[str]):
+        self.driver = driver
+        self.patterns = [re.compile(pattern) for pattern in patterns]
+
+    def reset(self):
+        """Отбрасывает накопленные события; вызывается перед переходом на новую страницу."""
+        self._read_log()
+
+    def collect(self, timeout: float = 10, settle: float = 0.5, idle: float = 1.5) -> List[Any]:
+        """Ждет завершения подходящих запросов и возвращает разобранные JSON-ответы.
+
+        После последнего завершенного запроса ждет еще settle секунд на случай
+        дополнительных запросов. Если страница загрузилась и за idle секунд подходящий
+        запрос так и не был отправлен, сразу возвращает [] - парсер переходит к DOM.
+        """
+        deadline = time.monotonic() + timeout
+        urls = {}
+        finished = []
+        failed = set()
+        last_finished = 0.0
+        loaded_at = None
+        while time.monotonic() < deadline:
+            for entry in self._read_log():
+                try:
+                    message = json.loads(entry["message"])["message"]
+                except (KeyError, ValueError):
+                    continue
+                method = message.get("method")
+                params = message.get("params", {})
+                if method in ("Network.requestWillBeSent", "Network.responseReceived"):
+                    key = "request" if method == "Network.requestWillBeSent" else "response"
+                    url = params.get(key, {}).get("url", "")
+                    if any(pattern.search(url) for pattern in self.patterns):
+                        urls[params["requestId"]] = url
+                elif method == "Network.loadingFinished" and params.get("requestId") in urls:
+                    finished.append(params["requestId"])
+                    last_finished = time.monotonic()
+                elif method == "Network.loadingFailed" and params.get("requestId") in urls:
+                    failed.add(params["requestId"])
+            now = time.monotonic()
+            if len(finished) + len(failed) == len(urls):
+                if finished and now - last_finished >= settle:
+                    break
+                if not urls:
+                    if loaded_at is None and self._loaded():
+                        loaded_at = now
+                    if loaded_at is not None and now - loaded_at >= idle:
+                        break
+                elif not finished:
+                    # Все подходящие запросы завершились ошибкой
+                    break
+            time.sleep(POLL_INTERVAL)
+
+        payloads = []
+        for request_id in finished:
+            payload = self._body(request_id, urls[request_id])
+            if payload is not None:
+                payloads.append(payload)
+        logger.debug("Перехвачено ответов API: %s из %s", len(payloads), len(urls))
+        return payloads
+
+    def _loaded(self) -> bool:
+        try:
+            return self.driver.execute_script("return document.readyState") == "complete"
+        except Exception:
+            return False
+
+    def _read_log(self):
+        try:
+            return self.driver.get_log("performance")
+        except Exception as e:
+            logger.debug("Performance-лог недоступен: %s", e)
+            return []
+
+    def _body(self, request_id: str, url: str):
+        try:
+            result = self.driver.execute_cdp_cmd("Network.getResponseBody", {"requestId": request_id})
+            body = result.get("body", "")
+            if result.get("base64Encoded"):
+                body = base64.b64decode(body).decode("utf-8")
+            return json.loads(body)
+        except Exception as e:
+            logger.warning("Не удалось прочитать ответ %s: %s", url, e)
+            return None
@@ -1,23 +1,40 @@
+import html
 import json
 import logging
+import re
 import time
-import random
 from selenium import webdriver
 from selenium.webdriver.chrome.options import Options
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
 from selenium.common.exceptions import TimeoutException
-
-# Set up logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s | %(levelname)s | %(message)s',
-    datefmt='%Y-%m-%d %H:%M:%S'
+from core.products import Product, parse_price
+from core.proxies import PROXY_POOL
+from core.throttle import get_throttle
+from core.scrolling import scroll_until_loaded
+from core.relevance import SearchStop
+from core.resources import apply_resource_policy, record_page_resources
+from core.xhr import ResponseCapture, enable_performance_log, xhr_enabled
+from core.metrics import (
+    CAPTCHA_DETECTIONS, CHROME_LAUNCH_SECONDS, PAGE_EXTRACTION_SOURCE, PAGES_SCRAPED, PARSER_DURATION_SECONDS,
+    PRODUCTS_PER_PAGE, TIMEOUTS
 )
-logger = logging.getLogger()
+from core.timing import add_span, span
+
+OZON_URL = "https://www.ozon.ru"
+TILE_SELECTOR = "div.tile-root"
+PRICE_SELECTOR = "[data-widget='webPrice'] span"
+# Первая страница выдачи приходит с сервера: состояние виджета лежит в data-state,
+# следующие порции страница запрашивает у entrypoint-api
+STATE_SELECTOR = "div[id^='state-searchResultsV2']"
+SEARCH_API_PATTERNS = (r"/api/entrypoint-api\.bx/page/json/v2\?url=(?:/|%2F)search",)
+ARTICLE_RE = re.compile(r"/product/(?:[^/?]*-)?(\d+)")
 
-def setup_selenium():
+logger = logging.getLogger(__name__)
+item_logger = logging.getLogger(f"{__name__}.items")
+
+def setup_selenium(proxy=None):
     """Initialize Selenium with headless Chrome."""
     options = Options()
     options.add_argument("--headless=new")
@@ -37,45 +54,113 @@ def setup_selenium():
     )
     options.add_argument("--disable-cache")
     options.add_argument("--disk-cache-size=0")
+    if proxy:
+        logger.info("Using proxy: %s", proxy)
+        options.add_argument(f"--proxy-server={proxy}")
+    enable_performance_log(options)
     try:
-        driver = webdriver.Chrome(options=options)
+        with CHROME_LAUNCH_SECONDS.labels("ozon").time():
+            driver = webdriver.Chrome(options=options)
+        apply_resource_policy(driver, "ozon")
         driver.execute_script("Object.defineProperty(navigator, 'webdriver', {get: () => undefined})")
         logger.info("Selenium initialized successfully")
         return driver
     except Exception as e:
-        logger.error(f"Failed to initialize Selenium: {e}")
+        logger.error("Failed to initialize Selenium: %s", e)
         return None
 
-def scroll_to_bottom(driver, max_scroll_time=10):
-    """Полная прокрутка страницы до конца с ограничением времени."""
-    start_time = time.time()
-    try:
-        last_height = driver.execute_script("return document.body.scrollHeight")
-        while time.time() - start_time < max_scroll_time:
-            driver.execute_script("window.scrollTo(0, document.body.scrollHeight);")
-            time.sleep(random.uniform(1, 2))
-            new_height = driver.execute_script("return document.body.scrollHeight")
-            if new_height == last_height:
-                break
-            last_height = new_height
-        logger.debug("Page fully scrolled")
-    except Exception as e:
-        logger.error(f"Error scrolling page: {e}")
+def product_from_item(item):
+    """Товар из элемента items[] виджета searchResultsV2."""
+    title = None
+    price = None
+    for state in item.get("mainState") or []:
+        atom = state.get("atom") or {}
+        if atom.get("type") == "textAtom" and state.get("id") == "name":
+            title = (atom.get("textAtom") or {}).get("text")
+        elif atom.get("type") == "priceV2" and price is None:
+            prices = (atom.get("priceV2") or {}).get("price") or []
+            current = next((p for p in prices if p.get("textStyle") == "PRICE"), prices[0] if prices else {})
+            price = parse_price(current.get("text"))
+
+    link = (item.get("action") or {}).get("link")
+    if link and link.startswith("/"):
+        link = OZON_URL + link
+    match = ARTICLE_RE.search(link or "")
+    article = str(item.get("sku") or "") or (match.group(1) if match else None)
+    images = (item.get("tileImage") or {}).get("items") or []
+    image = (images[0].get("image") or {}).get("link") if images else None
+
+    if not title or price is None:
+        item_logger.debug("Skipped API product: title=%s, price=%s, link=%s", title, price, link)
+        return None
+    return Product("ozon", html.unescape(title.strip()), price, link=link, image=image, article=article or None)
+
+def products_from_api(payloads):
+    """Товары из состояния виджета выдачи или ответа entrypoint-api (widgetStates)."""
+    products = []
+    for payload in payloads:
+        if not isinstance(payload, dict):
+            continue
+        widgets = [payload]
+        if "widgetStates" in payload:
+            widgets = []
+            for key, state in payload["widgetStates"].items():
+                if key.startswith("searchResultsV2"):
+                    try:
+                        widgets.append(json.loads(state))
+                    except (TypeError, ValueError):
+                        continue
+        for widget in widgets:
+            for item in widget.get("items") or []:
+                product = product_from_item(item)
+                if product:
+                    products.append(product)
+    return products
+
+def state_payloads(driver):
+    payloads = []
+    for elem in driver.find_elements(By.CSS_SELECTOR, STATE_SELECTOR):
+        try:
+            payloads.append(json.loads(elem.get_attribute("data-state")))
+        except (TypeError, ValueError):
+            continue
+    return payloads
+
+def products_from_page(driver, capture):
+    """Товары из JSON без разбора карточек: встроенное состояние, затем перехваченные ответы API."""
+    products = products_from_api(state_payloads(driver))
+    if products:
+        return "state", products
+    return "xhr", products_from_api(capture.collect(timeout=3))
+
+def build_search_url(query, base_url=OZON_URL):
+    encoded_query = query.replace(" ", "+")
+    return f"{base_url}/search/?from_global=true&text={encoded_query}"
 
-def scrape_ozon(query):
-    """Scrape Ozon search results for 60 seconds."""
-    driver = setup_selenium()
+@PARSER_DURATION_SECONDS.labels("ozon").time()
+def scrape_ozon(query, base_url=OZON_URL, limit=None, page=None):
+    """Scrape Ozon search results for 60 seconds or until limit products are collected.
+
+    page scrapes only that results page (worker tasks).
+    """
+    lease = PROXY_POOL.lease("ozon")
+    with span("ozon.driver_start"):
+        driver = setup_selenium(lease.chrome_arg)
     if not driver:
+        lease.release()
         logger.error("Cannot proceed without Selenium")
         return []
 
-    encoded_query = query.replace(" ", "+")
-    base_url = f"https://www.ozon.ru/search/?from_global=true&text={encoded_query}"
-    logger.info(f"Starting scrape for query: {query}")
+    search_url = build_search_url(query, base_url)
+    logger.info("Starting scrape for query: %s", query)
 
+    throttle = get_throttle("ozon")
+    stop = SearchStop("ozon", query, limit)
+    capture = ResponseCapture(driver, SEARCH_API_PATTERNS) if xhr_enabled() else None
     products = []
-    max_pages = 5
-    current_page = 1
+    max_pages = page or 5
+    current_page = page or 1
+    pages_scraped = 0
     start_time = time.time()
     max_duration = 60  # 60 секунд
 
@@ -84,56 +169,83 @@ def scrape_ozon(query):
         if remaining_time <= 0:
             break
 
-        page_url = f"{base_url}&page={current_page}"
-        logger.info(f"Scraping page {current_page}")
+        page_url = f"{search_url}&page={current_page}"
+        page_span = f"ozon.p{current_page}"
+        logger.info("Scraping page %s", current_page)
 
         try:
-            driver.get(page_url)
-            time.sleep(random.uniform(1, 2))
+            if capture:
+                capture.reset()
+            with span(f"{page_span}.get"), throttle.navigation(), lease.timed():
+                driver.get(page_url)
 
             # Проверка на CAPTCHA
             captcha = driver.find_elements(By.CSS_SELECTOR, "div.captcha-container")
             if captcha:
+                CAPTCHA_DETECTIONS.labels("ozon").inc()
+                throttle.record("captcha")
+                lease.record("captcha")
                 logger.error("CAPTCHA detected, stopping")
                 break
 
-            # Ожидание загрузки товаров
-            try:
-                WebDriverWait(driver, min(15, remaining_time)).until(
-                    EC.presence_of_element_located((By.CSS_SELECTOR, "div.tile-root"))
-                )
-            except TimeoutException:
-                logger.error(f"Timeout loading products on page {current_page}")
-                current_page += 1
-                continue
+            page_start = len(products)
+            with span(f"{page_span}.xhr"):
+                source, api_products = products_from_page(driver, capture) if capture else (None, [])
+            product_tiles = []
+            if api_products:
+                # Товары из JSON: без ожидания карточек и прокрутки
+                PAGE_EXTRACTION_SOURCE.labels("ozon", source).inc()
+                logger.info("Got %s products from %s on page %s", len(api_products), source, current_page)
+                products.extend(api_products[:stop.remaining(products)])
+                record_page_resources(driver, "ozon")
+                extract_start = time.perf_counter()
+            else:
+                # Ожидание загрузки товаров
+                try:
+                    with span(f"{page_span}.wait"):
+                        WebDriverWait(driver, min(15, remaining_time)).until(
+                            EC.presence_of_element_located((By.CSS_SELECTOR, TILE_SELECTOR))
+                        )
+                except TimeoutException:
+                    TIMEOUTS.labels("ozon", "tiles").inc()
+                    throttle.record("timeout")
+                    lease.record("timeout")
+                    logger.error("Timeout loading products on page %s", current_page)
+                    current_page += 1
+                    continue
 
-            # Прокрутка страницы
-            scroll_to_bottom(driver, max_scroll_time=min(10, remaining_time))
+                # Прокрутка страницы
+                with span(f"{page_span}.scroll"):
+                    scroll_until_loaded(driver, TILE_SELECTOR, target=stop.remaining(products),
+                                        max_time=min(10, remaining_time))
+                record_page_resources(driver, "ozon")
 
-            # Поиск карточек товаров
-            product_tiles = driver.find_elements(By.CSS_SELECTOR, "div.tile-root")
-            logger.info(f"Found {len(product_tiles)} product tiles on page {current_page}")
+                # Поиск карточек товаров
+                PAGE_EXTRACTION_SOURCE.labels("ozon", "dom").inc()
+                extract_start = time.perf_counter()
+                product_tiles = driver.find_elements(By.CSS_SELECTOR, TILE_SELECTOR)
+                logger.info("Found %s product tiles on page %s", len(product_tiles), current_page)
 
             for tile in product_tiles:
-                product = {
-                    "title": None,
-                    "price": None,
-                    "link": None,
-                    "image": None,
-                    "article": None
-                }
+                if stop.full(products):
+                    break
+                title = None
+                price = None
+                link = None
+                image = None
+                article = None
 
                 # Название
                 try:
                     title_elem = tile.find_element(By.CSS_SELECTOR, "span[class*='tsBody'][class*='Medium']")
-                    product["title"] = title_elem.text.strip() if title_elem else None
+                    title = title_elem.text.strip() if title_elem else None
                 except:
                     pass
 
                 # Цена
                 try:
                     price_elem = tile.find_element(By.CSS_SELECTOR, "span[class*='tsHeadline'][class*='Medium']")
-                    product["price"] = price_elem.text.strip().replace("\u2009", "").replace("₽", "").strip() if price_elem else None
+                    price = parse_price(price_elem.text) if price_elem else None
                 except:
                     pass
 
@@ -141,48 +253,59 @@ def scrape_ozon(query):
                 try:
                     link_elem = tile.find_element(By.CSS_SELECTOR, "a[class*='tile-hover-target'], a[href*='/product/']")
                     href = link_elem.get_attribute("href")
-                    product["link"] = href if href and "/product/" in href else None
+                    link = href if href and "/product/" in href else None
                 except:
                     try:
                         link_elem = tile.find_element(By.CSS_SELECTOR, "a")
                         href = link_elem.get_attribute("href")
-                        product["link"] = href if href and "/product/" in href else None
+                        link = href if href and "/product/" in href else None
                     except:
                         pass
 
                 # Артикул
-                if product["link"]:
+                if link:
                     try:
-                        article_id = product["link"].split("/product/")[-1].split("-")[0].split("?")[0]
-                        product["article"] = article_id if article_id.isdigit() else None
+                        article_id = link.split("/product/")[-1].split("-")[0].split("?")[0]
+                        article = article_id if article_id.isdigit() else None
                     except:
                         pass
                 else:
                     try:
                         article_elem = tile.find_element(By.CSS_SELECTOR, "div[data-widget='webProduct']")
                         article_id = article_elem.get_attribute("data-sku") or article_elem.get_attribute("data-product-id")
-                        product["article"] = article_id if article_id and article_id.isdigit() else None
+                        article = article_id if article_id and article_id.isdigit() else None
                     except:
                         pass
 
                 # Картинка
                 try:
                     img_elem = tile.find_element(By.CSS_SELECTOR, "img")
-                    product["image"] = img_elem.get_attribute("src") if img_elem else None
+                    image = img_elem.get_attribute("src") if img_elem else None
                 except:
                     pass
 
+                if not title or price is None:
+                    item_logger.debug("Skipped product: title=%s, price=%s, link=%s", title, price, link)
+                    continue
+
+                product = Product("ozon", title, price, link=link, image=image, article=article)
                 products.append(product)
-                logger.debug(
-                    f"Added product: title={product['title']}, price={product['price']}, "
-                    f"link={product['link']}, image={product['image']}, article={product['article']}"
+                item_logger.debug(
+                    "Added product: title=%s, price=%s, link=%s, image=%s, article=%s",
+                    product.title, product.price, product.link, product.image, product.article
                 )
 
+            add_span(f"{page_span}.extract", time.perf_counter() - extract_start)
+            pages_scraped += 1
+            PRODUCTS_PER_PAGE.labels("ozon").observe(len(products) - page_start)
+            throttle.record("ok" if len(products) > page_start else "empty")
+            lease.record("ok" if len(products) > page_start else "empty")
             current_page += 1
-            time.sleep(random.uniform(2, 3))
+            if stop.page_done(products, page_start):
+                break
 
         except Exception as e:
-            logger.error(f"Error on page {current_page}: {e}")
+            logger.error("Error on page %s: %s", current_page, e)
             current_page += 1
             continue
 
@@ -190,6 +313,8 @@ def scrape_ozon(query):
         driver.quit()
     except:
         pass
+    lease.release()
     logger.info("Selenium driver closed")
 
+    PAGES_SCRAPED.labels("ozon").observe(pages_scraped)
     return products
\ No newline at end of file
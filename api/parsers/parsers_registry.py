@@ -0,0 +1,89 @@
+import logging
+import os
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional, Tuple
+
+from core.products import MARKETPLACE_DOMAINS, Product
+from core.throttle import ThrottleConfig, configure_throttle
+from core.urls import register_article_pattern
+from parsers import parsers_ozon_parser, parsers_sber_parser, parsers_wb_parser
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class MarketplaceAdapter:
+    """Описание маркетплейса: домены, поиск, селекторы и ограничения нагрузки.
+
+    throttle задает темп и максимальный параллелизм переходов по страницам
+    маркетплейса, общий для поиска и трекера цен.
+    """
+    name: str
+    domains: Tuple[str, ...]
+    base_url: str
+    search_url: Callable[[str, str], str]
+    scrape: Callable[..., List[Product]]
+    tile_selector: str
+    price_selector: str
+    throttle: ThrottleConfig
+    # Артикул в пути ссылки на товар (первая группа)
+    article_pattern: str
+
+
+ADAPTERS: Dict[str, MarketplaceAdapter] = {}
+
+
+def register(adapter: MarketplaceAdapter) -> MarketplaceAdapter:
+    ADAPTERS[adapter.name] = adapter
+    for domain in adapter.domains:
+        MARKETPLACE_DOMAINS[domain] = adapter.name
+    configure_throttle(adapter.name, adapter.throttle)
+    register_article_pattern(adapter.name, adapter.article_pattern)
+    return adapter
+
+
+def enabled_adapters() -> List[MarketplaceAdapter]:
+    """Адаптеры без отключенных через DISABLED_MARKETPLACES (через запятую)."""
+    disabled = {name.strip() for name in os.getenv("DISABLED_MARKETPLACES", "").split(",") if name.strip()}
+    return [adapter for name, adapter in ADAPTERS.items() if name not in disabled]
+
+
+def adapter_for_url(url: str) -> Optional[MarketplaceAdapter]:
+    """Адаптер по домену ссылки на товар."""
+    return next((adapter for adapter in ADAPTERS.values()
+                 if any(domain in url for domain in adapter.domains)), None)
+
+
+register(MarketplaceAdapter(
+    name="ozon",
+    domains=("ozon.ru",),
+    base_url=parsers_ozon_parser.OZON_URL,
+    search_url=parsers_ozon_parser.build_search_url,
+    scrape=parsers_ozon_parser.scrape_ozon,
+    tile_selector=parsers_ozon_parser.TILE_SELECTOR,
+    price_selector=parsers_ozon_parser.PRICE_SELECTOR,
+    throttle=ThrottleConfig(initial_delay=2.5, min_delay=1.0, max_concurrency=3),
+    article_pattern=r"/product/(?:[^/]*-)?(\d+)(?:/|$)",
+))
+register(MarketplaceAdapter(
+    name="sbermegamarket",
+    domains=("megamarket.ru", "sbermegamarket.ru"),
+    base_url=parsers_sber_parser.MEGAMARKET_URL,
+    search_url=parsers_sber_parser.build_search_url,
+    scrape=parsers_sber_parser.scrape_sbermegamarket,
+    tile_selector=parsers_sber_parser.TILE_SELECTOR,
+    price_selector=parsers_sber_parser.PRICE_SELECTOR,
+    throttle=ThrottleConfig(initial_delay=1.5, max_concurrency=3),
+    article_pattern=r"/catalog/details/(?:[^/]*-)?(\d{6,})(?:_\d+)?(?:/|$)",
+))
+register(MarketplaceAdapter(
+    name="wildberries",
+    domains=("wildberries.ru", "wb.ru"),
+    base_url=parsers_wb_parser.WILDBERRIES_URL,
+    search_url=parsers_wb_parser.build_search_url,
+    scrape=parsers_wb_parser.scrape_wildberries,
+    tile_selector=parsers_wb_parser.TILE_SELECTOR,
+    price_selector=parsers_wb_parser.PRICE_SELECTOR,
+    throttle=ThrottleConfig(initial_delay=1.0, max_concurrency=4),
+    article_pattern=r"/catalog/(\d+)/detail\.aspx",
+))
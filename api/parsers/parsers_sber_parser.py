@@ -9,13 +9,27 @@ from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
 from selenium.webdriver.common.action_chains import ActionChains
 from selenium.common.exceptions import TimeoutException, WebDriverException
-
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s | %(levelname)s | %(message)s',
-    datefmt='%Y-%m-%d %H:%M:%S'
+from core.products import Product, parse_price, rubles_to_kopecks
+from core.proxies import PROXY_POOL
+from core.throttle import get_throttle
+from core.scrolling import scroll_until_loaded
+from core.relevance import SearchStop
+from core.resources import apply_resource_policy, record_page_resources
+from core.xhr import ResponseCapture, enable_performance_log, xhr_enabled
+from core.metrics import (
+    CHROME_LAUNCH_SECONDS, PAGE_EXTRACTION_SOURCE, PAGES_SCRAPED, PARSER_DURATION_SECONDS, PRODUCTS_PER_PAGE,
+    TIMEOUTS
 )
-logger = logging.getLogger()
+from core.timing import add_span, span
+
+MEGAMARKET_URL = "https://megamarket.ru"
+TILE_SELECTOR = "div[class*='catalog-item-regular']"
+PRICE_SELECTOR = ".pdp-price__current"
+# Поисковый API, из ответов которого страница строит выдачу
+SEARCH_API_PATTERNS = (r"/api/mobile/v1/catalogService/catalog/search",)
+
+logger = logging.getLogger(__name__)
+item_logger = logging.getLogger(f"{__name__}.items")
 
 def setup_selenium(proxy=None):
     """Инициализация Selenium с опциональным прокси."""
@@ -55,14 +69,17 @@ def setup_selenium(proxy=None):
     options.add_experimental_option('useAutomationExtension', False)
 
     if proxy:
-        logger.info(f"Используется прокси: {proxy}")
+        logger.info("Используется прокси: %s", proxy)
         options.add_argument(f'--proxy-server={proxy}')
     else:
         logger.info("Прокси не используется")
+    enable_performance_log(options)
 
     try:
-        driver = webdriver.Chrome(options=options)
+        with CHROME_LAUNCH_SECONDS.labels("sbermegamarket").time():
+            driver = webdriver.Chrome(options=options)
         driver.set_page_load_timeout(30)
+        apply_resource_policy(driver, "sbermegamarket")
         driver.execute_cdp_cmd("Page.addScriptToEvaluateOnNewDocument", {
             "source": """
                 Object.defineProperty(navigator, 'webdriver', {get: () => undefined});
@@ -75,24 +92,9 @@ def setup_selenium(proxy=None):
         logger.info("Selenium успешно инициализирован")
         return driver
     except Exception as e:
-        logger.error(f"Ошибка инициализации Selenium: {e}")
+        logger.error("Ошибка инициализации Selenium: %s", e)
         return None
 
-def scroll_to_bottom(driver, max_scroll_time=10):
-    start_time = time.time()
-    try:
-        last_height = driver.execute_script("return document.body.scrollHeight")
-        while time.time() - start_time < max_scroll_time:
-            driver.execute_script("window.scrollBy(0, 2000);")
-            time.sleep(random.uniform(0.1, 0.2))
-            new_height = driver.execute_script("return document.body.scrollHeight")
-            if new_height == last_height:
-                break
-            last_height = new_height
-        logger.debug("Страница полностью прокручена")
-    except Exception as e:
-        logger.error(f"Ошибка при прокрутке страницы: {e}")
-
 def handle_popups(driver):
     try:
         popup_selectors = [
@@ -106,13 +108,13 @@ def handle_popups(driver):
                 WebDriverWait(driver, 1).until(
                     EC.element_to_be_clickable((By.CSS_SELECTOR, selector))
                 ).click()
-                logger.debug(f"Закрыто всплывающее окно с селектором: {selector}")
+                logger.debug("Закрыто всплывающее окно с селектором: %s", selector)
                 time.sleep(random.uniform(0.1, 0.2))
                 return
             except:
                 continue
     except Exception as e:
-        logger.debug(f"Ошибка при обработке всплывающих окон: {e}")
+        logger.debug("Ошибка при обработке всплывающих окон: %s", e)
 
 def simulate_human_behavior(driver):
     try:
@@ -127,22 +129,54 @@ def simulate_human_behavior(driver):
             time.sleep(random.uniform(0.1, 0.2))
         logger.debug("Имитация человеческого поведения выполнена")
     except Exception as e:
-        logger.debug(f"Ошибка при имитации поведения: {e}")
+        logger.debug("Ошибка при имитации поведения: %s", e)
 
-def scrape_sbermegamarket(query):
-    """Скрапинг СберМегаМаркета."""
-    driver = setup_selenium()
+def products_from_api(payloads):
+    """Товары из ответов catalogService/catalog/search (items[].goods, цены в рублях)."""
+    products = []
+    for payload in payloads:
+        items = payload.get("items") if isinstance(payload, dict) else None
+        for item in items or []:
+            goods = item.get("goods") or {}
+            title = (goods.get("title") or "").strip()
+            price = item.get("finalPrice") or item.get("price")
+            link = goods.get("webUrl")
+            goods_id = str(goods.get("goodsId") or "").split("_")[0]
+            if title and price and link:
+                products.append(Product(
+                    "sbermegamarket", title, rubles_to_kopecks(float(price)), link=link,
+                    image=goods.get("titleImage"), article=goods_id if goods_id.isdigit() else None
+                ))
+            else:
+                item_logger.debug("Пропущен товар API: title=%s, price=%s", title, price)
+    return products
+
+def build_search_url(query, base_url=MEGAMARKET_URL):
+    encoded_query = query.replace(" ", "%20")
+    return f"{base_url}/catalog/?q={encoded_query}"
+
+@PARSER_DURATION_SECONDS.labels("sbermegamarket").time()
+def scrape_sbermegamarket(query, base_url=MEGAMARKET_URL, limit=None, page=None):
+    """Скрапинг СберМегаМаркета; limit - сколько товаров достаточно собрать,
+    page - обработать только эту страницу выдачи (задачи воркеров)."""
+    lease = PROXY_POOL.lease("sbermegamarket")
+    with span("sbermegamarket.driver_start"):
+        driver = setup_selenium(lease.chrome_arg)
     if not driver:
+        lease.release()
         logger.error("Не удалось инициализировать драйвер Selenium")
         return []
 
-    encoded_query = query.replace(" ", "%20")
-    base_url = f"https://megamarket.ru/catalog/?q={encoded_query}"
-    logger.info(f"Запуск скрапинга для запроса: {query}")
+    search_url = build_search_url(query, base_url)
+    logger.info("Запуск скрапинга для запроса: %s", query)
 
+    throttle = get_throttle("sbermegamarket")
+    stop = SearchStop("sbermegamarket", query, limit)
+    capture = ResponseCapture(driver, SEARCH_API_PATTERNS) if xhr_enabled() else None
     products = []
-    max_pages = 5
-    current_page = 1
+    max_pages = page or 5
+    current_page = page or 1
+    pages_scraped = 0
     start_time = time.time()
     max_duration = 60
     max_retries = 1
@@ -152,97 +186,135 @@ def scrape_sbermegamarket(query):
             logger.info("Достигнут лимит времени, завершаем")
             break
 
-        page_url = f"{base_url}&page={current_page}"
-        logger.info(f"Скрапинг страницы {current_page}: {page_url}")
+        page_url = f"{search_url}&page={current_page}"
+        page_span = f"sbermegamarket.p{current_page}"
+        logger.info("Скрапинг страницы %s: %s", current_page, page_url)
 
+        if capture:
+            capture.reset()
         for attempt in range(max_retries):
             try:
-                driver.get(page_url)
-                WebDriverWait(driver, 10).until(
-                    lambda d: d.execute_script("return document.readyState") == "complete"
-                )
-                simulate_human_behavior(driver)
-                handle_popups(driver)
+                with span(f"{page_span}.get"):
+                    with throttle.navigation(), lease.timed():
+                        driver.get(page_url)
+                    WebDriverWait(driver, 10).until(
+                        lambda d: d.execute_script("return document.readyState") == "complete"
+                    )
+                with span(f"{page_span}.human"):
+                    # Имитация пользователя нужна, только пока сайт присылает сигналы блокировки
+                    if throttle.cautious:
+                        simulate_human_behavior(driver)
+                    handle_popups(driver)
                 break
             except TimeoutException:
-                logger.error(f"Тайм-аут загрузки страницы {current_page}")
+                TIMEOUTS.labels("sbermegamarket", "page_load").inc()
+                throttle.record("timeout")
+                lease.record("timeout")
+                logger.error("Тайм-аут загрузки страницы %s", current_page)
                 current_page += 1
                 break
             except WebDriverException as e:
-                logger.error(f"Ошибка WebDriver на странице {current_page}: {e}")
+                logger.error("Ошибка WebDriver на странице %s: %s", current_page, e)
                 current_page += 1
                 break
 
-        for _ in range(8):
-            scroll_to_bottom(driver, max_scroll_time=10)
-            time.sleep(random.uniform(0.1, 0.2))
+        page_start = len(products)
+        with span(f"{page_span}.xhr"):
+            api_products = products_from_api(capture.collect(timeout=5)) if capture else []
+        product_tiles = []
+        if api_products:
+            # JSON уже содержит всю страницу: без ожидания карточек и прокрутки
+            PAGE_EXTRACTION_SOURCE.labels("sbermegamarket", "xhr").inc()
+            logger.info("Получено %s товаров из API поиска на странице %s", len(api_products), current_page)
+            products.extend(api_products[:stop.remaining(products)])
+            record_page_resources(driver, "sbermegamarket")
+            extract_start = time.perf_counter()
+        else:
+            try:
+                with span(f"{page_span}.wait"):
+                    WebDriverWait(driver, 30).until(
+                        lambda d: d.execute_script("return document.querySelectorAll(arguments[0]).length > 0", TILE_SELECTOR)
+                    )
+            except TimeoutException:
+                TIMEOUTS.labels("sbermegamarket", "tiles").inc()
+                throttle.record("empty")
+                logger.error("Карточки не найдены на странице %s", current_page)
+                current_page += 1
+                continue
 
-        try:
-            WebDriverWait(driver, 30).until(
-                lambda d: d.execute_script("return document.querySelectorAll('div[class*=\"catalog-item-regular\"]').length > 0")
-            )
-        except TimeoutException:
-            logger.error(f"Карточки не найдены на странице {current_page}")
-            current_page += 1
-            continue
+            with span(f"{page_span}.scroll"):
+                scroll_until_loaded(driver, TILE_SELECTOR, target=stop.remaining(products), max_time=20, step=2000)
 
-        product_tiles = driver.find_elements(By.CSS_SELECTOR, "div[class*='catalog-item-regular']")
-        product_tiles = [tile for tile in product_tiles if tile.find_elements(By.CSS_SELECTOR, "a.ddl_product_link")]
-        logger.info(f"Найдено {len(product_tiles)} карточек на странице {current_page}")
+            record_page_resources(driver, "sbermegamarket")
+            PAGE_EXTRACTION_SOURCE.labels("sbermegamarket", "dom").inc()
+            extract_start = time.perf_counter()
+            product_tiles = driver.find_elements(By.CSS_SELECTOR, TILE_SELECTOR)
+            product_tiles = [tile for tile in product_tiles if tile.find_elements(By.CSS_SELECTOR, "a.ddl_product_link")]
+            logger.info("Найдено %s карточек на странице %s", len(product_tiles), current_page)
 
         for tile in product_tiles:
-            if time.time() - start_time >= max_duration:
+            if time.time() - start_time >= max_duration or stop.full(products):
                 break
 
-            product = {"title": None, "price": None, "link": None, "image": None, "article": None}
+            title = None
+            price = None
+            image = None
+            article = None
 
             try:
                 link_elem = tile.find_element(By.CSS_SELECTOR, "a.ddl_product_link")
-                product["link"] = link_elem.get_attribute("href")
+                link = link_elem.get_attribute("href")
             except:
-                logger.debug("Ссылка не найдена")
+                item_logger.debug("Ссылка не найдена")
                 continue
 
             try:
                 article_id = link_elem.get_attribute("data-product-id")
-                product["article"] = article_id if article_id and article_id.isdigit() else None
+                article = article_id if article_id and article_id.isdigit() else None
             except:
-                logger.debug("Артикул не найден")
+                item_logger.debug("Артикул не найден")
 
             try:
                 title_elem = tile.find_element(By.CSS_SELECTOR, "meta[itemprop='name']")
-                product["title"] = title_elem.get_attribute("content").strip()
+                title = title_elem.get_attribute("content").strip()
             except:
                 try:
                     title_elem = tile.find_element(By.CSS_SELECTOR, "a.catalog-item-regular-desktop__title-link")
-                    product["title"] = title_elem.text.strip()
+                    title = title_elem.text.strip()
                 except:
-                    logger.debug("Название не найдено")
+                    item_logger.debug("Название не найдено")
                     continue
 
             try:
                 price_elem = tile.find_element(By.CSS_SELECTOR, "div.catalog-item-regular-desktop__price")
-                price_text = price_elem.text.strip().replace("\u2009", "").replace("₽", "").replace(" ", "").strip()
-                product["price"] = price_text
+                price = parse_price(price_elem.text)
             except:
-                logger.debug("Цена не найдена")
+                item_logger.debug("Цена не найдена")
                 continue
 
             try:
                 img_elem = tile.find_element(By.CSS_SELECTOR, "meta[itemprop='image']")
-                product["image"] = img_elem.get_attribute("content")
+                image = img_elem.get_attribute("content")
             except:
                 try:
                     img_elem = tile.find_element(By.CSS_SELECTOR, "img.pui-img")
-                    product["image"] = img_elem.get_attribute("src")
+                    image = img_elem.get_attribute("src")
                 except:
-                    logger.debug("Изображение не найдено")
+                    item_logger.debug("Изображение не найдено")
 
-            if product["title"] and product["price"]:
-                products.append(product)
-                logger.info(f"Добавлен товар: {product['title']}, цена={product['price']}")
+            if title and price is not None:
+                products.append(Product("sbermegamarket", title, price, link=link, image=image, article=article))
+                item_logger.debug("Добавлен товар: %s, цена=%s", title, price)
             else:
-                logger.debug(f"Пропущен товар: title={product['title']}, price={product['price']}")
+                item_logger.debug("Пропущен товар: title=%s, price=%s", title, price)
+
+        add_span(f"{page_span}.extract", time.perf_counter() - extract_start)
+        pages_scraped += 1
+        PRODUCTS_PER_PAGE.labels("sbermegamarket").observe(len(products) - page_start)
+        throttle.record("ok" if len(products) > page_start else "empty")
+        lease.record("ok" if len(products) > page_start else "empty")
+        if stop.page_done(products, page_start):
+            break
 
         try:
             next_button = WebDriverWait(driver, 3).until(
@@ -250,9 +322,8 @@ def scrape_sbermegamarket(query):
             )
             next_button.click()
             current_page += 1
-            time.sleep(random.uniform(1, 2))
         except:
-            logger.info(f"Кнопка пагинации не найдена, переходим через URL к странице {current_page + 1}")
+            logger.info("Кнопка пагинации не найдена, переходим через URL к странице %s", current_page + 1)
             current_page += 1
             continue
 
@@ -261,5 +332,7 @@ def scrape_sbermegamarket(query):
         logger.info("Драйвер Selenium закрыт")
     except:
         pass
+    lease.release()
 
+    PAGES_SCRAPED.labels("sbermegamarket").observe(pages_scraped)
     return products
@@ -1,26 +1,54 @@
+import asyncio
 import logging
+import bisect
 import time
-import random
 from selenium import webdriver
 from selenium.webdriver.chrome.options import Options
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
-import sys
+from selenium.common.exceptions import TimeoutException
+import json
 import urllib.parse
-
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s | %(levelname)s | %(message)s',
-    datefmt='%Y-%m-%d %H:%M:%S',
-    handlers=[
-        logging.FileHandler("wb_scraper.log", encoding="utf-8"),
-        logging.StreamHandler(sys.stdout)
-    ]
+from core.browser import engine_for, open_page
+from core.products import Product, parse_price
+from core.proxies import PROXY_POOL
+from core.throttle import get_throttle
+from core.scrolling import scroll_until_loaded
+from core.relevance import SearchStop
+from core.resources import apply_resource_policy, record_page_resources
+from core.xhr import ResponseCapture, enable_performance_log, xhr_enabled
+from core.metrics import (
+    CHROME_LAUNCH_SECONDS, PAGE_EXTRACTION_SOURCE, PAGES_SCRAPED, PARSER_DURATION_SECONDS, PRODUCTS_PER_PAGE,
+    TIMEOUTS
 )
-logger = logging.getLogger()
+from core.timing import add_span, span
+
+WILDBERRIES_URL = "https://www.wildberries.ru"
+TILE_SELECTOR = ".product-card"
+PRICE_SELECTOR = ".price-block__final-price"
+# Поисковый API, из ответов которого страница строит выдачу
+SEARCH_API_PATTERNS = (r"//(?:u-)?search\.wb\.ru/.+/search\?",)
+# Поля всех карточек выдачи за один вызов: те же селекторы, что в разборе через WebDriver
+CARDS_SCRIPT = """
+Array.from(document.querySelectorAll(%s)).map(card => {
+    const text = selector => { const e = card.querySelector(selector); return e ? e.innerText : ""; };
+    const link = card.querySelector("a.product-card__link");
+    const img = card.querySelector("img");
+    return {
+        article: card.getAttribute("data-nm-id") || "",
+        title: text("span.product-card__name"),
+        price: text("ins.price__lower-price"),
+        link: link ? link.href : "",
+        image: img ? (img.getAttribute("src") || img.getAttribute("data-src") || "") : "",
+    };
+})
+""" % json.dumps(TILE_SELECTOR)
+
+logger = logging.getLogger(__name__)
+item_logger = logging.getLogger(f"{__name__}.items")
 
-def setup_selenium():
+def setup_selenium(proxy=None):
     options = Options()
     options.add_argument("--headless=new")
     options.add_argument("--disable-gpu")
@@ -31,145 +59,284 @@ def setup_selenium():
         "user-agent=Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 "
         "(KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36"
     )
+    if proxy:
+        logger.info("Using proxy: %s", proxy)
+        options.add_argument(f"--proxy-server={proxy}")
+    enable_performance_log(options)
     try:
-        driver = webdriver.Chrome(options=options)
+        with CHROME_LAUNCH_SECONDS.labels("wildberries").time():
+            driver = webdriver.Chrome(options=options)
+        apply_resource_policy(driver, "wildberries")
         logger.info("Selenium initialized successfully")
         return driver
     except Exception as e:
-        logger.error(f"Failed to initialize Selenium: {e}")
+        logger.error("Failed to initialize Selenium: %s", e)
         return None
 
-def fetch_placeholder_images(query):
-    driver = setup_selenium()
-    if not driver:
-        logger.error("Cannot proceed with Google Images scrape without Selenium")
+# Верхние границы vol (nm_id // 100000) для серверов basket-01, basket-02, ... CDN картинок.
+# WB добавляет серверы по мере роста артикулов, дальше таблицы продолжаем шагом последнего диапазона
+BASKET_VOL_BOUNDS = (
+    143, 287, 431, 719, 1007, 1061, 1115, 1169, 1313, 1601, 1655, 1919, 2045, 2189, 2405, 2621,
+    2837, 3053, 3269, 3485, 3701, 3917, 4133, 4349, 4565, 4877, 5189, 5501, 5813, 6125, 6437,
+)
+IMAGE_URL = "https://basket-{basket:02d}.wbbasket.ru/vol{vol}/part{part}/{nm_id}/images/c516x688/1.webp"
+
+def image_url(article):
+    """Ссылка на первую картинку товара по артикулу (nm_id) без запросов к сайту."""
+    if not str(article).isdigit():
+        return ""
+    nm_id = int(article)
+    vol = nm_id // 100000
+    basket = bisect.bisect_left(BASKET_VOL_BOUNDS, vol) + 1
+    if basket > len(BASKET_VOL_BOUNDS):
+        step = BASKET_VOL_BOUNDS[-1] - BASKET_VOL_BOUNDS[-2]
+        basket = len(BASKET_VOL_BOUNDS) + 1 + (vol - BASKET_VOL_BOUNDS[-1] - 1) // step
+    return IMAGE_URL.format(basket=basket, vol=vol, part=nm_id // 1000, nm_id=nm_id)
+
+def api_price(item):
+    """Цена в копейках из ответа API: sizes[].price.product или salePriceU в старых версиях."""
+    for size in item.get("sizes") or []:
+        price = (size.get("price") or {}).get("product")
+        if price:
+            return int(price)
+    price = item.get("salePriceU")
+    return int(price) if price else None
+
+def products_from_api(payloads):
+    """Товары из JSON-ответов поискового API (data.products[])."""
+    products = []
+    for payload in payloads:
+        data = payload.get("data", payload) if isinstance(payload, dict) else {}
+        for item in data.get("products") or []:
+            article = str(item.get("id") or "")
+            title = (item.get("name") or "").strip()
+            price = api_price(item)
+            if article and title and price is not None:
+                link = f"{WILDBERRIES_URL}/catalog/{article}/detail.aspx"
+                products.append(Product("wildberries", title, price, link=link, image=image_url(article), article=article))
+            else:
+                item_logger.debug("Skipped API product: title=%s, article=%s, price=%s", title, article, price)
+    return products
+
+def build_search_url(query, base_url=WILDBERRIES_URL):
+    encoded_query = urllib.parse.quote(query.encode("utf-8"))
+    return f"{base_url}/catalog/0/search.aspx?search={encoded_query}"
+
+def card_product(card):
+    """Товар из полей карточки, собранных CARDS_SCRIPT, или None, если полей не хватает."""
+    article = card["article"]
+    title = card["title"].strip().lstrip("/ ").strip()
+    price = parse_price(card["price"]) if card["price"] else None
+    link = card["link"]
+    # Картинка карточки, пока она не подгружена (data:, пусто) - по артикулу
+    image = card["image"] if card["image"].startswith("http") else image_url(article)
+    if article and title and price is not None and link:
+        item_logger.debug("Added product: %s (Article: %s, Link: %s)", title, article, link)
+        return Product("wildberries", title, price, link=link, image=image, article=article)
+    item_logger.debug("Skipped product: title=%s, article=%s, price=%s, link=%s", title, article, price, link)
+    return None
+
+async def scrape_wildberries_page(query, base_url=WILDBERRIES_URL, limit=None, page=None):
+    """Выдача через core.browser.Page (движок cdp): карточки читаются из DOM одним вызовом.
+
+    Ответы поискового API на этом пути не перехватываются.
+    """
+    lease = PROXY_POOL.lease("wildberries")
+    with span("wildberries.driver_start"):
+        tab = await open_page("wildberries", lease.chrome_arg, setup_selenium, engine_for("wildberries"), shared=False)
+    if not tab:
+        lease.release()
+        logger.error("Cannot proceed without a browser")
         return []
 
+    throttle = get_throttle("wildberries")
+    stop = SearchStop("wildberries", query, limit)
+    products = []
+    pages_scraped = 0
+    search_url = build_search_url(query, base_url)
+    current_page = page or 1
+    max_pages = page or 5
     try:
-        encoded_query = urllib.parse.quote(query.encode("utf-8"))
-        url = f"https://www.google.com/search?q={encoded_query}&tbm=isch"
-        driver.get(url)
-        logger.info(f"Fetching placeholder images for query: {query}")
-
-        WebDriverWait(driver, 5).until(
-            EC.presence_of_element_located((By.CSS_SELECTOR, "img[src^='https']"))
-        )
-
-        image_elements = driver.find_elements(By.CSS_SELECTOR, "img[src^='https']")[:20]
-        image_urls = [
-            img.get_attribute("src") for img in image_elements
-            if img.get_attribute("src") and (
-                "encrypted-tbn0.gstatic.com" in img.get_attribute("src") or
-                "lh3.googleusercontent.com" in img.get_attribute("src")
-            )
-        ]
-        logger.info(f"Found {len(image_urls)} placeholder images")
-        return image_urls
+        logger.info("Starting scrape for query: %s", query)
+        while current_page <= max_pages:
+            page_span = f"wildberries.p{current_page}"
+            with span(f"{page_span}.get"):
+                async with throttle.navigation_async():
+                    with lease.timed():
+                        await tab.goto(f"{search_url}&page={current_page}")
+            logger.info("Scraping page %s", current_page)
+            page_start = len(products)
+            try:
+                with span(f"{page_span}.wait"):
+                    await tab.wait_for_selector(TILE_SELECTOR, timeout=10)
+            except TimeoutError:
+                TIMEOUTS.labels("wildberries", "tiles").inc()
+                throttle.record("timeout")
+                lease.record("timeout")
+                logger.error("Timeout loading product cards on page %s", current_page)
+                break
+            with span(f"{page_span}.scroll"):
+                await tab.scroll_until_loaded(TILE_SELECTOR, target=stop.remaining(products), max_time=20)
+            await tab.record_resources("wildberries")
+
+            PAGE_EXTRACTION_SOURCE.labels("wildberries", "dom").inc()
+            with span(f"{page_span}.extract"):
+                cards = await tab.evaluate(CARDS_SCRIPT) or []
+                logger.info("Found %s product cards on page %s", len(cards), current_page)
+                for card in cards:
+                    if stop.full(products):
+                        break
+                    product = card_product(card)
+                    if product:
+                        products.append(product)
 
+            pages_scraped += 1
+            PRODUCTS_PER_PAGE.labels("wildberries").observe(len(products) - page_start)
+            throttle.record("ok" if len(products) > page_start else "empty")
+            lease.record("ok" if len(products) > page_start else "empty")
+            current_page += 1
+            if stop.page_done(products, page_start):
+                break
     except Exception as e:
-        logger.error(f"Error fetching placeholder images: {e}")
-        return []
+        logger.error("Error during scraping: %s", e)
     finally:
-        try:
-            driver.quit()
-            logger.info("Google Images Selenium driver closed")
-        except:
-            pass
-
-def scrape_wildberries(query):
-    driver = setup_selenium()
+        await tab.close()
+        lease.release()
+        logger.info("Browser page closed")
+
+    PAGES_SCRAPED.labels("wildberries").observe(pages_scraped)
+    logger.info("Completed scrape, found %s products", len(products))
+    return products
+
+@PARSER_DURATION_SECONDS.labels("wildberries").time()
+def scrape_wildberries(query, base_url=WILDBERRIES_URL, limit=None, page=None):
+    """Scrape Wildberries search results; page scrapes only that results page (worker tasks).
+
+    BROWSER_ENGINE_WILDBERRIES=cdp (или BROWSER_ENGINE=cdp) переключает парсер на scrape_wildberries_page.
+    """
+    if engine_for("wildberries") == "cdp":
+        # Парсер вызывается из потока исполнителя или воркера: свой event loop на вызов
+        return asyncio.run(scrape_wildberries_page(query, base_url, limit, page))
+    lease = PROXY_POOL.lease("wildberries")
+    with span("wildberries.driver_start"):
+        driver = setup_selenium(lease.chrome_arg)
     if not driver:
+        lease.release()
         logger.error("Cannot proceed without Selenium")
         return []
 
+    throttle = get_throttle("wildberries")
+    stop = SearchStop("wildberries", query, limit)
+    capture = ResponseCapture(driver, SEARCH_API_PATTERNS) if xhr_enabled() else None
+    products = []
+    pages_scraped = 0
+
     try:
-        logger.info(f"Starting scrape for query: {query}")
-        encoded_query = urllib.parse.quote(query.encode("utf-8"))
-        base_url = f"https://www.wildberries.ru/catalog/0/search.aspx?search={encoded_query}"
+        logger.info("Starting scrape for query: %s", query)
+        search_url = build_search_url(query, base_url)
 
-        products = []
-        max_pages = 5
-        current_page = 1
+        max_pages = page or 5
+        current_page = page or 1
 
         while current_page <= max_pages:
-            page_url = f"{base_url}&page={current_page}"
-            driver.get(page_url)
-            logger.info(f"Scraping page {current_page}")
-
-            WebDriverWait(driver, 10).until(
-                EC.presence_of_element_located((By.CLASS_NAME, "product-card"))
-            )
-
-            last_height = driver.execute_script("return document.body.scrollHeight")
-            while True:
-                driver.execute_script("window.scrollTo(0, document.body.scrollHeight);")
-                time.sleep(1)
-                new_height = driver.execute_script("return document.body.scrollHeight")
-                if new_height == last_height:
+            page_url = f"{search_url}&page={current_page}"
+            page_span = f"wildberries.p{current_page}"
+            if capture:
+                capture.reset()
+            with span(f"{page_span}.get"), throttle.navigation(), lease.timed():
+                driver.get(page_url)
+            logger.info("Scraping page %s", current_page)
+            page_start = len(products)
+
+            with span(f"{page_span}.xhr"):
+                api_products = products_from_api(capture.collect(timeout=5)) if capture else []
+            product_cards = []
+            if api_products:
+                # JSON уже содержит всю страницу: без ожидания карточек и прокрутки
+                PAGE_EXTRACTION_SOURCE.labels("wildberries", "xhr").inc()
+                logger.info("Got %s products from search API on page %s", len(api_products), current_page)
+                products.extend(api_products[:stop.remaining(products)])
+                record_page_resources(driver, "wildberries")
+                extract_start = time.perf_counter()
+            else:
+                try:
+                    with span(f"{page_span}.wait"):
+                        WebDriverWait(driver, 10).until(
+                            EC.presence_of_element_located((By.CSS_SELECTOR, TILE_SELECTOR))
+                        )
+                except TimeoutException:
+                    TIMEOUTS.labels("wildberries", "tiles").inc()
+                    throttle.record("timeout")
+                    lease.record("timeout")
+                    logger.error("Timeout loading product cards on page %s", current_page)
                     break
-                last_height = new_height
 
-            product_cards = driver.find_elements(By.CLASS_NAME, "product-card")
-            logger.info(f"Found {len(product_cards)} product cards on page {current_page}")
+                with span(f"{page_span}.scroll"):
+                    scroll_until_loaded(driver, TILE_SELECTOR, target=stop.remaining(products), max_time=20)
+                record_page_resources(driver, "wildberries")
+
+                PAGE_EXTRACTION_SOURCE.labels("wildberries", "dom").inc()
+                extract_start = time.perf_counter()
+                product_cards = driver.find_elements(By.CSS_SELECTOR, TILE_SELECTOR)
+                logger.info("Found %s product cards on page %s", len(product_cards), current_page)
 
             for index, card in enumerate(product_cards, len(products) + 1):
+                if stop.full(products):
+                    break
                 try:
-                    product = {}
-                    product["index"] = index
-
-                    product["article"] = card.get_attribute("data-nm-id") or ""
+                    article = card.get_attribute("data-nm-id") or ""
 
                     title_elem = card.find_element(
                         By.CSS_SELECTOR, "span.product-card__name"
                     )
                     title = title_elem.text.strip() if title_elem else ""
-                    product["title"] = title.lstrip("/ ").strip() 
+                    title = title.lstrip("/ ").strip()
 
                     price_elem = card.find_element(
                         By.CSS_SELECTOR, "ins.price__lower-price"
                     )
-                    product["price"] = price_elem.text.strip().replace("\u2009", "").replace("₽", "").strip() if price_elem else ""
+                    price = parse_price(price_elem.text) if price_elem else None
 
                     link_elem = card.find_element(By.CSS_SELECTOR, "a.product-card__link")
-                    product["link"] = link_elem.get_attribute("href") if link_elem else ""
+                    link = link_elem.get_attribute("href") if link_elem else ""
 
-                    product["image"] = ""
+                    # Картинка карточки, пока она не подгружена (data:, пусто) - по артикулу
+                    image = ""
+                    for img_elem in card.find_elements(By.CSS_SELECTOR, "img"):
+                        image = img_elem.get_attribute("src") or img_elem.get_attribute("data-src") or ""
+                        break
+                    if not image.startswith("http"):
+                        image = image_url(article)
 
-                    if product["article"] and product["title"] and product["price"] and product["link"]:
-                        products.append(product)
-                        logger.debug(
-                            f"Added product: {product['title']} (Article: {product['article']}, Link: {product['link']})"
-                        )
+                    if article and title and price is not None and link:
+                        products.append(Product("wildberries", title, price, link=link, image=image, article=article))
+                        item_logger.debug("Added product: %s (Article: %s, Link: %s)", title, article, link)
                     else:
-                        logger.debug(
-                            f"Skipped product: title={product['title']}, "
-                            f"article={product['article']}, price={product['price']}, link={product['link']}"
+                        item_logger.debug(
+                            "Skipped product: title=%s, article=%s, price=%s, link=%s",
+                            title, article, price, link
                         )
 
                 except Exception as e:
-                    logger.error(f"Error parsing product card {index} on page {current_page}: {e}")
+                    logger.error("Error parsing product card %s on page %s: %s", index, current_page, e)
                     continue
 
+            add_span(f"{page_span}.extract", time.perf_counter() - extract_start)
+            pages_scraped += 1
+            PRODUCTS_PER_PAGE.labels("wildberries").observe(len(products) - page_start)
+            throttle.record("ok" if len(products) > page_start else "empty")
+            lease.record("ok" if len(products) > page_start else "empty")
             current_page += 1
-            time.sleep(1)
+            if stop.page_done(products, page_start):
+                break
 
     except Exception as e:
-        logger.error(f"Error during scraping: {e}")
+        logger.error("Error during scraping: %s", e)
     finally:
         driver.quit()
+        lease.release()
         logger.info("Selenium driver closed")
 
-    if products:
-        logger.info("Fetching placeholder images for all products")
-        placeholder_images = fetch_placeholder_images(query)
-        
-        for product in products:
-            if placeholder_images:
-                product["image"] = random.choice(placeholder_images)
-                logger.debug(f"Assigned placeholder image to {product['title']}: {product['image']}")
-            else:
-                product["image"] = ""
-                logger.debug(f"No placeholder image for {product['title']}")
-
-    logger.info(f"Completed scrape, found {len(products)} products")
+    PAGES_SCRAPED.labels("wildberries").observe(pages_scraped)
+    logger.info("Completed scrape, found %s products", len(products))
     return products
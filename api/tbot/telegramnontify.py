@@ -1,6 +1,9 @@
 from fastapi import FastAPI, HTTPException
 from pydantic import BaseModel
 import logging
+import os
+import sys
+import time
 from typing import Optional
 import urllib.parse
 import httpx
@@ -9,15 +12,14 @@ import smtplib
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s | %(levelname)s | %(module)s:%(lineno)d | %(message)s',
-    datefmt='%Y-%m-%d %H:%M:%S',
-    handlers=[
-        logging.StreamHandler(),
-        logging.FileHandler("price_alert.log", encoding="utf-8")
-    ]
-)
+# Запуск файлом (python tbot/telegramnontify.py): пакеты core и parsers лежат в каталоге api
+if not __package__:
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from core.logsetup import setup_logging
+from core.metrics import ALERT_SEND_SECONDS, ALERTS_SENT, metrics_response
+
+setup_logging("price_alert.log", level="INFO")
 logger = logging.getLogger(__name__)
 
 app = FastAPI(title="Price Alert API")
@@ -44,29 +46,29 @@ class PriceAlertResponse(BaseModel):
 
 async def validate_image_url(image_url: str) -> bool:
     """Проверяет доступность URL изображения."""
-    logger.debug(f"Проверка URL изображения: {image_url}")
+    logger.debug("Проверка URL изображения: %s", image_url)
     async with httpx.AsyncClient(timeout=10.0) as client:
         try:
             response = await client.head(image_url, follow_redirects=True)
             response.raise_for_status()
             content_type = response.headers.get("content-type", "")
             if not content_type.startswith("image/"):
-                logger.error(f"URL {image_url} не является изображением: {content_type}")
+                logger.error("URL %s не является изображением: %s", image_url, content_type)
                 return False
-            logger.debug(f"URL изображения валиден: {image_url}")
+            logger.debug("URL изображения валиден: %s", image_url)
             return True
         except httpx.HTTPError as e:
-            logger.error(f"Ошибка проверки URL изображения {image_url}: {str(e)}")
+            logger.error("Ошибка проверки URL изображения %s: %s", image_url, e)
             return False
 
 @retry(
     stop=stop_after_attempt(3),
     wait=wait_fixed(2),
     retry=retry_if_exception_type(httpx.ReadTimeout),
-    before_sleep=lambda retry_state: logger.debug(f"Повторная попытка {retry_state.attempt_number} после таймаута")
+    before_sleep=lambda retry_state: logger.debug("Повторная попытка %s после таймаута", retry_state.attempt_number)
 )
 async def send_to_telegram(chat_id: str, message: str, image_url: str):
-    logger.debug(f"Отправка сообщения в Telegram для chat_id: {chat_id}")
+    logger.debug("Отправка сообщения в Telegram для chat_id: %s", chat_id)
     async with httpx.AsyncClient(timeout=30.0) as client:
         try:
             photo_payload = {
@@ -85,19 +87,19 @@ async def send_to_telegram(chat_id: str, message: str, image_url: str):
             }
             text_response = await client.post(f"{TELEGRAM_API_URL}/sendMessage", json=text_payload)
             text_response.raise_for_status()
-            logger.info(f"Сообщение успешно отправлено в Telegram для chat_id: {chat_id}")
+            logger.info("Сообщение успешно отправлено в Telegram для chat_id: %s", chat_id)
         except httpx.HTTPStatusError as e:
-            logger.error(f"Ошибка HTTP при отправке в Telegram: {e.response.status_code} - {e.response.text}", exc_info=True)
+            logger.error("Ошибка HTTP при отправке в Telegram: %s - %s", e.response.status_code, e.response.text, exc_info=True)
             raise HTTPException(status_code=500, detail=f"Ошибка Telegram API: {e.response.text}")
         except httpx.ReadTimeout as e:
-            logger.error(f"Таймаут при отправке в Telegram: {str(e)}", exc_info=True)
+            logger.error("Таймаут при отправке в Telegram: %s", e, exc_info=True)
             raise
         except Exception as e:
-            logger.error(f"Общая ошибка при отправке в Telegram: {str(e)}", exc_info=True)
+            logger.error("Общая ошибка при отправке в Telegram: %s", e, exc_info=True)
             raise HTTPException(status_code=500, detail=f"Ошибка отправки в Telegram: {str(e)}")
 
 async def send_to_email(recipient_email: str, request: PriceAlertRequest):
-    logger.debug(f"Отправка email на {recipient_email}")
+    logger.debug("Отправка email на %s", recipient_email)
     try:
         email_subject = f"Price Drop Alert for {request.username}"
         email_message = (
@@ -119,15 +121,15 @@ async def send_to_email(recipient_email: str, request: PriceAlertRequest):
             server.login(SENDER_EMAIL, SENDER_PASSWORD)
             server.sendmail(SENDER_EMAIL, recipient_email, msg.as_string())
         
-        logger.info(f"Email успешно отправлен на {recipient_email}")
+        logger.info("Email успешно отправлен на %s", recipient_email)
         return email_message
     except Exception as e:
-        logger.error(f"Ошибка отправки email на {recipient_email}: {str(e)}", exc_info=True)
+        logger.error("Ошибка отправки email на %s: %s", recipient_email, e, exc_info=True)
         raise HTTPException(status_code=500, detail=f"Ошибка отправки email: {str(e)}")
 
 def format_telegram_message(request: PriceAlertRequest) -> str:
     """Формирует отформатированное сообщение для Telegram."""
-    logger.debug(f"Формирование сообщения для username: {request.username}, url: {request.url}")
+    logger.debug("Формирование сообщения для username: %s, url: %s", request.username, request.url)
     
     def escape_markdown(text):
         chars = ['_', '*', '[', ']', '(', ')', '~', '`', '>', '#', '+', '-', '=', '|', '{', '}', '.', '!']
@@ -148,7 +150,7 @@ def format_telegram_message(request: PriceAlertRequest) -> str:
         f"[🔗 Ссылка на товар]({url})"
     )
 
-    logger.debug(f"Сформированное сообщение:\n{message}")
+    logger.debug("Сформированное сообщение:\n%s", message)
     return message
 
 @app.get("/health")
@@ -157,10 +159,14 @@ async def health_check():
     logger.info("Получен запрос на проверку работоспособности")
     return {"status": "healthy", "message": "API is running"}
 
+@app.get("/metrics")
+async def metrics():
+    return metrics_response()
+
 @app.post("/send-telegram-alert", response_model=PriceAlertResponse)
 async def send_telegram_alert(request: PriceAlertRequest):
     """API endpoint для отправки уведомления о снижении цены в Telegram."""
-    logger.info(f"Получен POST запрос на Telegram: username={request.username}, url={request.url}, userid={request.userid}")
+    logger.info("Получен POST запрос на Telegram: username=%s, url=%s, userid=%s", request.username, request.url, request.userid)
 
     if not request.url.startswith(("http://", "https://")):
         logger.error("Некорректный URL: отсутствует схема http(s)")
@@ -171,7 +177,7 @@ async def send_telegram_alert(request: PriceAlertRequest):
         raise HTTPException(status_code=400, detail="URL изображения должен начинаться с http:// или https://")
     
     if request.old_price <= request.new_price:
-        logger.warning(f"Новая цена ({request.new_price}) не меньше старой ({request.old_price})")
+        logger.warning("Новая цена (%s) не меньше старой (%s)", request.new_price, request.old_price)
         raise HTTPException(status_code=400, detail="Новая цена должна быть меньше старой")
     
     if request.old_price < 0 or request.new_price < 0:
@@ -179,26 +185,34 @@ async def send_telegram_alert(request: PriceAlertRequest):
         raise HTTPException(status_code=400, detail="Цены не могут быть отрицательными")
 
     if not await validate_image_url(request.image):
-        logger.error(f"Невалидный или недоступный URL изображения: {request.image}")
+        logger.error("Невалидный или недоступный URL изображения: %s", request.image)
         raise HTTPException(status_code=400, detail="Невалидный или недоступный URL изображения")
 
     try:
         telegram_message = format_telegram_message(request)
-        logger.info(f"Сообщение успешно сформировано для username: {request.username}")
-        
-        await send_to_telegram(request.userid, telegram_message, request.image)
+        logger.info("Сообщение успешно сформировано для username: %s", request.username)
         
+        start_time = time.perf_counter()
+        try:
+            await send_to_telegram(request.userid, telegram_message, request.image)
+        except Exception:
+            ALERTS_SENT.labels("telegram", "error").inc()
+            raise
+        finally:
+            ALERT_SEND_SECONDS.labels("telegram").observe(time.perf_counter() - start_time)
+        ALERTS_SENT.labels("telegram", "sent").inc()
+
         return {
             "message": "Price alert sent to Telegram successfully",
             "telegram_message": telegram_message
         }
     except Exception as e:
-        logger.error(f"Ошибка при отправке в Telegram: {str(e)}", exc_info=True)
+        logger.error("Ошибка при отправке в Telegram: %s", e, exc_info=True)
         raise HTTPException(status_code=500, detail=f"Ошибка при отправке в Telegram: {str(e)}")
 
 @app.post("/send-email-alert", response_model=PriceAlertResponse)
 async def send_email_alert(request: PriceAlertRequest):
-    logger.info(f"Получен POST запрос на email: username={request.username}, url={request.url}, email={request.email}")
+    logger.info("Получен POST запрос на email: username=%s, url=%s, email=%s", request.username, request.url, request.email)
 
     if not request.url.startswith(("http://", "https://")):
         logger.error("Некорректный URL: отсутствует схема http(s)")
@@ -209,7 +223,7 @@ async def send_email_alert(request: PriceAlertRequest):
         raise HTTPException(status_code=400, detail="URL изображения должен начинаться с http:// или https://")
     
     if request.old_price <= request.new_price:
-        logger.warning(f"Новая цена ({request.new_price}) не меньше старой ({request.old_price})")
+        logger.warning("Новая цена (%s) не меньше старой (%s)", request.new_price, request.old_price)
         raise HTTPException(status_code=400, detail="Новая цена должна быть меньше старой")
     
     if request.old_price < 0 or request.new_price < 0:
@@ -217,22 +231,30 @@ async def send_email_alert(request: PriceAlertRequest):
         raise HTTPException(status_code=400, detail="Цены не могут быть отрицательными")
     
     if not "@" in request.email or not "." in request.email:
-        logger.error(f"Некорректный email: {request.email}")
+        logger.error("Некорректный email: %s", request.email)
         raise HTTPException(status_code=400, detail="Некорректный формат email")
         
     if not await validate_image_url(request.image):
-        logger.error(f"Невалидный или недоступный URL изображения: {request.image}")
+        logger.error("Невалидный или недоступный URL изображения: %s", request.image)
         raise HTTPException(status_code=400, detail="Невалидный или недоступный URL изображения")
 
     try:
-        email_message = await send_to_email(request.email, request)
-        
+        start_time = time.perf_counter()
+        try:
+            email_message = await send_to_email(request.email, request)
+        except Exception:
+            ALERTS_SENT.labels("email", "error").inc()
+            raise
+        finally:
+            ALERT_SEND_SECONDS.labels("email").observe(time.perf_counter() - start_time)
+        ALERTS_SENT.labels("email", "sent").inc()
+
         return {
             "message": "Price alert sent to email successfully",
             "email_message": email_message
         }
     except Exception as e:
-        logger.error(f"Ошибка при отправке на email: {str(e)}", exc_info=True)
+        logger.error("Ошибка при отправке на email: %s", e, exc_info=True)
         raise HTTPException(status_code=500, detail=f"Ошибка при отправке на email: {str(e)}")
 
 if __name__ == "__main__":
@@ -1,16 +1,16 @@
-from fastapi import FastAPI, BackgroundTasks
+from fastapi import FastAPI
 from pydantic import BaseModel
 from typing import Optional
 from selenium import webdriver
 from selenium.webdriver.chrome.options import Options
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
 from selenium.common.exceptions import TimeoutException, WebDriverException
 import appwrite
 from appwrite.client import Client
 from appwrite.services.databases import Databases
-from datetime import datetime
+from appwrite.query import Query
+from datetime import datetime, timezone
 import asyncio
 import re
 from contextlib import asynccontextmanager
@@ -18,19 +18,35 @@ import logging
 import requests
 from bs4 import BeautifulSoup
 import json
+import os
+import socket
+import sys
 import time
 import random
 
-
-logging.basicConfig(
-    level=logging.DEBUG,
-    format='%(asctime)s | %(levelname)s | %(module)s:%(lineno)d | %(message)s',
-    datefmt='%Y-%m-%d %H:%M:%S',
-    handlers=[
-        logging.StreamHandler(),
-        logging.FileHandler("price_tracker.log", encoding="utf-8")
-    ]
+# Запуск файлом (python tracker/trackerapi.py): пакеты core и parsers лежат в каталоге api
+if not __package__:
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from core.logsetup import setup_logging
+from parsers.parsers_registry import adapter_for_url
+from core.products import marketplace_for_url
+from core.proxies import BLOCK_STATUSES, PROXY_POOL
+from core.throttle import get_throttle
+from core.cache import TTLCache
+from core.urls import product_key
+from core.resources import apply_resource_policy, record_page_resources
+from core.browser import close_browsers, open_page
+from core.sharding import Shard, get_membership
+from core.refresh import ChangeRate, RefreshPolicy
+from core.metrics import (
+    CHROME_LAUNCH_SECONDS, TIMEOUTS, TITLE_EXTRACTION_SECONDS, TRACKER_REFRESH_INTERVAL_SECONDS,
+    TRACKER_REFRESHES, TRACKER_SHARD_SIZE,
+    metrics_response,
 )
+
+
+setup_logging("price_tracker.log", level="DEBUG")
 logger = logging.getLogger(__name__)
 
 app = FastAPI()
@@ -48,11 +64,48 @@ client.set_project(APPWRITE_PROJECT_ID)
 client.set_key(APPWRITE_API_KEY)
 databases = Databases(client)
 
+# Отслеживаемые товары: ключ товара -> {user_id: ссылка пользователя}.
+# Разные ссылки на один товар (метки, www, слаг) обновляются одним циклом
+TRACKED = {}
+TITLE_INDEX = TTLCache("tracker_titles", ttl=24 * 3600, max_size=10_000)
+
+# Экземпляры трекера делят товары консистентным хешированием ключа товара и проверяют
+# только свою долю. Подписки загружаются из Appwrite, поэтому переживают перезапуск;
+# в памяти экземпляра только товары его доли
+INSTANCE_ID = os.getenv("TRACKER_INSTANCE_ID") or f"{socket.gethostname()}:{os.getpid()}"
+SHARD = Shard(get_membership(databases=databases, database_id=DATABASE_ID), INSTANCE_ID)
+# Интервал проверки у каждого товара свой: по частоте изменения цены, числу подписчиков
+# и близости цены к цели подписчика
+REFRESH_POLICY = RefreshPolicy(
+    min_interval=float(os.getenv("TRACKER_REFRESH_MIN", str(15 * 60))),
+    max_interval=float(os.getenv("TRACKER_REFRESH_MAX", str(24 * 60 * 60))),
+    checks_per_change=float(os.getenv("TRACKER_CHECKS_PER_CHANGE", "10")),
+    proximity=float(os.getenv("TRACKER_TARGET_PROXIMITY", "0.05")),
+    jitter=float(os.getenv("TRACKER_REFRESH_JITTER", "0.1")),
+)
+REFRESH_CONCURRENCY = int(os.getenv("TRACKER_REFRESH_CONCURRENCY", "4"))
+HEARTBEAT_INTERVAL = float(os.getenv("TRACKER_HEARTBEAT_INTERVAL", "15"))
+# Подписки, принятые другими экземплярами, попадают к владельцу при перечитывании
+RELOAD_INTERVAL = float(os.getenv("TRACKER_RELOAD_INTERVAL", "300"))
+SCHEDULER_TICK = 5
+# Документы цен читаются за последние три периода полураспада ChangeRate: более старая
+# история почти не влияет на оценку, а проверяемый товар пишется не реже раза в сутки
+HISTORY_WINDOW = float(os.getenv("TRACKER_HISTORY_DAYS", "21")) * 24 * 60 * 60
+APPWRITE_PAGE_SIZE = 100
+# Ключ товара -> время следующей проверки (time.time())
+NEXT_CHECK = {}
+# Ключ товара -> ChangeRate по истории цен и {user_id: целевая цена}
+HISTORY = {}
+TARGETS = {}
+# $createdAt последнего прочитанного документа: перечитываются только новые записи
+LOADED_UNTIL = None
+
 class ProductRequest(BaseModel):
     url: str
     user_id: str
+    target_price: Optional[float] = None
 
-def setup_selenium():
+def setup_selenium(proxy=None):
     logger.debug("Начало настройки Selenium WebDriver")
     options = Options()
     options.add_argument("--headless")
@@ -73,10 +126,16 @@ def setup_selenium():
     options.add_experimental_option("excludeSwitches", ["enable-automation"])
     options.add_experimental_option('useAutomationExtension', False)
 
+    if proxy:
+        logger.info("Используется прокси: %s", proxy)
+        options.add_argument(f"--proxy-server={proxy}")
+
     try:
         logger.debug("Инициализация Chrome WebDriver")
-        driver = webdriver.Chrome(options=options)
+        with CHROME_LAUNCH_SECONDS.labels("tracker").time():
+            driver = webdriver.Chrome(options=options)
         driver.set_page_load_timeout(30)
+        apply_resource_policy(driver, "product_page")
         logger.debug("Установка скрипта для сокрытия WebDriver")
         driver.execute_cdp_cmd("Page.addScriptToEvaluateOnNewDocument", {
             "source": """
@@ -89,49 +148,52 @@ def setup_selenium():
         logger.info("Selenium успешно инициализирован")
         return driver
     except Exception as e:
-        logger.error(f"Ошибка инициализации Selenium: {str(e)}", exc_info=True)
+        logger.error("Ошибка инициализации Selenium: %s", e, exc_info=True)
         return None
 
 def scroll_page(driver):
     logger.debug("Начало прокрутки страницы")
     try:
         last_height = driver.execute_script("return document.body.scrollHeight")
-        logger.debug(f"Начальная высота страницы: {last_height}")
+        logger.debug("Начальная высота страницы: %s", last_height)
         for i in range(3):
             driver.execute_script("window.scrollBy(0, 1000);")
             time.sleep(random.uniform(0.1, 0.2))
             new_height = driver.execute_script("return document.body.scrollHeight")
-            logger.debug(f"Прокрутка {i+1}, новая высота: {new_height}")
+            logger.debug("Прокрутка %s, новая высота: %s", i+1, new_height)
             if new_height == last_height:
                 logger.debug("Достигнут конец страницы")
                 break
             last_height = new_height
         logger.info("Прокрутка страницы завершена")
     except Exception as e:
-        logger.error(f"Ошибка при прокрутке страницы: {str(e)}", exc_info=True)
+        logger.error("Ошибка при прокрутке страницы: %s", e, exc_info=True)
 
 def clean_title(title):
     if not title:
         logger.debug("Пустое название, возвращается None")
         return None
-    logger.debug(f"Исходное название: {title}")
+    logger.debug("Исходное название: %s", title)
     title = re.sub(r'\s+', ' ', title.strip())
     title = re.sub(r'[-|].*', '', title).strip()
     cleaned = title if title else None
-    logger.debug(f"Очищенное название: {cleaned}")
+    logger.debug("Очищенное название: %s", cleaned)
     return cleaned
 
+@TITLE_EXTRACTION_SECONDS.labels("selenium").time()
 def extract_title_selenium(url: str) -> Optional[str]:
-    logger.info(f"Начало извлечения названия через Selenium для URL: {url}")
-    driver = setup_selenium()
+    logger.info("Начало извлечения названия через Selenium для URL: %s", url)
+    lease = PROXY_POOL.lease(marketplace_for_url(url) or "other")
+    driver = setup_selenium(lease.chrome_arg)
     if not driver:
+        lease.release()
         logger.error("Не удалось инициализировать Selenium")
         return None
     try:
-        logger.debug(f"Попытка загрузки страницы: {url}")
+        logger.debug("Попытка загрузки страницы: %s", url)
         start_time = time.time()
         driver.get(url)
-        logger.debug(f"Время загрузки страницы: {time.time() - start_time:.2f} секунд")
+        logger.debug("Время загрузки страницы: %.2f секунд", time.time() - start_time)
         
         logger.debug("Ожидание полной загрузки страницы")
         WebDriverWait(driver, 15).until(
@@ -139,6 +201,7 @@ def extract_title_selenium(url: str) -> Optional[str]:
         )
         logger.debug("Страница полностью загружена")
         scroll_page(driver)
+        record_page_resources(driver, "tracker", "product_page")
 
         meta_selectors = [
             "meta[property='og:title']",
@@ -148,34 +211,34 @@ def extract_title_selenium(url: str) -> Optional[str]:
         ]
         for selector in meta_selectors:
             try:
-                logger.debug(f"Проверка селектора: {selector}")
+                logger.debug("Проверка селектора: %s", selector)
                 meta = driver.find_element(By.CSS_SELECTOR, selector)
                 title = meta.get_attribute("content")
                 if title:
-                    logger.info(f"Название найдено в {selector}: {title}")
+                    logger.info("Название найдено в %s: %s", selector, title)
                     return clean_title(title)
             except:
-                logger.debug(f"Селектор {selector} не найден")
+                logger.debug("Селектор %s не найден", selector)
                 continue
 
         try:
             logger.debug("Проверка тега <title>")
             title = driver.find_element(By.CSS_SELECTOR, "title").text
             if title:
-                logger.info(f"Название найдено в <title>: {title}")
+                logger.info("Название найдено в <title>: %s", title)
                 return clean_title(title)
         except:
             logger.debug("Тег <title> не найден")
 
         for tag in ["h1", "h2"]:
             try:
-                logger.debug(f"Проверка тега {tag}")
+                logger.debug("Проверка тега %s", tag)
                 header = driver.find_element(By.CSS_SELECTOR, tag).text
                 if header:
-                    logger.info(f"Название найдено в {tag}: {header}")
+                    logger.info("Название найдено в %s: %s", tag, header)
                     return clean_title(header)
             except:
-                logger.debug(f"Тег {tag} не найден")
+                logger.debug("Тег %s не найден", tag)
                 continue
 
         class_selectors = [
@@ -187,13 +250,13 @@ def extract_title_selenium(url: str) -> Optional[str]:
         ]
         for selector in class_selectors:
             try:
-                logger.debug(f"Проверка селектора класса: {selector}")
+                logger.debug("Проверка селектора класса: %s", selector)
                 elem = driver.find_element(By.CSS_SELECTOR, selector).text
                 if elem:
-                    logger.info(f"Название найдено в {selector}: {elem}")
+                    logger.info("Название найдено в %s: %s", selector, elem)
                     return clean_title(elem)
             except:
-                logger.debug(f"Селектор класса {selector} не найден")
+                logger.debug("Селектор класса %s не найден", selector)
                 continue
 
         try:
@@ -202,12 +265,12 @@ def extract_title_selenium(url: str) -> Optional[str]:
             for script in scripts:
                 json_data = json.loads(script.get_attribute("innerHTML"))
                 if isinstance(json_data, dict) and json_data.get("name"):
-                    logger.info(f"Название найдено в JSON-LD: {json_data['name']}")
+                    logger.info("Название найдено в JSON-LD: %s", json_data['name'])
                     return clean_title(json_data["name"])
                 elif isinstance(json_data, list):
                     for item in json_data:
                         if item.get("name"):
-                            logger.info(f"Название найдено в JSON-LD: {item['name']}")
+                            logger.info("Название найдено в JSON-LD: %s", item['name'])
                             return clean_title(item["name"])
         except:
             logger.debug("JSON-LD не найден или невалидный")
@@ -217,21 +280,23 @@ def extract_title_selenium(url: str) -> Optional[str]:
             elem = driver.find_element(By.XPATH, "//*[contains(@class, 'title') or contains(@class, 'name')]")
             title = elem.text
             if title:
-                logger.info(f"Название найдено через XPath: {title}")
+                logger.info("Название найдено через XPath: %s", title)
                 return clean_title(title)
         except:
             logger.debug("XPath не сработал")
 
-        logger.warning(f"Название не найдено через Selenium для URL: {url}")
+        logger.warning("Название не найдено через Selenium для URL: %s", url)
         return None
     except TimeoutException as e:
-        logger.error(f"Таймаут при загрузке страницы {url}: {str(e)}", exc_info=True)
+        TIMEOUTS.labels("tracker", "title_selenium").inc()
+        lease.record("timeout")
+        logger.error("Таймаут при загрузке страницы %s: %s", url, e, exc_info=True)
         return None
     except WebDriverException as e:
-        logger.error(f"Ошибка WebDriver для {url}: {str(e)}", exc_info=True)
+        logger.error("Ошибка WebDriver для %s: %s", url, e, exc_info=True)
         return None
     except Exception as e:
-        logger.error(f"Общая ошибка при извлечении через Selenium: {str(e)}", exc_info=True)
+        logger.error("Общая ошибка при извлечении через Selenium: %s", e, exc_info=True)
         return None
     finally:
         try:
@@ -239,19 +304,24 @@ def extract_title_selenium(url: str) -> Optional[str]:
             driver.quit()
         except:
             logger.error("Ошибка при закрытии Selenium")
+        lease.release()
 
+@TITLE_EXTRACTION_SECONDS.labels("requests").time()
 def extract_title_requests(url: str) -> Optional[str]:
-    logger.info(f"Начало извлечения названия через requests для URL: {url}")
+    logger.info("Начало извлечения названия через requests для URL: %s", url)
     headers = {
         "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 "
                       "(KHTML, like Gecko) Chrome/126.0.0.0 Safari/537.36"
     }
+    lease = PROXY_POOL.lease(marketplace_for_url(url) or "other")
     try:
         logger.debug("Отправка HTTP-запроса")
         start_time = time.time()
-        response = requests.get(url, headers=headers, timeout=15)
+        with lease.timed():
+            response = requests.get(url, headers=headers, timeout=15, proxies=lease.requests_proxies)
         response.raise_for_status()
-        logger.debug(f"Время ответа HTTP: {time.time() - start_time:.2f} секунд")
+        lease.record("ok")
+        logger.debug("Время ответа HTTP: %.2f секунд", time.time() - start_time)
         logger.debug("Страница успешно загружена через requests")
         soup = BeautifulSoup(response.text, "html.parser")
         
@@ -262,27 +332,27 @@ def extract_title_requests(url: str) -> Optional[str]:
             ("meta[itemprop='name']", "content")
         ]
         for selector, attr in meta_tags:
-            logger.debug(f"Проверка мета-тега: {selector}")
+            logger.debug("Проверка мета-тега: %s", selector)
             tag = soup.select_one(selector)
             if tag and tag.get(attr):
-                logger.info(f"Название найдено в {selector}: {tag.get(attr)}")
+                logger.info("Название найдено в %s: %s", selector, tag.get(attr))
                 return clean_title(tag.get(attr))
-            logger.debug(f"Мета-тег {selector} не найден")
+            logger.debug("Мета-тег %s не найден", selector)
 
         logger.debug("Проверка тега <title>")
         title_tag = soup.select_one("title")
         if title_tag and title_tag.text:
-            logger.info(f"Название найдено в <title>: {title_tag.text}")
+            logger.info("Название найдено в <title>: %s", title_tag.text)
             return clean_title(title_tag.text)
         logger.debug("Тег <title> не найден")
 
         for tag in ["h1", "h2"]:
-            logger.debug(f"Проверка тега {tag}")
+            logger.debug("Проверка тега %s", tag)
             header = soup.select_one(tag)
             if header and header.text:
-                logger.info(f"Название найдено в {tag}: {header.text}")
+                logger.info("Название найдено в %s: %s", tag, header.text)
                 return clean_title(header.text)
-            logger.debug(f"Тег {tag} не найден")
+            logger.debug("Тег %s не найден", tag)
 
         class_selectors = [
             "[class*='product-title']",
@@ -292,14 +362,14 @@ def extract_title_requests(url: str) -> Optional[str]:
             "[class*='product-name']"
         ]
         for selector in class_selectors:
-            logger.debug(f"Проверка селектора класса: {selector}")
+            logger.debug("Проверка селектора класса: %s", selector)
             try:
                 elem = soup.select_one(selector)
                 if elem and elem.text:
-                    logger.info(f"Название найдено в {selector}: {elem.text}")
+                    logger.info("Название найдено в %s: %s", selector, elem.text)
                     return clean_title(elem.text)
             except:
-                logger.debug(f"Селектор класса {selector} не найден")
+                logger.debug("Селектор класса %s не найден", selector)
                 continue
 
         logger.debug("Проверка JSON-LD")
@@ -308,96 +378,232 @@ def extract_title_requests(url: str) -> Optional[str]:
             try:
                 json_data = json.loads(script.text)
                 if isinstance(json_data, dict) and json_data.get("name"):
-                    logger.info(f"Название найдено в JSON-LD: {json_data['name']}")
+                    logger.info("Название найдено в JSON-LD: %s", json_data['name'])
                     return clean_title(json_data["name"])
                 elif isinstance(json_data, list):
                     for item in json_data:
                         if item.get("name"):
-                            logger.info(f"Название найдено в JSON-LD: {item['name']}")
+                            logger.info("Название найдено в JSON-LD: %s", item['name'])
                             return clean_title(item["name"])
             except:
                 logger.debug("JSON-LD невалидный или отсутствует")
                 continue
 
-        logger.warning(f"Название не найдено через requests для URL: {url}")
+        logger.warning("Название не найдено через requests для URL: %s", url)
         return None
     except requests.exceptions.Timeout:
-        logger.error(f"Таймаут HTTP-запроса для {url}", exc_info=True)
+        TIMEOUTS.labels("tracker", "title_requests").inc()
+        lease.record("timeout")
+        logger.error("Таймаут HTTP-запроса для %s", url, exc_info=True)
         return None
     except requests.exceptions.RequestException as e:
-        logger.error(f"Ошибка HTTP-запроса для {url}: {str(e)}", exc_info=True)
+        if getattr(e.response, "status_code", None) in BLOCK_STATUSES:
+            lease.record("captcha")
+        logger.error("Ошибка HTTP-запроса для %s: %s", url, e, exc_info=True)
         return None
     except Exception as e:
-        logger.error(f"Общая ошибка при извлечении через requests: {str(e)}", exc_info=True)
+        logger.error("Общая ошибка при извлечении через requests: %s", e, exc_info=True)
         return None
+    finally:
+        lease.release()
 
-def extract_price(url: str) -> Optional[float]:
-    driver = setup_selenium()
-    if not driver:
-        logger.error("Не удалось инициализировать Selenium для извлечения цены")
+async def extract_price(url: str) -> Optional[float]:
+    adapter = adapter_for_url(url)
+    if adapter is None:
+        logger.warning("Unsupported URL: %s", url)
+        return None
+    lease = PROXY_POOL.lease(adapter.name)
+    # Движок задает BROWSER_ENGINE: Selenium в потоке или CDP прямо из event loop
+    page = await open_page("product_page", lease.chrome_arg, setup_selenium)
+    if not page:
+        lease.release()
+        logger.error("Не удалось открыть браузер для извлечения цены")
         return None
+    throttle = get_throttle(adapter.name)
     try:
-        driver.get(url)
-        wait = WebDriverWait(driver, 15)
-        
-        price = None
-        if 'ozon.ru' in url:
-            price_element = wait.until(EC.visibility_of_element_located((By.CSS_SELECTOR, "[data-widget='webPrice'] span")))
-            price = price_element.text
-        elif 'wildberries.ru' in url:
-            price_element = wait.until(EC.visibility_of_element_located((By.CSS_SELECTOR, ".price-block__final-price")))
-            price = price_element.text
-        elif 'megamarket.ru' in url:
-            price_element = wait.until(EC.visibility_of_element_located((By.CSS_SELECTOR, ".pdp-price__current")))
-            price = price_element.text
-        else:
-            logger.warning(f"Unsupported URL: {url}")
-            return None
+        async with throttle.navigation_async():
+            with lease.timed():
+                await page.goto(url)
+        await page.record_resources("tracker", "product_page")
+        await page.wait_for_selector(adapter.price_selector, timeout=15, visible=True)
+        price = await page.text(adapter.price_selector)
 
         price = re.sub(r'[^\d]', '', price) if price else None
+        throttle.record("ok" if price else "empty")
+        lease.record("ok" if price else "empty")
         if price:
-            logger.info(f"Extracted price {price} for URL: {url}")
+            logger.info("Extracted price %s for URL: %s", price, url)
         return float(price) if price else None
-    
+
+    except TimeoutError as e:
+        TIMEOUTS.labels("tracker", "price").inc()
+        throttle.record("timeout")
+        lease.record("timeout")
+        logger.error("Таймаут ожидания цены для URL %s: %s", url, e)
+        return None
     except Exception as e:
-        logger.error(f"Error extracting price for URL {url}: {e}", exc_info=True)
+        logger.error("Error extracting price for URL %s: %s", url, e, exc_info=True)
         return None
     finally:
-        try:
-            driver.quit()
-        except:
-            logger.error("Ошибка при закрытии Selenium при извлечении цены")
+        await page.close()
+        lease.release()
+
+def extract_title(url: str) -> Optional[str]:
+    key = product_key(url)
+    title = TITLE_INDEX.get(key)
+    if title:
+        return title
+    title = extract_title_requests(url)
+    if not title:
+        logger.debug("Название не найдено через requests, пробуем Selenium")
+        title = extract_title_selenium(url)
+    if title:
+        TITLE_INDEX.put(key, title)
+    return title
 
-async def update_price_periodically(url: str, user_id: str):
+def save_price(user_id: str, url: str, price: float, title: Optional[str], current_time: datetime,
+               target_price: Optional[float] = None):
+    document = {
+        'user_id': user_id,
+        'url': url,
+        'date': current_time.strftime('%Y-%m-%d'),
+        'time': current_time.strftime('%H:%M:%S'),
+        'price': price,
+        'title': title or ''
+    }
+    if target_price is not None:
+        document['target_price'] = target_price
+    databases.create_document(
+        database_id=DATABASE_ID,
+        collection_id=COLLECTION_ID,
+        document_id='unique()',
+        data=document
+    )
+
+def next_interval(key: str) -> float:
+    history = HISTORY.setdefault(key, ChangeRate())
+    return REFRESH_POLICY.interval(history.rate, len(TRACKED.get(key, ())), history.last_price,
+                                   TARGETS.get(key, {}).values())
+
+async def refresh_product(key: str, slots: asyncio.Semaphore):
+    interval = next_interval(key)
+    NEXT_CHECK[key] = time.time() + interval
+    subscribers = TRACKED.get(key)
+    if not subscribers:
+        return
+    async with slots:
+        # Цену и название загружаем один раз на товар, документ пишем каждому подписчику
+        url = next(iter(subscribers.values()))
+        price = await extract_price(url)
+        title = await asyncio.to_thread(extract_title, url)
+    TRACKER_REFRESHES.labels("ok" if price else "empty").inc()
+    if price:
+        HISTORY.setdefault(key, ChangeRate()).observe(price, time.time())
+        interval = next_interval(key)
+        NEXT_CHECK[key] = time.time() + interval
+    TRACKER_REFRESH_INTERVAL_SECONDS.observe(interval)
+    if not price:
+        return
+    current_time = datetime.now()
+    targets = TARGETS.get(key, {})
+    for user_id, user_url in list(subscribers.items()):
+        try:
+            await asyncio.to_thread(save_price, user_id, user_url, price, title, current_time, targets.get(user_id))
+            logger.info("Price updated for URL: %s, user_id: %s, price: %s, title: %s, time: %s", user_url, user_id, price, title, current_time)
+        except Exception as e:
+            logger.error("Error saving to Appwrite for URL %s, user_id: %s: %s", user_url, user_id, e, exc_info=True)
+
+def load_documents(since: Optional[str] = None):
+    """Документы цен из Appwrite в порядке создания, начиная с $createdAt = since."""
+    documents = []
+    cursor = None
     while True:
-        price = extract_price(url)
-        title = extract_title_requests(url)
-        if not title:
-            logger.debug("Название не найдено через requests, пробуем Selenium")
-            title = extract_title_selenium(url)
-        
-        if price:
-            current_time = datetime.now()
-            document = {
-                'user_id': user_id,
-                'url': url,
-                'date': current_time.strftime('%Y-%m-%d'),
-                'time': current_time.strftime('%H:%M:%S'),
-                'price': price,
-                'title': title or ''
-            }
-            try:
-                databases.create_document(
-                    database_id=DATABASE_ID,
-                    collection_id=COLLECTION_ID,
-                    document_id='unique()',
-                    data=document
-                )
-                logger.info(f"Price updated for URL: {url}, user_id: {user_id}, price: {price}, title: {title}, time: {current_time}")
-            except Exception as e:
-                logger.error(f"Error saving to Appwrite for URL {url}, user_id: {user_id}: {e}", exc_info=True)
-        
-        await asyncio.sleep(1 * 60 * 60)
+        queries = [Query.order_asc("$createdAt"), Query.limit(APPWRITE_PAGE_SIZE)]
+        if since:
+            queries.append(Query.greater_than_equal("$createdAt", since))
+        if cursor:
+            queries.append(Query.cursor_after(cursor))
+        page = databases.list_documents(
+            database_id=DATABASE_ID, collection_id=COLLECTION_ID, queries=queries
+        )["documents"]
+        documents.extend(page)
+        if len(page) < APPWRITE_PAGE_SIZE:
+            return documents
+        cursor = page[-1]["$id"]
+
+def schedule(key: str, checked_at: float):
+    due = checked_at + next_interval(key)
+    if key not in NEXT_CHECK and due < time.time():
+        # Просроченные за время простоя товары проверяем не разом, а в течение RELOAD_INTERVAL
+        due = time.time() + random.uniform(0, RELOAD_INTERVAL)
+    NEXT_CHECK[key] = due
+
+def update_shard_size():
+    TRACKER_SHARD_SIZE.set(len(TRACKED))
+
+def drop_foreign_keys():
+    """Забывает товары, которые после перестройки кольца проверяет другой экземпляр."""
+    for key in [key for key in TRACKED if not SHARD.owns(key)]:
+        for state in (TRACKED, NEXT_CHECK, HISTORY, TARGETS):
+            state.pop(key, None)
+
+async def reload_tracked():
+    """Подписки, цели и история цен своей доли из документов Appwrite, записанных после
+    прошлого чтения, а при первом чтении - за HISTORY_WINDOW."""
+    global LOADED_UNTIL
+    since = LOADED_UNTIL or datetime.fromtimestamp(time.time() - HISTORY_WINDOW, timezone.utc).isoformat()
+    try:
+        documents = await asyncio.to_thread(load_documents, since)
+    except Exception as e:
+        logger.error("Не удалось загрузить отслеживаемые товары из Appwrite: %s", e, exc_info=True)
+        return
+    checked = {}
+    for document in documents:
+        key = product_key(document["url"])
+        if not SHARD.owns(key):
+            continue
+        TRACKED.setdefault(key, {})[document["user_id"]] = document["url"]
+        if document.get("target_price"):
+            TARGETS.setdefault(key, {})[document["user_id"]] = document["target_price"]
+        created_at = datetime.fromisoformat(document["$createdAt"]).timestamp()
+        HISTORY.setdefault(key, ChangeRate()).observe(document["price"], created_at)
+        checked[key] = max(checked.get(key, 0), created_at)
+    if documents:
+        LOADED_UNTIL = documents[-1]["$createdAt"]
+    for key, checked_at in checked.items():
+        # Расписание уже известных товаров ведет сам экземпляр
+        if key not in NEXT_CHECK:
+            schedule(key, checked_at)
+    update_shard_size()
+    logger.info("Отслеживаемых товаров в доле экземпляра %s: %s", INSTANCE_ID, len(TRACKED))
+
+async def maintain_shard():
+    """Отметка в реестре экземпляров и периодическое перечитывание подписок."""
+    global LOADED_UNTIL
+    last_reload = time.monotonic()
+    while True:
+        await asyncio.sleep(HEARTBEAT_INTERVAL)
+        if await asyncio.to_thread(SHARD.refresh):
+            # Доля изменилась: чужие товары забываем, полученные читаем за HISTORY_WINDOW
+            drop_foreign_keys()
+            LOADED_UNTIL = None
+            last_reload = time.monotonic()
+            await reload_tracked()
+        elif time.monotonic() - last_reload >= RELOAD_INTERVAL:
+            last_reload = time.monotonic()
+            await reload_tracked()
+
+async def run_scheduler():
+    """Запускает проверку товаров своей доли, у которых подошло время NEXT_CHECK."""
+    slots = asyncio.Semaphore(REFRESH_CONCURRENCY)
+    running = {}
+    while True:
+        now = time.time()
+        for key, due in list(NEXT_CHECK.items()):
+            if due <= now and key not in running and SHARD.owns(key):
+                running[key] = asyncio.create_task(refresh_product(key, slots))
+                running[key].add_done_callback(lambda task, key=key: running.pop(key, None))
+        await asyncio.sleep(SCHEDULER_TICK)
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
@@ -454,27 +660,48 @@ async def lifespan(app: FastAPI):
                 size=500,
                 required=False
             )
+        if 'target_price' not in existing_attributes:
+            databases.create_float_attribute(
+                database_id=DATABASE_ID,
+                collection_id=COLLECTION_ID,
+                key="target_price",
+                required=False
+            )
         logger.info("Collection attributes verified for products-track")
     except Exception as e:
-        logger.error(f"Error setting up collection attributes: {e}", exc_info=True)
+        logger.error("Error setting up collection attributes: %s", e, exc_info=True)
+    try:
+        await asyncio.to_thread(SHARD.membership.setup)
+    except Exception as e:
+        logger.error("Не удалось подготовить реестр экземпляров трекера: %s", e, exc_info=True)
+
+    await asyncio.to_thread(SHARD.refresh)
+    await reload_tracked()
+    scheduler = [asyncio.create_task(maintain_shard()), asyncio.create_task(run_scheduler())]
 
     yield
     logger.info("Shutting down...")
+    for task in scheduler:
+        task.cancel()
+    await asyncio.gather(*scheduler, return_exceptions=True)
+    await asyncio.to_thread(SHARD.leave)
+    await close_browsers()
+
+app.router.lifespan_context = lifespan
 
-app.lifespan = lifespan
+@app.get("/metrics")
+async def metrics():
+    return metrics_response()
 
 @app.post("/track-price")
-async def track_price(request: ProductRequest, background_tasks: BackgroundTasks):
-    price = extract_price(request.url)
+async def track_price(request: ProductRequest):
+    price = await extract_price(request.url)
     if not price:
-        logger.warning(f"Failed to extract price for URL: {request.url}")
+        logger.warning("Failed to extract price for URL: %s", request.url)
         return {"error": "Could not extract price"}
 
-    title = extract_title_requests(request.url)
-    if not title:
-        logger.debug("Название не найдено через requests, пробуем Selenium")
-        title = extract_title_selenium(request.url)
-    logger.debug(f"Title extracted for URL: {request.url}: {title}")
+    title = await asyncio.to_thread(extract_title, request.url)
+    logger.debug("Title extracted for URL: %s: %s", request.url, title)
 
     current_time = datetime.now()
     document = {
@@ -485,6 +712,8 @@ async def track_price(request: ProductRequest, background_tasks: BackgroundTasks
         'price': price,
         'title': title or '' 
     }
+    if request.target_price is not None:
+        document['target_price'] = request.target_price
 
     try:
         databases.create_document(
@@ -493,13 +722,25 @@ async def track_price(request: ProductRequest, background_tasks: BackgroundTasks
             document_id='unique()',
             data=document
         )
-        logger.info(f"Initial price saved for URL: {request.url}, user_id: {request.user_id}, price: {price}, title: {title}")
+        logger.info("Initial price saved for URL: %s, user_id: %s, price: %s, title: %s", request.url, request.user_id, price, title)
         
-        background_tasks.add_task(update_price_periodically, request.url, request.user_id)
+        key = product_key(request.url)
+        if not SHARD.owns(key):
+            # Владелец получит подписку при следующем чтении документов из Appwrite
+            logger.info("Товар %s проверяет экземпляр %s", key, SHARD.ring.node_for(key))
+        else:
+            if key in TRACKED:
+                logger.info("Товар %s уже отслеживается, пользователь %s добавлен к подписчикам", key, request.user_id)
+            TRACKED.setdefault(key, {})[request.user_id] = request.url
+            if request.target_price is not None:
+                TARGETS.setdefault(key, {})[request.user_id] = request.target_price
+            HISTORY.setdefault(key, ChangeRate()).observe(price, time.time())
+            schedule(key, time.time())
+            update_shard_size()
         
         return {"message": "Price tracking started", "initial_price": price, "title": title}
     except Exception as e:
-        logger.error(f"Failed to save initial data for URL: {request.url}, user_id: {request.user_id}: {e}", exc_info=True)
+        logger.error("Failed to save initial data for URL: %s, user_id: %s: %s", request.url, request.user_id, e, exc_info=True)
         return {"error": f"Failed to save data: {str(e)}"}
 
 if __name__ == "__main__":
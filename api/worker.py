@@ -0,0 +1,102 @@
+"""Воркер парсинга: берет из брокера задачи (маркетплейс, запрос, страница) и запускает парсеры.
+
+Запуск из каталога api, на любом числе машин с доступом к брокеру:
+    BROKER_URL=sqlite:///broker.sqlite3 python worker.py --threads 2 --metrics-port 9101
+
+API ставит задачи в брокер при SCRAPE_BACKEND=broker.
+"""
+import argparse
+import logging
+import os
+import signal
+import socket
+import threading
+
+from prometheus_client import start_http_server
+
+from core.broker import POLL_INTERVAL, Broker, ScrapeTask, get_broker
+from core.logsetup import setup_logging
+from parsers.parsers_registry import ADAPTERS
+
+logger = logging.getLogger(__name__)
+
+# Как часто удалять из брокера задачи, результат которых так и не забрали
+PURGE_INTERVAL = 60
+
+
+def run_task(broker: Broker, task: ScrapeTask):
+    adapter = ADAPTERS.get(task.marketplace)
+    if adapter is None:
+        broker.fail(task.id, f"Неизвестный маркетплейс {task.marketplace}")
+        return
+    try:
+        products = adapter.scrape(task.query, limit=task.limit, page=task.page)
+    except Exception as e:
+        logger.error("Ошибка парсера %s в задаче %s: %s", task.marketplace, task.id, e, exc_info=True)
+        broker.fail(task.id, str(e))
+        return
+    broker.complete(task.id, products)
+    logger.info("Задача %s: %s, страница %s, товаров %s", task.id, task.marketplace, task.page, len(products))
+
+
+def work(broker: Broker, worker_id: str, stopping: threading.Event):
+    while not stopping.is_set():
+        try:
+            task = broker.claim(worker_id)
+        except Exception as e:
+            logger.error("Брокер недоступен: %s", e)
+            stopping.wait(5)
+            continue
+        if task is None:
+            stopping.wait(POLL_INTERVAL)
+            continue
+        logger.info("Задача %s: %s «%s», страница %s, попытка %s",
+                    task.id, task.marketplace, task.query, task.page, task.attempts)
+        run_task(broker, task)
+
+
+def purge(broker: Broker):
+    try:
+        purged = broker.purge()
+    except Exception as e:
+        logger.error("Не удалось очистить брокер: %s", e)
+        return
+    if purged:
+        logger.info("Удалено устаревших задач: %s", purged)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--broker", default=os.getenv("BROKER_URL"), help="по умолчанию BROKER_URL")
+    parser.add_argument("--threads", type=int, default=int(os.getenv("WORKER_THREADS", "1")),
+                        help="сколько задач (браузеров) выполнять одновременно")
+    parser.add_argument("--metrics-port", type=int, help="порт /metrics для Prometheus")
+    args = parser.parse_args(argv)
+
+    setup_logging("worker.log", level="INFO")
+    broker = get_broker(args.broker)
+    if args.metrics_port:
+        start_http_server(args.metrics_port)
+
+    stopping = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stopping.set())
+    name = f"{socket.gethostname()}:{os.getpid()}"
+    threads = [
+        threading.Thread(target=work, args=(broker, f"{name}:{i}", stopping), name=f"worker-{i}")
+        for i in range(args.threads)
+    ]
+    for thread in threads:
+        thread.start()
+    logger.info("Воркер %s запущен, потоков: %s", name, args.threads)
+    try:
+        while not stopping.wait(PURGE_INTERVAL):
+            purge(broker)
+    except KeyboardInterrupt:
+        stopping.set()
+    logger.info("Остановка: ждем завершения текущих задач")
+    for thread in threads:
+        thread.join()
+
+
+if __name__ == "__main__":
+    main()
@@ -7,7 +7,6 @@ interface Product {
 	link: string
 	article: string | null
 	image?: string
-	index?: number
 }
 
 interface ProductsState {
@@ -42,7 +41,7 @@ export const useProductsStore = defineStore('products', {
 				price: product.price,
 				link: product.link,
 				article: product.article,
-				index: product.index
+				image: product.image
 			}))
 		},
 